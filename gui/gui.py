@@ -1,54 +1,112 @@
-import base64
+import hashlib
 import os
-import sys
+import queue
 import requests
-import subprocess
+import struct
+import tempfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from xml.sax.saxutils import escape
 
 from PIL import ImageTk
 from PIL import Image as PILImage
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, HRFlowable, Image as ReportLabImage
+from reportlab.platypus import (SimpleDocTemplate, Paragraph, HRFlowable, PageBreak, Table, TableStyle,
+                                Image as ReportLabImage)
 import tkinter as tk
 from tkinter import filedialog, ttk, PhotoImage
 
 WINDOW_WIDTH = 800
 WINDOW_HEIGHT = 700
 ORGAN_CHOICES = ["Kidney", "Chest"]
+SERVER_URL = os.environ.get("DIAGNOSIS_SERVER_URL", "http://localhost:8000")
+REQUEST_TIMEOUT = (3.05, 60)
+POLL_INTERVAL_MS = 50
+BATCH_WORKERS = 4
+PREVIEW_SIZE = (200, 200)
+PREVIEW_CACHE_SIZE = 32
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+THUMBNAIL_CACHE_DIR = os.environ.get("THUMBNAIL_CACHE_DIR", ".thumbnail_cache")
+REPORT_IMAGE_POINTS = 400
+REPORT_IMAGE_PIXELS = 800
+REPORT_JPEG_QUALITY = 85
+# Must match MODEL_INPUT_SIZE, REDUCING_GAP and the wire format of prediction/prediction.py, checked by
+# prediction/tests/test_client_preprocessing.py
+CLIENT_RESIZE = os.environ.get("CLIENT_RESIZE", "1") != "0"
+MODEL_INPUT_SIZE = (150, 150)
+REDUCING_GAP = 3.0
+PREPROCESSED_MAGIC = b'CTPX\x01'
+PREPROCESSED_HEADER = struct.Struct('>5sBHH')
 
 file_path = ""
 selected_organ = ""
 image_label = None
+current_analysis = None
+current_batch = None
+preview_cache = OrderedDict()
+organ_variable = None
 
 
-def restart_program():
+def create_session(retries=3, pool_size=4):
     """
-    Restart the program
+    Create an HTTP session reusing connections to the server
 
-    """
-    window.withdraw()
-    python = sys.executable
-    subprocess.Popen([python] + sys.argv)
-
-
-def encode_image(image_path):
-    """Function for encoding images to base64.
+    Requests failing to connect, or answered with 502, 503 or 504, are retried
+    with exponential backoff, honouring the server's Retry-After header.
+    Requests whose answer fails or times out are not retried, since the
+    server may still be processing them.
 
     Parameters
     ----------
-    image_path:
-        Path of the image to be encoded.
+    retries : int
+        Number of retries of a failed request
+    pool_size : int
+        Number of connections kept open to the server
 
     Returns
     -------
-    image_str: str
-        Base64 encoded image.
+    session : requests.Session
+        Session used for all requests to the server
+    """
+    retry = Retry(
+        total=retries,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"}),
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    http_session = requests.Session()
+    http_session.mount("http://", adapter)
+    http_session.mount("https://", adapter)
+    return http_session
+
+
+session = create_session(pool_size=BATCH_WORKERS)
+executor = ThreadPoolExecutor(max_workers=2)
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+
+
+def back_to_menu():
+    """
+    Cancel running analyses and show the menu again, without
+    restarting the program
+
     """
-    image = open(image_path, 'rb')
-    image_bytes = image.read()
-    image_b64 = base64.b64encode(image_bytes)
-    image_str = image_b64.decode('utf-8')
-    return image_str
+    global file_path, image_label, current_analysis
+    if current_analysis is not None:
+        current_analysis.cancel()
+        current_analysis = None
+    cancel_batch()
+    file_path = ""
+    image_label = None
+    clear_window()
+    build_menu()
 
 
 def upload_image():
@@ -86,10 +144,60 @@ def display_uploaded_image():
     btn_upload_img.config(state=tk.DISABLED)
 
 
+def resize_for_model(image_path):
+    """
+    Resize an image to the model's input size exactly like the
+    server's prediction.resize_for_model does
+
+    Parameters
+    ----------
+    image_path : str
+        Path to the image file
+
+    Returns
+    -------
+    image : PIL.Image.Image
+        Resized image, in mode 'L' or 'RGB'
+    """
+    with PILImage.open(image_path) as image:
+        if image.format == 'JPEG':
+            image.draft(image.mode, (int(MODEL_INPUT_SIZE[0] * REDUCING_GAP), int(MODEL_INPUT_SIZE[1] * REDUCING_GAP)))
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        return image.resize(MODEL_INPUT_SIZE, PILImage.BICUBIC, reducing_gap=REDUCING_GAP)
+
+
+def encode_preprocessed(image_path):
+    """
+    Resize an image on the client and encode it in the compact format
+    the server uses without decoding or resizing it again
+
+    Parameters
+    ----------
+    image_path : str
+        Path to the image file
+
+    Returns
+    -------
+    payload : bytes
+        Header with the number of channels and the size of the image,
+        followed by its zlib compressed pixels
+    """
+    image = resize_for_model(image_path)
+    channels = 1 if image.mode == 'L' else 3
+    header = PREPROCESSED_HEADER.pack(PREPROCESSED_MAGIC, channels, image.width, image.height)
+    return header + zlib.compress(image.tobytes(), 6)
+
+
 def send_analyze_request(file_path, selected_organ):
     """
     Send image to server for analysis
 
+    The image is sent as raw bytes through the pooled session, so it
+    is neither base64 encoded nor sent over a new connection. With
+    CLIENT_RESIZE, the image is resized on the client and only the
+    pixels the model needs are sent, see encode_preprocessed.
+
     Parameters
     ----------
     file_path : str
@@ -102,77 +210,71 @@ def send_analyze_request(file_path, selected_organ):
     diagnosis : dict
         Dictionary containing the diagnosis and confidence
     """
-    encoded_image = encode_image(file_path)
+    if CLIENT_RESIZE:
+        image_bytes = encode_preprocessed(file_path)
+    else:
+        with open(file_path, 'rb') as image:
+            image_bytes = image.read()
 
-    url = "http://localhost:8000"
+    url = SERVER_URL
 
     if selected_organ == "Kidney":
-        url += "/kidney"
+        url += "/kidney/upload"
     elif selected_organ == "Chest":
-        url += "/chest"
+        url += "/chest/upload"
 
-    payload = {"image": encoded_image}
-
-    response = requests.post(url, json=payload)
+    response = session.post(
+        url,
+        data=image_bytes,
+        headers={"Content-Type": "application/octet-stream"},
+        timeout=REQUEST_TIMEOUT
+    )
+    response.raise_for_status()
 
     diagnosis = response.json()
 
     return diagnosis
 
 
-def show_diagnosis_window():
+def clear_window():
     """
-    Display diagnosis with the diagnosis and confidence, also
-    display buttons for generating a PDF report, going back to
-    the menu and exiting the program.
+    Remove every widget but the background from the window
 
     """
-    global file_path
+    for widget in window.winfo_children():
+        if widget != background_label:
+            widget.destroy()
 
-    if file_path:
-        for widget in window.winfo_children():
-            if widget != background_label:
-                widget.destroy()
 
-        result = send_analyze_request(file_path, selected_organ)
-        diagnosis = result["diagnosis"]
-        confidence = result["confidence"]
+def show_diagnosis_window():
+    """
+    Start the analysis of the uploaded image on a background thread and
+    display a progress bar with a button cancelling the analysis. The
+    result is displayed by show_diagnosis_result once it arrives.
 
-        diagnosis_label = tk.Label(
-            window,
-            text=f"Diagnosis: {diagnosis}\nProbability: {confidence * 100: .2f}%",
-            font=("Calibri", 20),
-            fg="black",
-            height=3,
-            width=30,
-            bd=2,
-            relief="solid"
-        )
-        diagnosis_label.config(state=tk.DISABLED)
-        diagnosis_label.pack(pady=20)
+    """
+    global current_analysis
+
+    if file_path:
+        clear_window()
 
-        btn_generate_pdf = tk.Button(
+        progress_label = tk.Label(
             window,
-            text="GENERATE PDF \U0001F4C4",
-            command=lambda: create_diagnosis_pdf(file_path, diagnosis, confidence),
+            text="Analyzing image...",
             font=("Calibri", 20),
-            bg="black",
             fg="white",
-            activeforeground="white",
-            activebackground='black',
-            bd=5,
-            padx=10,
-            pady=5,
-            compound='bottom',
-            width=15,
-            height=2
+            bg="black"
         )
-        btn_generate_pdf.pack(pady=10)
+        progress_label.pack(pady=20)
+
+        progress_bar = ttk.Progressbar(window, mode="indeterminate", length=300)
+        progress_bar.pack(pady=10)
+        progress_bar.start(10)
 
-        btn_back = tk.Button(
+        btn_cancel = tk.Button(
             window,
-            text="BACK TO MENU \U0001F519",
-            command=restart_program,
+            text="CANCEL \u274C",
+            command=cancel_analysis,
             font=("Calibri", 20),
             bg="black",
             fg="white",
@@ -185,25 +287,466 @@ def show_diagnosis_window():
             width=15,
             height=2
         )
-        btn_back.pack(pady=10)
+        btn_cancel.pack(pady=10)
 
-        btn_exit = tk.Button(
-            window,
-            text="EXIT \U0001F6AA",
-            command=window.quit,
-            font=("Calibri", 15),
-            bg="black",
-            fg="white",
-            activeforeground="white",
-            activebackground='black',
-            bd=5,
-            padx=10,
-            pady=5,
-            compound='bottom',
-            width=15,
-            height=2
-        )
-        btn_exit.pack(side=tk.BOTTOM, pady=10)
+        current_analysis = executor.submit(send_analyze_request, file_path, selected_organ)
+        window.after(POLL_INTERVAL_MS, poll_analysis, current_analysis)
+
+
+def poll_analysis(analysis):
+    """
+    Check on the Tk event loop whether the background analysis finished,
+    and display its result if it did. An image that cannot be read or
+    resized on the client is reported like a failed request
+
+    Parameters
+    ----------
+    analysis : concurrent.futures.Future
+        Running analysis
+
+    """
+    if analysis is not current_analysis:
+        return
+    if not analysis.done():
+        window.after(POLL_INTERVAL_MS, poll_analysis, analysis)
+        return
+
+    try:
+        result = analysis.result()
+    except (requests.RequestException, OSError, ValueError, PILImage.DecompressionBombError) as error:
+        show_analysis_error(error)
+        return
+    show_diagnosis_result(result["diagnosis"], result["confidence"])
+
+
+def cancel_analysis():
+    """
+    Cancel the running analysis and go back to the menu, a result
+    arriving later is ignored
+
+    """
+    back_to_menu()
+
+
+def show_analysis_error(error):
+    """
+    Display why the analysis failed, with a button going back to the menu
+
+    Parameters
+    ----------
+    error : Exception
+        Error raised by the analysis
+
+    """
+    clear_window()
+
+    error_label = tk.Label(
+        window,
+        text=f"Analysis failed:\n{error}",
+        font=("Calibri", 15),
+        fg="black",
+        wraplength=600,
+        bd=2,
+        relief="solid"
+    )
+    error_label.pack(pady=20)
+
+    btn_back = tk.Button(
+        window,
+        text="BACK TO MENU \U0001F519",
+        command=back_to_menu,
+        font=("Calibri", 20),
+        bg="black",
+        fg="white",
+        activeforeground="white",
+        activebackground='black',
+        bd=5,
+        padx=10,
+        pady=5,
+        compound='bottom',
+        width=15,
+        height=2
+    )
+    btn_back.pack(pady=10)
+
+
+def show_diagnosis_result(diagnosis, confidence):
+    """
+    Display diagnosis with the diagnosis and confidence, also
+    display buttons for generating a PDF report, going back to
+    the menu and exiting the program.
+
+    Parameters
+    ----------
+    diagnosis : str
+        Diagnosis of the image
+    confidence : float
+        Confidence of the diagnosis
+
+    """
+    clear_window()
+
+    diagnosis_label = tk.Label(
+        window,
+        text=f"Diagnosis: {diagnosis}\nProbability: {confidence * 100: .2f}%",
+        font=("Calibri", 20),
+        fg="black",
+        height=3,
+        width=30,
+        bd=2,
+        relief="solid"
+    )
+    diagnosis_label.config(state=tk.DISABLED)
+    diagnosis_label.pack(pady=20)
+
+    btn_generate_pdf = tk.Button(
+        window,
+        text="GENERATE PDF \U0001F4C4",
+        command=lambda: generate_report(
+            create_diagnosis_pdf, file_path, diagnosis, confidence, selected_organ
+        ),
+        font=("Calibri", 20),
+        bg="black",
+        fg="white",
+        activeforeground="white",
+        activebackground='black',
+        bd=5,
+        padx=10,
+        pady=5,
+        compound='bottom',
+        width=15,
+        height=2
+    )
+    btn_generate_pdf.pack(pady=10)
+
+    btn_back = tk.Button(
+        window,
+        text="BACK TO MENU \U0001F519",
+        command=back_to_menu,
+        font=("Calibri", 20),
+        bg="black",
+        fg="white",
+        activeforeground="white",
+        activebackground='black',
+        bd=5,
+        padx=10,
+        pady=5,
+        compound='bottom',
+        width=15,
+        height=2
+    )
+    btn_back.pack(pady=10)
+
+    btn_exit = tk.Button(
+        window,
+        text="EXIT \U0001F6AA",
+        command=window.quit,
+        font=("Calibri", 15),
+        bg="black",
+        fg="white",
+        activeforeground="white",
+        activebackground='black',
+        bd=5,
+        padx=10,
+        pady=5,
+        compound='bottom',
+        width=15,
+        height=2
+    )
+    btn_exit.pack(side=tk.BOTTOM, pady=10)
+
+
+def list_study_images(folder):
+    """
+    List image files of a study folder and its subfolders
+
+    Parameters
+    ----------
+    folder : str
+        Path to the study folder
+
+    Returns
+    -------
+    paths : list of str
+        Sorted paths to the image files
+    """
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(folder)
+        for name in names
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def upload_folder():
+    """
+    Select a study folder and analyse all of its images
+
+    """
+    folder = filedialog.askdirectory(title=f"Select {selected_organ} Study Folder")
+
+    if folder:
+        paths = list_study_images(folder)
+        if paths:
+            show_batch_window(folder, paths)
+
+
+def show_batch_window(folder, paths):
+    """
+    Display a results table for the images of a study folder and
+    upload the images through a bounded pool of worker threads.
+    Rows are filled on the Tk event loop as answers come in, the
+    preview of an image is loaded only when its row is selected.
+
+    Parameters
+    ----------
+    folder : str
+        Path to the study folder
+    paths : list of str
+        Paths to the image files
+
+    """
+    global current_batch
+
+    cancel_batch()
+    clear_window()
+
+    title_label = tk.Label(
+        window,
+        text=f"{selected_organ} Study: {os.path.basename(folder)}",
+        font=("Calibri", 20),
+        fg="white",
+        bg="black"
+    )
+    title_label.pack(pady=10)
+
+    table_frame = tk.Frame(window, bg="black")
+    table_frame.pack(padx=20, pady=5, fill=tk.X)
+
+    results_table = ttk.Treeview(
+        table_frame,
+        columns=("file", "diagnosis", "confidence", "status"),
+        show="headings",
+        height=8
+    )
+    for column, width in (("file", 320), ("diagnosis", 150), ("confidence", 100), ("status", 120)):
+        results_table.heading(column, text=column.capitalize())
+        results_table.column(column, width=width, anchor=tk.W)
+    scrollbar = ttk.Scrollbar(table_frame, orient=tk.VERTICAL, command=results_table.yview)
+    results_table.configure(yscrollcommand=scrollbar.set)
+    results_table.pack(side=tk.LEFT, fill=tk.X, expand=True)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    for index, path in enumerate(paths):
+        results_table.insert("", tk.END, iid=str(index), values=(os.path.relpath(path, folder), "", "", "queued"))
+
+    progress_bar = ttk.Progressbar(window, mode="determinate", length=600, maximum=len(paths))
+    progress_bar.pack(pady=5)
+    progress_label = tk.Label(window, text=f"0 / {len(paths)}", font=("Calibri", 12), fg="white", bg="black")
+    progress_label.pack()
+
+    preview_label = tk.Label(window, background="#050505")
+    preview_label.pack(pady=5)
+    results_table.bind("<<TreeviewSelect>>", lambda event: show_preview(results_table, preview_label))
+
+    btn_back = tk.Button(
+        window,
+        text="BACK TO MENU \U0001F519",
+        command=back_to_menu,
+        font=("Calibri", 15),
+        bg="black",
+        fg="white",
+        activeforeground="white",
+        activebackground='black',
+        bd=5,
+        padx=10,
+        pady=5,
+        compound='bottom',
+        width=15
+    )
+    btn_back.pack(side=tk.BOTTOM, pady=10)
+
+    btn_generate_pdf = tk.Button(
+        window,
+        text="GENERATE PDF \U0001F4C4",
+        command=lambda: generate_report(
+            create_batch_pdf, paths, list(batch["results"]), selected_organ, os.path.basename(folder)
+        ),
+        font=("Calibri", 15),
+        bg="black",
+        fg="white",
+        activeforeground="white",
+        activebackground='black',
+        bd=5,
+        padx=10,
+        pady=5,
+        compound='bottom',
+        width=15
+    )
+    btn_generate_pdf.pack(side=tk.BOTTOM, pady=5)
+
+    answers = queue.Queue()
+    batch = {
+        "folder": folder,
+        "paths": paths,
+        "organ": selected_organ,
+        "results": [None] * len(paths),
+        "answers": answers,
+        "futures": [],
+        "done": 0,
+        "table": results_table,
+        "progress_bar": progress_bar,
+        "progress_label": progress_label
+    }
+    for index, path in enumerate(paths):
+        future = batch_executor.submit(send_analyze_request, path, selected_organ)
+        future.add_done_callback(lambda done, index=index: answers.put((index, done)))
+        batch["futures"].append(future)
+
+    current_batch = batch
+    window.after(POLL_INTERVAL_MS, poll_batch, batch)
+
+
+def poll_batch(batch):
+    """
+    Fill the results table with the answers received since the last
+    call, on the Tk event loop. An image that cannot be uploaded, read
+    or resized marks its row as failed without stopping the batch
+
+    Parameters
+    ----------
+    batch : dict
+        Running batch analysis
+
+    """
+    if batch is not current_batch:
+        return
+
+    while True:
+        try:
+            index, future = batch["answers"].get_nowait()
+        except queue.Empty:
+            break
+        if future.cancelled():
+            continue
+        try:
+            result = future.result()
+            batch["results"][index] = result
+            batch["table"].set(str(index), "diagnosis", result["diagnosis"])
+            batch["table"].set(str(index), "confidence", f"{result['confidence'] * 100:.2f}%")
+            batch["table"].set(str(index), "status", "done")
+        except (requests.RequestException, OSError, ValueError, KeyError, PILImage.DecompressionBombError) as error:
+            batch["table"].set(str(index), "status", f"failed: {error}")
+        batch["done"] += 1
+
+    total = len(batch["paths"])
+    batch["progress_bar"]["value"] = batch["done"]
+    batch["progress_label"].config(text=f"{batch['done']} / {total}")
+    if batch["done"] < total:
+        window.after(POLL_INTERVAL_MS, poll_batch, batch)
+
+
+def cancel_batch():
+    """
+    Cancel the images of the running batch analysis that are not
+    uploaded yet
+
+    """
+    global current_batch
+    if current_batch is not None:
+        for future in current_batch["futures"]:
+            future.cancel()
+        current_batch = None
+
+
+def load_preview(path):
+    """
+    Decode a downscaled preview of an image, on a worker thread
+
+    Parameters
+    ----------
+    path : str
+        Path to the image file
+
+    Returns
+    -------
+    preview : PIL.Image.Image
+        Preview fitting in PREVIEW_SIZE
+    """
+    with PILImage.open(path) as original_image:
+        original_image.draft("RGB", PREVIEW_SIZE)
+        original_image.thumbnail(PREVIEW_SIZE, PILImage.BICUBIC)
+        return original_image.copy()
+
+
+def show_preview(results_table, preview_label):
+    """
+    Display the preview of the image selected in the results table,
+    reusing recently displayed ones. Other previews are decoded on the
+    executor so selecting a row never blocks the Tk event loop
+
+    Parameters
+    ----------
+    results_table : ttk.Treeview
+        Table of the batch analysis
+    preview_label : tk.Label
+        Label displaying the preview
+
+    """
+    selection = results_table.selection()
+    if not selection or current_batch is None:
+        return
+    path = current_batch["paths"][int(selection[0])]
+    if path in preview_cache:
+        preview_cache.move_to_end(path)
+        preview_label.config(image=preview_cache[path], text="")
+        preview_label.image = preview_cache[path]
+        return
+    future = executor.submit(load_preview, path)
+    window.after(POLL_INTERVAL_MS, poll_preview, current_batch, path, future, results_table, preview_label)
+
+
+def poll_preview(batch, path, future, results_table, preview_label):
+    """
+    Check on the Tk event loop whether a preview is decoded, and
+    display it if its row is still selected
+
+    Parameters
+    ----------
+    batch : dict
+        Batch analysis the preview belongs to
+    path : str
+        Path to the image file
+    future : concurrent.futures.Future
+        Running load_preview
+    results_table : ttk.Treeview
+        Table of the batch analysis
+    preview_label : tk.Label
+        Label displaying the preview
+
+    """
+    if batch is not current_batch:
+        return
+    if not future.done():
+        window.after(POLL_INTERVAL_MS, poll_preview, batch, path, future, results_table, preview_label)
+        return
+
+    selection = results_table.selection()
+    selected = bool(selection) and batch["paths"][int(selection[0])] == path
+    try:
+        image = future.result()
+    except (OSError, ValueError, PILImage.DecompressionBombError) as error:
+        if selected:
+            preview_label.config(image="", text=f"No preview: {error}", fg="white")
+        return
+
+    preview = ImageTk.PhotoImage(image)
+    preview_cache[path] = preview
+    if len(preview_cache) > PREVIEW_CACHE_SIZE:
+        preview_cache.popitem(last=False)
+    if selected:
+        preview_label.config(image=preview, text="")
+        preview_label.image = preview
 
 
 def update_selected_organ(event):
@@ -224,58 +767,152 @@ def update_selected_organ(event):
     analysis_label.config(text=f"{selected_organ} Tomography Analysis")
 
     btn_upload_img.config(state=tk.ACTIVE)
+    btn_upload_folder.config(state=tk.ACTIVE)
 
 
-def create_diagnosis_pdf(image_path, diagnosis, confidence):
+def file_hash(path):
     """
-    Create a PDF report with the diagnosis and confidence
+    Compute hash of a file's contents
 
     Parameters
     ----------
-    image_path : str
-        Path to the image file
-    diagnosis : str
-        Diagnosis of the image
-    confidence : float
-        Confidence of the diagnosis
+    path : str
+        Path to the file
 
     Returns
     -------
-    pdf_filename : str
-        Name of the PDF file
+    digest : str
+        Hex encoded SHA-256 hash of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 
+def replace_atomically(path, write):
     """
-    pdf_filename = f"{selected_organ.lower()}_diagnosis_report.pdf"
+    Write a file through a uniquely named temporary file in the same
+    directory, so readers never see it half written and concurrent
+    writers never share a temporary file
 
-    if os.path.exists(pdf_filename):
-        os.remove(pdf_filename)
+    Parameters
+    ----------
+    path : str
+        Path to the file
+    write : callable
+        Function writing the file to the path it is given
 
-    doc = SimpleDocTemplate(pdf_filename, pagesize=letter)
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(path)),
+                                     prefix=f".{os.path.basename(path)}.", suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def to_grayscale(image):
+    """
+    Convert a single channel image to 8-bit grayscale, stretching the
+    range of 16-bit and floating point scans to 0-255
 
-    styles = getSampleStyleSheet()
-    custom_style = ParagraphStyle(
-        'CustomStyle',
-        parent=styles['Normal'],
-        fontSize=15,
-        leading=14,
-        spaceAfter=10
+    Parameters
+    ----------
+    image : PIL.Image.Image
+        Single channel image
+
+    Returns
+    -------
+    image : PIL.Image.Image
+        Image in L mode
+    """
+    if image.mode in ("1", "L"):
+        return image.convert("L")
+    image = image.convert("F")
+    low, high = image.getextrema()
+    scale = 255 / (high - low) if high > low else 0
+    return image.point(lambda value: value * scale - low * scale).convert("L")
+
+
+def report_thumbnail(image_path):
+    """
+    Create a downscaled JPEG copy of an image for PDF reports, or reuse
+    the one cached for the same file contents
+
+    Parameters
+    ----------
+    image_path : str
+        Path to the image file
+
+    Returns
+    -------
+    thumbnail_path : str
+        Path to the cached thumbnail
+    size : tuple of int
+        Width and height of the thumbnail
+    """
+    os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+    thumbnail_path = os.path.join(
+        THUMBNAIL_CACHE_DIR,
+        f"{file_hash(image_path)}_{REPORT_IMAGE_PIXELS}_{REPORT_JPEG_QUALITY}.jpg"
     )
 
-    content = []
+    if not os.path.exists(thumbnail_path):
+        with PILImage.open(image_path) as original_image:
+            original_image.draft("RGB", (REPORT_IMAGE_PIXELS, REPORT_IMAGE_PIXELS))
+            if original_image.mode in ("1", "L", "F") or original_image.mode.startswith("I"):
+                thumbnail = to_grayscale(original_image)
+            else:
+                thumbnail = original_image.convert("RGB")
+            thumbnail.thumbnail((REPORT_IMAGE_PIXELS, REPORT_IMAGE_PIXELS), PILImage.BICUBIC)
+            replace_atomically(thumbnail_path, lambda path: thumbnail.save(
+                path, format="JPEG", quality=REPORT_JPEG_QUALITY, optimize=True
+            ))
 
-    title = f"<b>{selected_organ} Diagnosis Report</b>"
-    content.append(Paragraph(title, styles['Title']))
+    with PILImage.open(thumbnail_path) as thumbnail:
+        return thumbnail_path, thumbnail.size
 
-    content.append(HRFlowable(
+
+def scan_flowables(image_path, diagnosis, confidence, styles, custom_style):
+    """
+    Create the report content of a single scan
+
+    Parameters
+    ----------
+    image_path : str
+        Path to the image file
+    diagnosis : str
+        Diagnosis of the image
+    confidence : float
+        Confidence of the diagnosis
+    styles : reportlab.lib.styles.StyleSheet1
+        Sample style sheet
+    custom_style : ParagraphStyle
+        Style of the diagnosis paragraphs
+
+    Returns
+    -------
+    content : list
+        Flowables of the scan
+    """
+    content = [HRFlowable(
         width="100%",
         thickness=2,
         color="black",
         spaceBefore=5,
         spaceAfter=5
-    ))
+    )]
 
     if os.path.exists(image_path):
-        img = ReportLabImage(image_path, width=400, height=400)
+        thumbnail_path, (width, height) = report_thumbnail(image_path)
+        scale = REPORT_IMAGE_POINTS / max(width, height)
+        # lazy=2 opens the thumbnail only while its page is drawn
+        img = ReportLabImage(thumbnail_path, width=width * scale, height=height * scale, lazy=2)
         content.append(img)
 
     content.append(HRFlowable(
@@ -286,94 +923,283 @@ def create_diagnosis_pdf(image_path, diagnosis, confidence):
         spaceAfter=5
     ))
 
-    diagnosis_text = f"<b>Diagnosis:</b> {diagnosis}"
+    diagnosis_text = f"<b>Diagnosis:</b> {escape(diagnosis)}"
     probability_text = f"<b>Probability:</b> {round(confidence * 100, 2)}%"
+    content.append(Paragraph(f"<b>File:</b> {escape(os.path.basename(image_path))}", styles['Normal']))
     content.append(Paragraph(diagnosis_text, custom_style))
     content.append(Paragraph(probability_text, custom_style))
+    return content
+
+
+def report_styles():
+    """
+    Create the paragraph styles of reports
 
-    doc.build(content)
+    Returns
+    -------
+    styles : reportlab.lib.styles.StyleSheet1
+        Sample style sheet
+    custom_style : ParagraphStyle
+        Style of the diagnosis paragraphs
+    """
+    styles = getSampleStyleSheet()
+    custom_style = ParagraphStyle(
+        'CustomStyle',
+        parent=styles['Normal'],
+        fontSize=15,
+        leading=14,
+        spaceAfter=10
+    )
+    return styles, custom_style
+
+
+def create_diagnosis_pdf(image_path, diagnosis, confidence, organ):
+    """
+    Create a PDF report with the diagnosis and confidence
 
-    print(f"PDF report generated: {pdf_filename}")
+    The image is embedded as a downscaled JPEG thumbnail, see
+    report_thumbnail.
+
+    Parameters
+    ----------
+    image_path : str
+        Path to the image file
+    diagnosis : str
+        Diagnosis of the image
+    confidence : float
+        Confidence of the diagnosis
+    organ : str
+        Organ the image was analysed for
+
+    Returns
+    -------
+    pdf_filename : str
+        Name of the PDF file
+
+    """
+    pdf_filename = f"{organ.lower()}_diagnosis_report.pdf"
+
+    styles, custom_style = report_styles()
+
+    content = [Paragraph(f"<b>{organ} Diagnosis Report</b>", styles['Title'])]
+    content.extend(scan_flowables(image_path, diagnosis, confidence, styles, custom_style))
+
+    replace_atomically(pdf_filename, lambda path: SimpleDocTemplate(path, pagesize=letter).build(content))
 
     return pdf_filename
 
 
-# Main window
-window = tk.Tk()
-window.geometry(f"{WINDOW_WIDTH}x{WINDOW_HEIGHT}")
-window.title("Organ Diagnosis UI")
-window.resizable(False, False)
-
-# Set an image as background of window
-background_image = PhotoImage(file="bg_gui.png")
-background_image = background_image.subsample(
-    int(background_image.width() / WINDOW_WIDTH),
-    int(background_image.height() / WINDOW_HEIGHT)
-)
-background_label = tk.Label(window, image=background_image)
-background_label.place(x=0, y=0, relwidth=1, relheight=1)
-
-# Combobox for choosing the organ
-selected_organ = tk.StringVar()
-selected_organ.set("[Select Organ]")
-
-combobox_style = ttk.Style()
-combobox_style.configure('Custom.TCombobox', font=('Calibri', 20))
-
-organ_combobox = ttk.Combobox(
-    window,
-    values=ORGAN_CHOICES,
-    state="readonly",
-    font=("Calibri", 15),
-    textvariable=selected_organ
-)
-organ_combobox.pack(pady=10)
-organ_combobox.bind("<<ComboboxSelected>>", update_selected_organ)
-
-# Button for uploading image
-btn_upload_img = tk.Button(
-    window,
-    text="UPLOAD IMAGE \U0001F4E4",
-    command=upload_image,
-    font=("Calibri", 20),
-    fg="white",
-    bg='black',
-    activeforeground="white",
-    activebackground='black',
-    state=tk.DISABLED,
-    compound='bottom',
-    bd=5,
-)
-btn_upload_img.place(relx=0.5, rely=0.75, anchor="center")
-
-# Button for analyzing image
-btn_analyze_img = tk.Button(
-    window,
-    text="ANALYZE IMAGE \U0001F50D",
-    font=("Calibri", 20),
-    fg="white",
-    bg="black",
-    activeforeground="white",
-    activebackground='black',
-    state=tk.DISABLED,
-    compound='bottom',
-    bd=5,
-    command=show_diagnosis_window
-)
-btn_analyze_img.place(relx=0.5, rely=0.90, anchor="center")
-
-# Label displaying chosen organ
-analysis_label = tk.Label(
-    window,
-    font=("Calibri", 20),
-    text="[Select Organ] Tomography Analysis",
-    compound="center",
-    fg="white",
-    bg='black',
-    bd=0,
-    highlightbackground="white",
-    highlightthickness=2,
-)
-analysis_label.pack(padx=20, pady=5)
-
-window.mainloop()
+def create_batch_pdf(paths, results, organ, study_name):
+    """
+    Create a multi-page PDF report of a study, with a summary table
+    followed by one page per analysed scan
+
+    Scans are embedded as cached JPEG thumbnails that are opened only
+    while their page is drawn, so memory use does not grow with the
+    size of the original images.
+
+    Parameters
+    ----------
+    paths : list of str
+        Paths to the image files
+    results : list of dict
+        Diagnosis and confidence of every image, None for images that
+        were not analysed
+    organ : str
+        Organ the images were analysed for
+    study_name : str
+        Name of the study, used in the title and file name
+
+    Returns
+    -------
+    pdf_filename : str
+        Name of the PDF file
+
+    """
+    pdf_filename = f"{organ.lower()}_{study_name}_batch_report.pdf"
+
+    styles, custom_style = report_styles()
+    analysed = [(path, result) for path, result in zip(paths, results) if result is not None]
+
+    summary = [["File", "Diagnosis", "Probability"]] + [
+        [os.path.basename(path), result["diagnosis"], f"{round(result['confidence'] * 100, 2)}%"]
+        for path, result in analysed
+    ]
+    summary_table = Table(summary, repeatRows=1)
+    summary_table.setStyle(TableStyle([
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("LINEBELOW", (0, 0), (-1, 0), 1, "black"),
+        ("FONTSIZE", (0, 0), (-1, -1), 9)
+    ]))
+
+    content = [
+        Paragraph(f"<b>{organ} Study Report: {escape(study_name)}</b>", styles['Title']),
+        Paragraph(f"{len(analysed)} of {len(paths)} scans analysed", styles['Normal']),
+        summary_table
+    ]
+    for path, result in analysed:
+        content.append(PageBreak())
+        content.extend(scan_flowables(path, result["diagnosis"], result["confidence"], styles, custom_style))
+
+    replace_atomically(pdf_filename, lambda path: SimpleDocTemplate(path, pagesize=letter).build(content))
+
+    return pdf_filename
+
+
+def generate_report(create_report, *args):
+    """
+    Generate a PDF report on a background thread and display its
+    status in the window
+
+    Parameters
+    ----------
+    create_report : callable
+        Function creating the report and returning its file name
+    args :
+        Arguments of create_report
+
+    """
+    status_label = tk.Label(
+        window,
+        text="Generating PDF report...",
+        font=("Calibri", 12),
+        fg="white",
+        bg="black"
+    )
+    status_label.pack(pady=5)
+
+    report = executor.submit(create_report, *args)
+    window.after(POLL_INTERVAL_MS, poll_report, report, status_label)
+
+
+def poll_report(report, status_label):
+    """
+    Display the status of a report once it is generated
+
+    Parameters
+    ----------
+    report : concurrent.futures.Future
+        Report being generated
+    status_label : tk.Label
+        Label displaying the status
+
+    """
+    if not report.done():
+        window.after(POLL_INTERVAL_MS, poll_report, report, status_label)
+        return
+    if not status_label.winfo_exists():
+        return
+    try:
+        status_label.config(text=f"PDF report generated: {report.result()}")
+    except Exception as error:
+        status_label.config(text=f"PDF report failed: {error}")
+
+
+def build_menu():
+    """
+    Create the widgets of the menu, keeping the organ selected before
+
+    """
+    global organ_variable, organ_combobox, btn_upload_img, btn_analyze_img, btn_upload_folder, analysis_label
+
+    # Combobox for choosing the organ, its variable is kept at module
+    # level so it is not garbage collected while the menu is displayed
+    organ_variable = tk.StringVar()
+    organ_variable.set(selected_organ or "[Select Organ]")
+
+    combobox_style = ttk.Style()
+    combobox_style.configure('Custom.TCombobox', font=('Calibri', 20))
+
+    organ_combobox = ttk.Combobox(
+        window,
+        values=ORGAN_CHOICES,
+        state="readonly",
+        font=("Calibri", 15),
+        textvariable=organ_variable
+    )
+    organ_combobox.pack(pady=10)
+    organ_combobox.bind("<<ComboboxSelected>>", update_selected_organ)
+
+    # Button for uploading image
+    btn_upload_img = tk.Button(
+        window,
+        text="UPLOAD IMAGE \U0001F4E4",
+        command=upload_image,
+        font=("Calibri", 20),
+        fg="white",
+        bg='black',
+        activeforeground="white",
+        activebackground='black',
+        state=tk.ACTIVE if selected_organ else tk.DISABLED,
+        compound='bottom',
+        bd=5,
+    )
+    btn_upload_img.place(relx=0.3, rely=0.75, anchor="center")
+
+    # Button for analyzing image
+    btn_analyze_img = tk.Button(
+        window,
+        text="ANALYZE IMAGE \U0001F50D",
+        font=("Calibri", 20),
+        fg="white",
+        bg="black",
+        activeforeground="white",
+        activebackground='black',
+        state=tk.DISABLED,
+        compound='bottom',
+        bd=5,
+        command=show_diagnosis_window
+    )
+    btn_analyze_img.place(relx=0.5, rely=0.90, anchor="center")
+
+    # Button for analyzing a study folder
+    btn_upload_folder = tk.Button(
+        window,
+        text="ANALYZE FOLDER \U0001F4C1",
+        command=upload_folder,
+        font=("Calibri", 20),
+        fg="white",
+        bg='black',
+        activeforeground="white",
+        activebackground='black',
+        state=tk.ACTIVE if selected_organ else tk.DISABLED,
+        compound='bottom',
+        bd=5,
+    )
+    btn_upload_folder.place(relx=0.7, rely=0.75, anchor="center")
+
+    # Label displaying chosen organ
+    analysis_label = tk.Label(
+        window,
+        font=("Calibri", 20),
+        text=f"{selected_organ or '[Select Organ]'} Tomography Analysis",
+        compound="center",
+        fg="white",
+        bg='black',
+        bd=0,
+        highlightbackground="white",
+        highlightthickness=2,
+    )
+    analysis_label.pack(padx=20, pady=5)
+
+
+if __name__ == '__main__':
+    # Main window
+    window = tk.Tk()
+    window.geometry(f"{WINDOW_WIDTH}x{WINDOW_HEIGHT}")
+    window.title("Organ Diagnosis UI")
+    window.resizable(False, False)
+
+    # Set an image as background of window
+    background_image = PhotoImage(file="bg_gui.png")
+    background_image = background_image.subsample(
+        int(background_image.width() / WINDOW_WIDTH),
+        int(background_image.height() / WINDOW_HEIGHT)
+    )
+    background_label = tk.Label(window, image=background_image)
+    background_label.place(x=0, y=0, relwidth=1, relheight=1)
+
+    # Menu
+    build_menu()
+
+    window.mainloop()
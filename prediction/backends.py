@@ -0,0 +1,106 @@
+import threading
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+
+class SavedModelBackend:
+    """Inference backend running a model exported in the SavedModel format.
+
+    Parameters
+    ----------
+    path: str
+        Path to the SavedModel directory.
+    """
+
+    def __init__(self, path):
+        self._model = tf.saved_model.load(path)
+        self._signature = self._model.signatures['serving_default']
+        self._input_name = list(self._signature.structured_input_signature[1].keys())[0]
+
+    def predict_on_batch(self, img_batch: np.ndarray) -> np.ndarray:
+        """Method that returns prediction vectors for a batch of preprocessed images.
+
+        Parameters
+        ----------
+        img_batch: np.ndarray
+            Preprocessed images, in the format expected by the model (N, 150, 150, 3).
+
+        Returns
+        -------
+        predictions: np.ndarray
+            Prediction vectors, one row per image.
+        """
+        outputs = self._signature(**{self._input_name: tf.convert_to_tensor(img_batch, dtype=tf.float32)})
+        return next(iter(outputs.values())).numpy()
+
+
+class TFLiteBackend:
+    """Inference backend running a model exported in the TFLite format, including quantized models.
+
+    Parameters
+    ----------
+    path: str
+        Path to the .tflite file.
+    num_threads: int
+        Number of threads used by the interpreter, None lets TFLite decide.
+    """
+
+    def __init__(self, path, num_threads=None):
+        self._interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, img_batch: np.ndarray) -> np.ndarray:
+        """Method that returns prediction vectors for a batch of preprocessed images.
+
+        Parameters
+        ----------
+        img_batch: np.ndarray
+            Preprocessed images, in the format expected by the model (N, 150, 150, 3).
+
+        Returns
+        -------
+        predictions: np.ndarray
+            Prediction vectors, one row per image.
+        """
+        with self._lock:
+            if self._batch_size != len(img_batch):
+                self._interpreter.resize_tensor_input(self._input['index'], img_batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(img_batch)
+            self._interpreter.set_tensor(self._input['index'], img_batch.astype(self._input['dtype']))
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output['index']).copy()
+
+
+BACKENDS = {
+    'keras': ('.h5', load_model),
+    'savedmodel': ('_savedmodel', SavedModelBackend),
+    'tflite': ('.tflite', TFLiteBackend),
+    'tflite_float16': ('_float16.tflite', TFLiteBackend),
+    'tflite_int8': ('_int8.tflite', TFLiteBackend),
+}
+
+
+def get_backend(name: str):
+    """Function that returns file suffix and loader of an inference backend.
+
+    Parameters
+    ----------
+    name: str
+        Name of the backend: 'keras', 'savedmodel', 'tflite', 'tflite_float16' or 'tflite_int8'.
+
+    Returns
+    -------
+    suffix: str
+        Suffix appended to the model name to get the path of its exported file.
+    loader: callable
+        Function loading a model from a path, the loaded model exposes predict_on_batch.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unsupported model backend: {name}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]
@@ -0,0 +1,273 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from prediction import get_batch_prediction, parse_prediction, prepare_image_bytes
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MODEL_NAMES = ['kidney_diagnose', 'chest_diagnose']
+
+
+def list_inputs(source: str, split=None) -> list[str]:
+    """Function that lists image files of a directory tree or of a manifest.
+
+    Parameters
+    ----------
+    source: str
+        Directory, searched recursively, or CSV manifest with a path column, as written by
+        training/split_manifest.py. Paths of a manifest are relative to its directory.
+    split: str
+        Only list files of this split of a manifest, None lists all of them.
+
+    Returns
+    -------
+    paths: list of str
+        Sorted absolute paths to image files, the same whichever form of source is given.
+    """
+    if os.path.isfile(source):
+        manifest_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, newline='') as f:
+            return sorted(os.path.abspath(os.path.join(manifest_dir, row['path'])) for row in csv.DictReader(f)
+                          if split is None or row.get('split') == split)
+    return sorted(os.path.abspath(os.path.join(root, name)) for root, _, names in os.walk(source) for name in names
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def output_fields(model_names: list[str]) -> list[str]:
+    """Function that returns columns of a CSV output.
+
+    Parameters
+    ----------
+    model_names: list of str
+        Names of the models run on every image.
+
+    Returns
+    -------
+    fields: list of str
+        Path, diagnosis and confidence of every model, and error.
+    """
+    return ['path'] + [f'{name}_{key}' for name in model_names for key in ('diagnosis', 'confidence')] + ['error']
+
+
+def completed_paths(output_path: str, model_names: list[str]) -> set[str]:
+    """Function that reads paths of images already written to an output file, so that a run can resume.
+
+    A partially written last line, left by an interrupted run, is removed from the file.
+
+    Parameters
+    ----------
+    output_path: str
+        Path of the CSV or JSONL output.
+    model_names: list of str
+        Names of the models the run is resumed with, which have to be the ones the output was written with.
+
+    Returns
+    -------
+    paths: set of str
+        Absolute paths of images with a result.
+
+    Raises
+    ------
+    ValueError
+        If the output was written with other models.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, 'rb+') as f:
+        contents = f.read()
+        end = contents.rfind(b'\n') + 1
+        if end < len(contents):
+            f.truncate(end)
+
+    with open(output_path, newline='') as f:
+        if output_path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+            expected = set(output_fields(model_names)) - {'error'}
+            mismatched = any(set(row) != expected for row in rows if 'error' not in row)
+        else:
+            reader = csv.DictReader(f)
+            rows = list(reader)
+            mismatched = reader.fieldnames is not None and reader.fieldnames != output_fields(model_names)
+    if mismatched:
+        raise ValueError(f"{output_path} was written with other models than {', '.join(model_names)}, "
+                         f"write the results to another file")
+    return {os.path.abspath(row['path']) for row in rows}
+
+
+def load_image(path: str):
+    """Function that reads and preprocesses a single image file.
+
+    Parameters
+    ----------
+    path: str
+        Path to the image file.
+
+    Returns
+    -------
+    img_array: np.ndarray
+        Preprocessed image of shape (1, 150, 150, 3), None if it cannot be read.
+    error: str
+        Why the image cannot be read, None otherwise.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return prepare_image_bytes(f.read()), None
+    except (OSError, ValueError) as error:
+        return None, f'{type(error).__name__}: {error}'
+
+
+def infer_files(paths: list[str], model_names: list[str], batch_size=32, decode_threads=4) -> list[dict]:
+    """Function that runs models on image files in batches, decoding the next images while a batch is predicted.
+
+    Parameters
+    ----------
+    paths: list of str
+        Paths to image files.
+    model_names: list of str
+        Names of the models run on every image, see prediction.get_batch_prediction.
+    batch_size: int
+        Number of images predicted at once.
+    decode_threads: int
+        Number of threads reading, decoding and preprocessing images ahead of the model.
+
+    Returns
+    -------
+    results: list of dict
+        Path, diagnosis and confidence of every model, or error, of every image, in the order of paths.
+    """
+    results = []
+    batch_paths, batch_arrays = [], []
+
+    def flush():
+        img_batch = np.concatenate(batch_arrays)
+        rows = [{'path': path} for path in batch_paths]
+        for model_name in model_names:
+            for row, prediction in zip(rows, get_batch_prediction(img_batch, model_name)):
+                diagnosis, confidence = parse_prediction(prediction, model_name)
+                row[f'{model_name}_diagnosis'] = diagnosis
+                row[f'{model_name}_confidence'] = confidence
+        results.extend(rows)
+        batch_paths.clear()
+        batch_arrays.clear()
+
+    with ThreadPoolExecutor(max_workers=decode_threads) as executor:
+        for path, (img_array, error) in zip(paths, executor.map(load_image, paths)):
+            if error is not None:
+                results.append({'path': path, 'error': error})
+                continue
+            batch_paths.append(path)
+            batch_arrays.append(img_array)
+            if len(batch_paths) == batch_size:
+                flush()
+        if batch_paths:
+            flush()
+    return results
+
+
+def _init_worker(threads):
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _infer_chunk(args):
+    return infer_files(*args)
+
+
+def run_batch_inference(source, output_path, model_names=MODEL_NAMES, processes=1, batch_size=32, chunk_size=256,
+                        decode_threads=4, split=None) -> int:
+    """Function that runs models on every image of a directory or manifest and writes results incrementally.
+
+    Images are dealt in chunks to a pool of processes, each with an equal share of the CPU threads, which decode
+    and predict them with infer_files. Results of every finished chunk are appended to the output and flushed at
+    once, and images already in the output are skipped, so an interrupted run resumes where it stopped.
+
+    Parameters
+    ----------
+    source: str
+        Directory or manifest, see list_inputs.
+    output_path: str
+        Path of the output, JSON lines if it ends with .jsonl, CSV otherwise.
+    model_names: list of str
+        Names of the models run on every image.
+    processes: int
+        Number of processes running the models.
+    batch_size: int
+        Number of images predicted at once.
+    chunk_size: int
+        Number of images per task of a process, and per flush of the output.
+    decode_threads: int
+        Number of threads decoding images ahead of the model in every process.
+    split: str
+        Only process files of this split of a manifest.
+
+    Returns
+    -------
+    processed: int
+        Number of images processed by this run.
+    """
+    done = completed_paths(output_path, model_names)
+    paths = [path for path in list_inputs(source, split) if path not in done]
+    print(f'{len(done)} images already processed, {len(paths)} remaining')
+    if not paths:
+        return 0
+
+    chunks = [(paths[i:i + chunk_size], model_names, batch_size, decode_threads)
+              for i in range(0, len(paths), chunk_size)]
+    is_jsonl = output_path.endswith('.jsonl')
+    write_header = not (os.path.exists(output_path) and os.path.getsize(output_path))
+
+    processed = 0
+    start = time.perf_counter()
+    with open(output_path, 'a', newline='') as f:
+        writer = None if is_jsonl else csv.DictWriter(f, fieldnames=output_fields(model_names))
+        if writer is not None and write_header:
+            writer.writeheader()
+
+        if processes > 1:
+            threads = max(1, (os.cpu_count() or 1) // processes)
+            pool = multiprocessing.get_context('spawn').Pool(processes, initializer=_init_worker,
+                                                             initargs=(threads,))
+            results = pool.imap_unordered(_infer_chunk, chunks)
+        else:
+            pool = None
+            results = map(_infer_chunk, chunks)
+
+        try:
+            for rows in results:
+                for row in rows:
+                    if is_jsonl:
+                        f.write(json.dumps(row) + '\n')
+                    else:
+                        writer.writerow(row)
+                f.flush()
+                processed += len(rows)
+                elapsed = time.perf_counter() - start
+                print(f'{len(done) + processed}/{len(done) + len(paths)} images, {processed / elapsed:.1f} images/s')
+        finally:
+            if pool is not None:
+                pool.terminate()
+    return processed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the classifiers on every image of a directory or manifest, "
+                                                 "resuming interrupted runs.")
+    parser.add_argument('source', help="Directory of images or CSV manifest")
+    parser.add_argument('output', help="Output file, .csv or .jsonl")
+    parser.add_argument('--models', nargs='+', default=MODEL_NAMES, choices=MODEL_NAMES)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--chunk-size', type=int, default=256)
+    parser.add_argument('--decode-threads', type=int, default=4)
+    parser.add_argument('--split', default=None, help="Only process this split of a manifest")
+    args = parser.parse_args()
+
+    run_batch_inference(args.source, args.output, args.models, args.processes, args.batch_size, args.chunk_size,
+                        args.decode_threads, args.split)
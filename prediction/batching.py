@@ -0,0 +1,212 @@
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+_STOP = object()
+
+
+class BatchStats:
+    """Statistics of the batches formed by a MicroBatcher.
+
+    Parameters
+    ----------
+    window: int
+        Number of most recent queue wait times kept for computing percentiles.
+    """
+
+    def __init__(self, window=10000):
+        self._lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.wait_times = deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+
+    def record(self, batch_size: int, wait_times: list[float]) -> None:
+        """Method that records a single batched forward pass.
+
+        Parameters
+        ----------
+        batch_size: int
+            Number of requests in the batch.
+        wait_times: list of float
+            Time in seconds each request spent in the queue before the forward pass started.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self.batch_sizes[batch_size] += 1
+            self.wait_times.extend(wait_times)
+            self.requests += batch_size
+            self.batches += 1
+
+    def summary(self) -> dict:
+        """Method that summarizes recorded statistics.
+
+        Returns
+        -------
+        summary: dict
+            Number of requests and batches, mean batch size, histogram of batch sizes and queue wait time
+            percentiles in milliseconds.
+        """
+        with self._lock:
+            waits = np.array(self.wait_times) * 1000
+            summary = {
+                "requests": self.requests,
+                "batches": self.batches,
+                "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            }
+        if waits.size:
+            summary["queue_wait_ms"] = {
+                "mean": float(waits.mean()),
+                "p50": float(np.percentile(waits, 50)),
+                "p95": float(np.percentile(waits, 95)),
+                "p99": float(np.percentile(waits, 99)),
+                "max": float(waits.max()),
+            }
+        return summary
+
+
+class MicroBatcher:
+    """Scheduler that groups concurrent prediction requests into batches.
+
+    Every model gets its own queue and worker thread. The worker takes the first waiting request, then keeps
+    collecting requests until the batch is full or the oldest request has waited for max_wait_ms, runs a single
+    forward pass on the whole batch and hands each caller its own row of the result. Requests whose futures were
+    cancelled in the meantime are dropped from the batch. A request that would push the batch past max_batch_size
+    starts the next batch instead, only a single request larger than max_batch_size is run on its own as a bigger
+    batch.
+
+    Parameters
+    ----------
+    predict_fn: callable
+        Function taking a batch of preprocessed images and a model name, and returning prediction vectors.
+    max_batch_size: int
+        Maximum number of images in a single forward pass.
+    max_wait_ms: float
+        Maximum time in milliseconds a request waits for other requests to join its batch.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queues = {}
+        self._workers = {}
+        self._stats = {}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def submit(self, img_array: np.ndarray, model_name: str) -> Future:
+        """Method that schedules preprocessed images for prediction.
+
+        Parameters
+        ----------
+        img_array: np.ndarray
+            Preprocessed images, in the format expected by the model (N, 150, 150, 3), usually with N = 1.
+        model_name: str
+            Name of the model to use, currently supported models are: 'kidney_diagnose', 'chest_diagnose'.
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            Future resolved with prediction vectors for the submitted images.
+
+        Raises
+        ------
+        RuntimeError
+            If the batcher was shut down.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher was shut down")
+            self._queue(model_name).put((img_array, future, time.perf_counter()))
+        return future
+
+    def shutdown(self) -> None:
+        """Method that stops the worker threads after they process the requests already submitted.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._closed = True
+            workers = dict(self._workers)
+        for model_name, worker in workers.items():
+            self._queues[model_name].put(_STOP)
+        for worker in workers.values():
+            worker.join()
+
+    def stats(self) -> dict:
+        """Method that summarizes achieved batch sizes and queue wait times.
+
+        Returns
+        -------
+        stats: dict
+            Summary of BatchStats for every model.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        return {model_name: model_stats.summary() for model_name, model_stats in stats.items()}
+
+    def _queue(self, model_name):
+        if model_name not in self._queues:
+            self._queues[model_name] = queue.Queue()
+            self._stats[model_name] = BatchStats()
+            self._workers[model_name] = threading.Thread(target=self._run, args=(model_name,), daemon=True,
+                                                         name=f"batcher-{model_name}")
+            self._workers[model_name].start()
+        return self._queues[model_name]
+
+    def _run(self, model_name):
+        requests_queue = self._queues[model_name]
+        carried = None
+        while True:
+            request = carried or requests_queue.get()
+            if request is _STOP:
+                return
+            batch = [request]
+            carried = None
+            size = len(batch[0][0])
+            deadline = batch[0][2] + self.max_wait
+            while size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = requests_queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is _STOP or size + len(request[0]) > self.max_batch_size:
+                    carried = request
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._process(model_name, batch)
+
+    def _process(self, model_name, batch):
+        # Callers may cancel their futures while waiting, e.g. when a client disconnects
+        batch = [request for request in batch if request[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        start = time.perf_counter()
+        self._stats[model_name].record(sum(len(img_array) for img_array, _, _ in batch),
+                                       [start - submitted for _, _, submitted in batch])
+        try:
+            predictions = self.predict_fn(np.concatenate([img_array for img_array, _, _ in batch]), model_name)
+            offset = 0
+            for img_array, future, _ in batch:
+                future.set_result(predictions[offset:offset + len(img_array)])
+                offset += len(img_array)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
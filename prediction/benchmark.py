@@ -0,0 +1,332 @@
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from batching import MicroBatcher
+from model_registry import registry
+from prediction import (PREPROCESS_TOLERANCE, decode_image, encode_preprocessed, get_batch_prediction,
+                        parse_prediction, prepare_image, prepare_image_bytes, preprocess_batch,
+                        preprocess_prediction_image, preprocessing_deviation, resize_for_model)
+
+IMAGE_SPECS = [
+    ('png_gray_512', 'PNG', 'L', 512),
+    ('png_gray_1024', 'PNG', 'L', 1024),
+    ('png_rgb_512', 'PNG', 'RGB', 512),
+    ('jpeg_gray_512', 'JPEG', 'L', 512),
+    ('jpeg_rgb_2048', 'JPEG', 'RGB', 2048),
+]
+BATCH_SIZES = [1, 8, 32]
+CONCURRENCY_LEVELS = [1, 4, 8]
+
+
+def synthetic_ct_image(image_format: str, mode: str, size: int, seed=0) -> bytes:
+    """Function that generates a synthetic CT-like image file.
+
+    The image contains a bright elliptical body with noisy soft tissue and a few dense round structures on a dark
+    background, so that it compresses like a real slice rather than like pure noise.
+
+    Parameters
+    ----------
+    image_format: str
+        File format: 'PNG' or 'JPEG'.
+    mode: str
+        Image mode: 'L' or 'RGB'.
+    size: int
+        Width and height of the image.
+    seed: int
+        Seed of the random generator.
+
+    Returns
+    -------
+    image_bytes: bytes
+        Contents of the image file.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[-1:1:size * 1j, -1:1:size * 1j]
+    pixels = np.where(x ** 2 / 0.8 + y ** 2 / 0.6 < 1, 110.0, 5.0)
+    for _ in range(6):
+        cx, cy, r = rng.uniform(-0.5, 0.5), rng.uniform(-0.4, 0.4), rng.uniform(0.03, 0.12)
+        pixels[(x - cx) ** 2 + (y - cy) ** 2 < r ** 2] = rng.uniform(160, 250)
+    pixels += rng.normal(0, 8, pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode='L').convert(mode)
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def percentiles(timings: list[float]) -> dict:
+    """Function that summarizes timings.
+
+    Parameters
+    ----------
+    timings: list of float
+        Timings in seconds.
+
+    Returns
+    -------
+    summary: dict
+        Mean, p50, p95 and p99 in milliseconds.
+    """
+    timings = np.array(timings) * 1000
+    return {
+        'mean': float(timings.mean()),
+        'p50': float(np.percentile(timings, 50)),
+        'p95': float(np.percentile(timings, 95)),
+        'p99': float(np.percentile(timings, 99)),
+    }
+
+
+def time_stage(fn, repeats: int) -> dict:
+    """Function that measures latency of a single pipeline stage.
+
+    Parameters
+    ----------
+    fn: callable
+        Function running the stage once.
+    repeats: int
+        Number of timed runs, preceded by one warm-up run.
+
+    Returns
+    -------
+    latency: dict
+        Latency percentiles, see percentiles.
+    """
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return percentiles(timings)
+
+
+def benchmark_stages(images: dict, model_name: str, repeats: int) -> dict:
+    """Function that measures latency of every stage of the prediction pipeline separately.
+
+    Parameters
+    ----------
+    images: dict
+        Mapping from image spec name to base64 encoded synthetic image.
+    model_name: str
+        Name of the model to benchmark, None skips model stages.
+    repeats: int
+        Number of timed runs of each stage.
+
+    Returns
+    -------
+    stages: dict
+        Latency percentiles of decoding and preprocessing per image spec, of preparing client-side resized payloads,
+        and of model loading, prediction and parsing of prediction vectors.
+    """
+    stages = {}
+    for name, image_data in images.items():
+        stages[f'decode/{name}'] = time_stage(lambda: decode_image(image_data).load(), repeats)
+        stages[f'preprocess/{name}'] = time_stage(lambda: preprocess_prediction_image(decode_image(image_data)),
+                                                  repeats)
+        stages[f'preprocess_batch/{name}'] = time_stage(lambda: preprocess_batch([decode_image(image_data)]),
+                                                        repeats)
+        payload = encode_preprocessed(resize_for_model(decode_image(image_data)))
+        stages[f'preprocessed_payload/{name}'] = time_stage(lambda: prepare_image_bytes(payload), repeats)
+    if model_name is None:
+        return stages
+
+    path = registry.model_path(model_name)
+    stages['load_model'] = time_stage(lambda: registry.loader(path), max(1, repeats // 10))
+    img_array = prepare_image(next(iter(images.values())))
+    prediction = get_batch_prediction(img_array, model_name)
+    stages['predict'] = time_stage(lambda: get_batch_prediction(img_array, model_name), repeats)
+    stages['parse_prediction'] = time_stage(lambda: parse_prediction(prediction, model_name), repeats)
+    return stages
+
+
+def benchmark_batch_sizes(image_data: str, model_name: str, batch_sizes: list[int], repeats: int) -> dict:
+    """Function that measures model throughput at different batch sizes.
+
+    Parameters
+    ----------
+    image_data: str
+        Base64 encoded image used to fill the batches.
+    model_name: str
+        Name of the model to benchmark.
+    batch_sizes: list of int
+        Batch sizes to measure.
+    repeats: int
+        Number of timed forward passes per batch size.
+
+    Returns
+    -------
+    throughput: dict
+        Latency percentiles of a forward pass and images per second, per batch size.
+    """
+    img_array = prepare_image(image_data)
+    results = {}
+    for batch_size in batch_sizes:
+        img_batch = np.repeat(img_array, batch_size, axis=0)
+        latency = time_stage(lambda: get_batch_prediction(img_batch, model_name), repeats)
+        results[str(batch_size)] = {'latency_ms': latency,
+                                    'images_per_second': batch_size / latency['mean'] * 1000}
+    return results
+
+
+def benchmark_concurrency(image_data: str, model_name: str, levels: list[int], requests: int,
+                          max_batch_size: int, max_wait_ms: int) -> dict:
+    """Function that measures end-to-end throughput of concurrent requests served through the micro-batcher.
+
+    Parameters
+    ----------
+    image_data: str
+        Base64 encoded image sent by every request.
+    model_name: str
+        Name of the model to benchmark.
+    levels: list of int
+        Numbers of concurrent clients to measure.
+    requests: int
+        Number of requests sent per concurrency level.
+    max_batch_size: int
+        Maximum batch size of the micro-batcher.
+    max_wait_ms: int
+        Maximum queue wait time of the micro-batcher.
+
+    Returns
+    -------
+    throughput: dict
+        Request latency percentiles, requests per second and achieved batch sizes, per concurrency level.
+    """
+    results = {}
+    for level in levels:
+        batcher = MicroBatcher(get_batch_prediction, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+        def request():
+            start = time.perf_counter()
+            prediction = batcher.submit(prepare_image(image_data), model_name).result()
+            parse_prediction(prediction, model_name)
+            return time.perf_counter() - start
+
+        try:
+            request()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=level) as executor:
+                timings = list(executor.map(lambda _: request(), range(requests)))
+            elapsed = time.perf_counter() - start
+        finally:
+            batcher.shutdown()
+        results[str(level)] = {'latency_ms': percentiles(timings), 'requests_per_second': requests / elapsed,
+                               'batching': batcher.stats()[model_name]}
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Function that compares benchmark results with a stored baseline.
+
+    Parameters
+    ----------
+    results: dict
+        Results of the current run.
+    baseline: dict
+        Results of a previous run, in the same format.
+    threshold: float
+        Relative slowdown of p50 latency (or drop of throughput) above which a measurement is flagged.
+
+    Returns
+    -------
+    regressions: list of str
+        Description of every flagged measurement.
+    """
+    regressions = []
+    for stage, latency in results['stages'].items():
+        reference = baseline.get('stages', {}).get(stage)
+        if reference and latency['p50'] > reference['p50'] * (1 + threshold):
+            regressions.append(f"{stage}: p50 {reference['p50']:.2f} ms -> {latency['p50']:.2f} ms")
+    for section, key in [('batch_sizes', 'images_per_second'), ('concurrency', 'requests_per_second')]:
+        for level, result in results.get(section, {}).items():
+            reference = baseline.get(section, {}).get(level)
+            if reference and result[key] < reference[key] * (1 - threshold):
+                regressions.append(f"{section}/{level}: {key} {reference[key]:.1f} -> {result[key]:.1f}")
+    return regressions
+
+
+def run_benchmark(model_name=None, repeats=50, requests=200, max_batch_size=16, max_wait_ms=10) -> dict:
+    """Function that runs the whole benchmark suite.
+
+    Parameters
+    ----------
+    model_name: str
+        Name of the model to benchmark, None or a model without a file benchmarks only decoding and preprocessing.
+    repeats: int
+        Number of timed runs of each stage.
+    requests: int
+        Number of requests sent per concurrency level.
+    max_batch_size: int
+        Maximum batch size of the micro-batcher.
+    max_wait_ms: int
+        Maximum queue wait time of the micro-batcher.
+
+    Returns
+    -------
+    results: dict
+        Environment description, per stage latency, preprocessing deviation and throughput measurements.
+    """
+    encoded = {name: synthetic_ct_image(image_format, mode, size)
+               for name, image_format, mode, size in IMAGE_SPECS}
+    images = {name: base64.b64encode(image_bytes).decode('utf-8') for name, image_bytes in encoded.items()}
+    if model_name is not None and not os.path.exists(registry.model_path(model_name)):
+        print(f"{registry.model_path(model_name)} not found, skipping model stages")
+        model_name = None
+
+    results = {
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(),
+                        'cpus': os.cpu_count(), 'model': model_name},
+        'stages': benchmark_stages(images, model_name, repeats),
+        'preprocessing_deviation': {name: preprocessing_deviation(image_bytes)
+                                    for name, image_bytes in encoded.items()},
+    }
+    if model_name is not None:
+        image_data = images[IMAGE_SPECS[0][0]]
+        results['batch_sizes'] = benchmark_batch_sizes(image_data, model_name, BATCH_SIZES, repeats)
+        results['concurrency'] = benchmark_concurrency(image_data, model_name, CONCURRENCY_LEVELS, requests,
+                                                       max_batch_size, max_wait_ms)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark stages and throughput of the prediction pipeline "
+                                                 "on synthetic CT images.")
+    parser.add_argument('--model', default='kidney_diagnose', help="Model to benchmark, 'none' to skip the model")
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help="Results of a previous run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = run_benchmark(None if args.model == 'none' else args.model, args.repeats, args.requests)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    for stage, latency in results['stages'].items():
+        print(f"{stage:<36} p50 {latency['p50']:>9.2f} ms  p95 {latency['p95']:>9.2f} ms  "
+              f"p99 {latency['p99']:>9.2f} ms")
+    for name, deviation in results['preprocessing_deviation'].items():
+        status = 'ok' if deviation <= PREPROCESS_TOLERANCE else 'ABOVE TOLERANCE'
+        print(f"preprocessing deviation {name:<20} {deviation:.4f} {status}")
+    for batch_size, result in results.get('batch_sizes', {}).items():
+        print(f"batch size {batch_size:>3}: {result['images_per_second']:.1f} images/s")
+    for level, result in results.get('concurrency', {}).items():
+        print(f"concurrency {level:>3}: {result['requests_per_second']:.1f} requests/s, "
+              f"mean batch {result['batching']['mean_batch_size']:.2f}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,44 @@
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    """Function that reads an integer setting from the environment.
+
+    Parameters
+    ----------
+    name: str
+        Name of the environment variable.
+    default: int
+        Value returned when the variable is not set.
+
+    Returns
+    -------
+    value: int
+        Parsed value of the setting.
+    """
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+MODEL_DIR = os.environ.get("MODEL_DIR", ".")
+MODEL_MEMORY_LIMIT_MB = _env_int("MODEL_MEMORY_LIMIT_MB", 2048)
+MAX_BATCH_SIZE = _env_int("MAX_BATCH_SIZE", 16)
+MAX_BATCH_WAIT_MS = _env_int("MAX_BATCH_WAIT_MS", 10)
+INFERENCE_POOL = os.environ.get("INFERENCE_POOL", "thread")
+INFERENCE_WORKERS = _env_int("INFERENCE_WORKERS", os.cpu_count() or 1)
+INFERENCE_QUEUE_SIZE = _env_int("INFERENCE_QUEUE_SIZE", 64)
+RETRY_AFTER_SECONDS = _env_int("RETRY_AFTER_SECONDS", 1)
+STREAM_CHUNK_SIZE = _env_int("STREAM_CHUNK_SIZE", MAX_BATCH_SIZE)
+STREAM_SPOOL_MEMORY_MB = _env_int("STREAM_SPOOL_MEMORY_MB", 16)
+CACHE_MAX_ENTRIES = _env_int("CACHE_MAX_ENTRIES", 10000)
+CACHE_MAX_MB = _env_int("CACHE_MAX_MB", 64)
+CACHE_TTL_SECONDS = _env_int("CACHE_TTL_SECONDS", 3600)
+CACHE_DISK_PATH = os.environ.get("CACHE_DISK_PATH") or None
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "keras")
+MODEL_VARIANT = os.environ.get("MODEL_VARIANT", "")
+SHARED_BACKBONE = bool(_env_int("SHARED_BACKBONE", 0))
+
+# The shared backbone is assembled from the Keras .h5 files of the organ models
+if SHARED_BACKBONE and (MODEL_BACKEND != "keras" or MODEL_VARIANT):
+    raise ValueError(f"SHARED_BACKBONE=1 serves the Keras .h5 models and cannot be combined with "
+                     f"MODEL_BACKEND={MODEL_BACKEND} or MODEL_VARIANT={MODEL_VARIANT!r}")
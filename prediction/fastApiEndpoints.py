@@ -1,6 +1,20 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from prediction import prediction_pipeline
+import asyncio
+import contextlib
+import tempfile
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+import config
+from batching import MicroBatcher
+from model_registry import registry
+from prediction import (InvalidImageError, get_batch_prediction, get_model_version, parse_prediction,
+                        prepare_image_bytes, read_image_data, split_prediction)
+from prediction_cache import PredictionCache
+from shared_backbone import COMBINED_MODEL
+from worker_pool import PoolFullError, WorkerPool
 
 
 class ImageData(BaseModel):
@@ -12,7 +26,149 @@ class Prediction(BaseModel):
     confidence: float
 
 
-app = FastAPI()
+class CombinedPrediction(BaseModel):
+    kidney: Prediction
+    chest: Prediction
+
+
+class BatchPrediction(BaseModel):
+    index: int
+    diagnosis: Optional[str] = None
+    confidence: Optional[float] = None
+    error: Optional[str] = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Fast API lifespan handler stopping the micro-batcher and the worker pool on shutdown.
+
+    Parameters
+    ----------
+    app: FastAPI
+        Application being served.
+    """
+    yield
+    batcher.shutdown()
+    pool.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+batcher = MicroBatcher(get_batch_prediction, max_batch_size=config.MAX_BATCH_SIZE,
+                       max_wait_ms=config.MAX_BATCH_WAIT_MS)
+pool = WorkerPool(kind=config.INFERENCE_POOL, max_workers=config.INFERENCE_WORKERS,
+                  max_queue=config.INFERENCE_QUEUE_SIZE, retry_after=config.RETRY_AFTER_SECONDS)
+cache = PredictionCache(max_entries=config.CACHE_MAX_ENTRIES, max_bytes=config.CACHE_MAX_MB * 1024 ** 2,
+                        ttl_seconds=config.CACHE_TTL_SECONDS, disk_path=config.CACHE_DISK_PATH)
+
+
+@app.exception_handler(PoolFullError)
+async def pool_full_handler(request: Request, exc: PoolFullError):
+    """Fast API exception handler rejecting requests when the worker pool is full.
+
+    Parameters
+    ----------
+    request: Request
+        Rejected request.
+    exc: PoolFullError
+        Raised exception.
+
+    Returns
+    -------
+    response: JSONResponse
+        503 response with Retry-After header.
+    """
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.exception_handler(InvalidImageError)
+async def invalid_image_handler(request: Request, exc: InvalidImageError):
+    """Fast API exception handler rejecting images that cannot be decoded.
+
+    Parameters
+    ----------
+    request: Request
+        Rejected request.
+    exc: InvalidImageError
+        Raised exception.
+
+    Returns
+    -------
+    response: JSONResponse
+        422 response describing why the image cannot be read.
+    """
+    return JSONResponse(status_code=422, content={"detail": str(exc)})
+
+
+def cached_prediction(digest: str, model_name: str):
+    """Function that looks up the prediction of an image computed with the current version of a model.
+
+    Parameters
+    ----------
+    digest: str
+        Content hash of the image, see prediction_cache.image_digest.
+    model_name: str
+        Name of the model.
+
+    Returns
+    -------
+    version: tuple
+        Current version of the model files.
+    prediction: np.ndarray or None
+        Cached prediction vector, None on a cache miss.
+    """
+    version = get_model_version(model_name)
+    return version, cache.get(digest, model_name, version)
+
+
+async def predict(image_data, model_name: str):
+    """Function that returns prediction vector for a given image without blocking the event loop.
+
+    Decoding, hashing and preprocessing run on the worker pool and the model runs through the micro-batcher.
+    Predictions are looked up in and stored to the prediction cache, keyed by content hash of the image and
+    version of the model file. Cache lookups and stores, which stat model files and may query SQLite, run on the
+    event loop's default executor, since the worker pool may be a process pool.
+
+    Parameters
+    ----------
+    image_data: str or bytes
+        Base64 encoded image or raw image file contents.
+    model_name: str
+        Name of the model used to make a prediction, currently supported models are: 'kidney_diagnose', 'chest_diagnose'.
+
+    Returns
+    -------
+    prediction: np.ndarray
+        Prediction vector.
+    """
+    image_bytes, digest = await asyncio.wrap_future(pool.submit(read_image_data, image_data))
+    version, prediction = await asyncio.to_thread(cached_prediction, digest, model_name)
+    if prediction is None:
+        img_array = await asyncio.wrap_future(pool.submit(prepare_image_bytes, image_bytes))
+        prediction = await asyncio.wrap_future(batcher.submit(img_array, model_name))
+        await asyncio.to_thread(cache.put, digest, model_name, version, prediction)
+    return prediction
+
+
+async def diagnose(image_data, model_name: str) -> Prediction:
+    """Function that applies prediction pipeline to a given image without blocking the event loop.
+
+    Parameters
+    ----------
+    image_data: str or bytes
+        Base64 encoded image or raw image file contents.
+    model_name: str
+        Name of the model used to make a prediction, currently supported models are: 'kidney_diagnose', 'chest_diagnose'.
+
+    Returns
+    -------
+    response: Prediction
+        Prediction response containing diagnosis and confidence.
+    """
+    with pool.admit():
+        prediction = await predict(image_data, model_name)
+    diagnosis, confidence = parse_prediction(prediction, model_name)
+    return Prediction(diagnosis=diagnosis, confidence=confidence)
 
 
 @app.post("/kidney")
@@ -29,8 +185,7 @@ async def get_kidney_diagnosis(data: ImageData):
     response: Prediction
         Prediction response containing diagnosis and confidence.
     """
-    diagnosis, confidence = prediction_pipeline(data.image, "kidney_diagnose")
-    response = Prediction(diagnosis=diagnosis, confidence=confidence)
+    response = await diagnose(data.image, "kidney_diagnose")
     return response
 
 
@@ -48,11 +203,287 @@ async def get_chest_diagnosis(data: ImageData):
         response: Prediction
             Prediction response containing diagnosis and confidence.
         """
-    diagnosis, confidence = prediction_pipeline(data.image, "chest_diagnose")
-    response = Prediction(diagnosis=diagnosis, confidence=confidence)
+    response = await diagnose(data.image, "chest_diagnose")
+    return response
+
+
+@app.post("/combined")
+async def get_combined_diagnosis(data: ImageData):
+    """Fast API endpoint for both kidney and chest diagnosis, sharing a single backbone pass.
+
+    Parameters
+    ----------
+    data: ImageData
+        Image data, encoded in base64.
+
+    Returns
+    -------
+    response: CombinedPrediction
+        Kidney and chest prediction responses.
+    """
+    with pool.admit():
+        prediction = await predict(data.image, COMBINED_MODEL)
+    predictions = split_prediction(prediction)
+    kidney_diagnosis, kidney_confidence = parse_prediction(predictions["kidney_diagnose"], "kidney_diagnose")
+    chest_diagnosis, chest_confidence = parse_prediction(predictions["chest_diagnose"], "chest_diagnose")
+    response = CombinedPrediction(kidney=Prediction(diagnosis=kidney_diagnosis, confidence=kidney_confidence),
+                                  chest=Prediction(diagnosis=chest_diagnosis, confidence=chest_confidence))
+    return response
+
+
+async def read_upload(request: Request) -> bytes:
+    """Function that reads an uploaded image from a raw or multipart request body.
+
+    Parameters
+    ----------
+    request: Request
+        Request with either an application/octet-stream body or a multipart/form-data body with the image
+        in its first file field.
+
+    Returns
+    -------
+    image_bytes: bytes
+        Contents of the uploaded image file.
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        upload = next((value for value in form.values() if hasattr(value, "read")), None)
+        if upload is None:
+            raise HTTPException(status_code=422, detail="No file in multipart request")
+        image_bytes = await upload.read()
+        await form.close()
+        return image_bytes
+    return await request.body()
+
+
+@app.post("/kidney/upload")
+async def upload_kidney_diagnosis(request: Request):
+    """Fast API endpoint for kidney diagnosis of an image sent as raw bytes or multipart upload.
+
+    Parameters
+    ----------
+    request: Request
+        Request with the image file as an application/octet-stream or multipart/form-data body.
+
+    Returns
+    -------
+    response: Prediction
+        Prediction response containing diagnosis and confidence.
+    """
+    response = await diagnose(await read_upload(request), "kidney_diagnose")
+    return response
+
+
+@app.post("/chest/upload")
+async def upload_chest_diagnosis(request: Request):
+    """Fast API endpoint for chest diagnosis of an image sent as raw bytes or multipart upload.
+
+    Parameters
+    ----------
+    request: Request
+        Request with the image file as an application/octet-stream or multipart/form-data body.
+
+    Returns
+    -------
+    response: Prediction
+        Prediction response containing diagnosis and confidence.
+    """
+    response = await diagnose(await read_upload(request), "chest_diagnose")
     return response
 
 
+async def spool_body(request: Request):
+    """Function that reads a whole request body into a temporary file.
+
+    The body has to be read before a streaming response is returned, reading it while the response is sent races
+    with the server listening for the client to disconnect.
+
+    Parameters
+    ----------
+    request: Request
+        Request whose body is read.
+
+    Returns
+    -------
+    body: tempfile.SpooledTemporaryFile
+        Body rewound to its start, held in memory up to STREAM_SPOOL_MEMORY_MB and on disk beyond.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=config.STREAM_SPOOL_MEMORY_MB * 1024 ** 2)
+    try:
+        async for data in request.stream():
+            body.write(data)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body
+
+
+def read_ndjson_images(lines, chunk_size: int):
+    """Function that parses base64 encoded images from NDJSON lines, one chunk at a time.
+
+    Parameters
+    ----------
+    lines: iterable of bytes
+        Lines with one ImageData JSON object each, e.g. a request body returned by spool_body.
+    chunk_size: int
+        Number of images yielded at once.
+
+    Yields
+    ------
+    chunk: list of tuple
+        At most chunk_size (image, error) pairs, one per non-empty line: the base64 encoded image and None, or
+        None and why the line is not a valid ImageData object.
+    """
+    chunk = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            chunk.append((ImageData.model_validate_json(line).image, None))
+        except ValidationError as error:
+            chunk.append((None, str(error)))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def diagnose_stream(body, model_name: str):
+    """Function that applies prediction pipeline to a stream of images, one chunk at a time.
+
+    Only a single chunk of images is held in memory, so memory use does not depend on the number of images.
+    Lines are read and parsed off the event loop, and an invalid line only fails its own image.
+
+    Parameters
+    ----------
+    body: file
+        Request body with one ImageData JSON object per line, returned by spool_body.
+    model_name: str
+        Name of the model used to make a prediction, currently supported models are: 'kidney_diagnose', 'chest_diagnose'.
+
+    Yields
+    ------
+    line: str
+        BatchPrediction of a single image serialized as an NDJSON line, in the order of the request.
+    """
+    chunks = read_ndjson_images(body, config.STREAM_CHUNK_SIZE)
+    index = 0
+    while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+        predictions = iter(await asyncio.gather(*(predict(image_data, model_name) for image_data, error in chunk
+                                                  if error is None), return_exceptions=True))
+        for _, error in chunk:
+            if error is None:
+                prediction = next(predictions)
+                if isinstance(prediction, BaseException):
+                    error = str(prediction)
+            if error is not None:
+                result = BatchPrediction(index=index, error=error)
+            else:
+                diagnosis, confidence = parse_prediction(prediction, model_name)
+                result = BatchPrediction(index=index, diagnosis=diagnosis, confidence=confidence)
+            yield result.model_dump_json(exclude_none=True) + "\n"
+            index += 1
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """Streaming response holding an admission to the worker pool and a spooled request body.
+
+    Both are freed once the response is sent, whether the stream ran to completion, failed, was cancelled by a
+    client disconnect or never started.
+
+    Parameters
+    ----------
+    content: async iterator
+        Stream of the response body.
+    body: file
+        Spooled request body closed with the response.
+    """
+
+    def __init__(self, content, body, **kwargs):
+        super().__init__(content, **kwargs)
+        self.spooled_body = body
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.spooled_body.close()
+            pool.release()
+
+
+async def batch_diagnosis(request: Request, model_name: str) -> StreamingResponse:
+    """Function that admits a batch request to the worker pool and starts streaming its predictions.
+
+    Parameters
+    ----------
+    request: Request
+        Request with one ImageData JSON object per line (NDJSON).
+    model_name: str
+        Name of the model used to make a prediction, currently supported models are: 'kidney_diagnose', 'chest_diagnose'.
+
+    Returns
+    -------
+    response: StreamingResponse
+        NDJSON stream with one BatchPrediction per image.
+    """
+    pool.acquire()
+    try:
+        body = await spool_body(request)
+    except BaseException:
+        pool.release()
+        raise
+    return AdmittedStreamingResponse(diagnose_stream(body, model_name), body, media_type="application/x-ndjson")
+
+
+@app.post("/kidney/batch")
+async def get_kidney_batch_diagnosis(request: Request):
+    """Fast API endpoint for kidney diagnosis of many images, streaming results while processing continues.
+
+    Parameters
+    ----------
+    request: Request
+        Request with one ImageData JSON object per line (NDJSON).
+
+    Returns
+    -------
+    response: StreamingResponse
+        NDJSON stream with one BatchPrediction per image.
+    """
+    return await batch_diagnosis(request, "kidney_diagnose")
+
+
+@app.post("/chest/batch")
+async def get_chest_batch_diagnosis(request: Request):
+    """Fast API endpoint for chest diagnosis of many images, streaming results while processing continues.
+
+    Parameters
+    ----------
+    request: Request
+        Request with one ImageData JSON object per line (NDJSON).
+
+    Returns
+    -------
+    response: StreamingResponse
+        NDJSON stream with one BatchPrediction per image.
+    """
+    return await batch_diagnosis(request, "chest_diagnose")
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Fast API endpoint exposing serving statistics.
+
+    Returns
+    -------
+    metrics: dict
+        Batch sizes and queue wait times achieved by the micro-batcher, prediction cache counters and models
+        currently loaded in memory.
+    """
+    return {"batching": batcher.stats(), "cache": cache.stats(), "models": registry.loaded()}
+
+
 if __name__ == '__main__':
     import uvicorn
 
@@ -0,0 +1,249 @@
+import os
+import threading
+from collections import OrderedDict
+
+import config
+from backends import get_backend
+
+
+def model_version(path: str) -> tuple[int, int]:
+    """Function that returns version of a model file on disk.
+
+    Parameters
+    ----------
+    path: str
+        Path to the model file or SavedModel directory.
+
+    Returns
+    -------
+    version: tuple of int
+        Modification time (in nanoseconds) and size of the file, changes whenever the file is replaced.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, 'saved_model.pb')
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def estimate_model_bytes(model, path: str) -> int:
+    """Function that estimates how much memory a loaded model occupies.
+
+    Parameters
+    ----------
+    model:
+        Loaded model.
+    path: str
+        Path of the file the model was loaded from, its size is used when the model exposes no weights.
+
+    Returns
+    -------
+    size: int
+        Estimated size of the model in bytes.
+    """
+    weights = getattr(model, 'weights', None)
+    if weights:
+        return int(sum(int(w.shape.num_elements()) * w.dtype.size for w in weights))
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded models.
+
+    Models are loaded on first use and kept in memory, keyed by their name and the version of the file they were
+    loaded from. When the file on disk changes, the new version is loaded next to the old one, which keeps serving
+    requests until the new model is ready and then gets swapped out atomically. Least recently used models are evicted
+    once the total estimated size of loaded models exceeds the memory limit.
+
+    Parameters
+    ----------
+    model_dir: str
+        Directory containing the model files.
+    memory_limit_bytes: int
+        Total estimated size of loaded models above which the least recently used ones are evicted.
+    backend: str
+        Inference backend the models are loaded with, see backends.BACKENDS.
+    variant: str
+        Suffix of the model files served instead of the original ones, e.g. '_student' for classifiers distilled by
+        training/distillation.py, empty for the original models.
+    """
+
+    def __init__(self, model_dir=config.MODEL_DIR, memory_limit_bytes=config.MODEL_MEMORY_LIMIT_MB * 1024 ** 2,
+                 backend=config.MODEL_BACKEND, variant=config.MODEL_VARIANT):
+        self.model_dir = model_dir
+        self.memory_limit_bytes = memory_limit_bytes
+        self.variant = variant
+        self.suffix, self.loader = get_backend(backend)
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def model_path(self, model_name: str) -> str:
+        """Method that returns path of the file a model is loaded from.
+
+        Parameters
+        ----------
+        model_name: str
+            Name of the model.
+
+        Returns
+        -------
+        path: str
+            Path to the model file exported for the registry's backend.
+        """
+        return os.path.join(self.model_dir, f"{model_name}{self.variant}{self.suffix}")
+
+    def version(self, model_name: str) -> tuple[int, int]:
+        """Method that returns the version of a model file on disk, without loading it.
+
+        Parameters
+        ----------
+        model_name: str
+            Name of the model.
+
+        Returns
+        -------
+        version: tuple of int
+            Version of the model file, see model_version.
+        """
+        return model_version(self.model_path(model_name))
+
+    def get(self, model_name: str):
+        """Method that returns the current version of a model, loading it if needed.
+
+        Parameters
+        ----------
+        model_name: str
+            Name of the model, currently supported models are: 'kidney_diagnose', 'chest_diagnose'.
+
+        Returns
+        -------
+        model:
+            Loaded model.
+        """
+        return self.get_with_version(model_name)[0]
+
+    def get_with_version(self, model_name: str):
+        """Method that returns the current version of a model together with its version.
+
+        While a new version of the model file is being loaded by another thread, the version already in memory is
+        returned instead of waiting for it. Only the first load of a model blocks its callers.
+
+        Parameters
+        ----------
+        model_name: str
+            Name of the model, currently supported models are: 'kidney_diagnose', 'chest_diagnose'.
+
+        Returns
+        -------
+        model:
+            Loaded model.
+        version: tuple of int
+            Version of the file the model was loaded from.
+        """
+        path = self.model_path(model_name)
+        version = self.version(model_name)
+
+        loaded = self.get_loaded(model_name)
+        if loaded is not None and loaded[0] == version:
+            return loaded[1], version
+
+        load_lock = self._load_lock(model_name)
+        if not load_lock.acquire(blocking=loaded is None):
+            return loaded[1], loaded[0]
+        try:
+            loaded = self.get_loaded(model_name)
+            if loaded is not None and loaded[0] == version:
+                return loaded[1], version
+            model = self.loader(path)
+            self.add(model_name, version, model, estimate_model_bytes(model, path))
+        finally:
+            load_lock.release()
+        return model, version
+
+    def get_loaded(self, model_name: str):
+        """Method that returns the model held in memory under a name, whatever its version, without loading it.
+
+        Parameters
+        ----------
+        model_name: str
+            Name of the model.
+
+        Returns
+        -------
+        loaded: tuple or None
+            Version and model, None if no version of the model is in memory.
+        """
+        with self._lock:
+            entry = self._models.get(model_name)
+            if entry is None:
+                return None
+            self._models.move_to_end(model_name)
+            return entry[0], entry[1]
+
+    def add(self, model_name: str, version, model, size: int) -> None:
+        """Method that holds a model in memory, replacing its previous version and counting it against the memory limit.
+
+        Models loaded outside of the registry, e.g. by shared_backbone.SharedBackbone, are added so that all models
+        share a single memory limit.
+
+        Parameters
+        ----------
+        model_name: str
+            Name of the model.
+        version:
+            Version of the files the model was loaded from.
+        model:
+            Loaded model.
+        size: int
+            Estimated size of the model in bytes, see estimate_model_bytes.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._models[model_name] = (version, model, size)
+            self._models.move_to_end(model_name)
+            self._evict()
+
+    def loaded(self) -> dict:
+        """Method that describes the models currently held in memory.
+
+        Returns
+        -------
+        loaded: dict
+            Mapping from model name to its version and estimated size in bytes, ordered from least to most
+            recently used.
+        """
+        with self._lock:
+            return {name: {"version": version, "bytes": size} for name, (version, _, size) in self._models.items()}
+
+    def evict(self, model_name: str) -> None:
+        """Method that removes a model from memory.
+
+        Parameters
+        ----------
+        model_name: str
+            Name of the model to remove.
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._models.pop(model_name, None)
+
+    def _load_lock(self, model_name):
+        with self._lock:
+            return self._load_locks.setdefault(model_name, threading.Lock())
+
+    def _evict(self):
+        total = sum(size for _, _, size in self._models.values())
+        while total > self.memory_limit_bytes and len(self._models) > 1:
+            _, (_, _, size) = self._models.popitem(last=False)
+            total -= size
+
+
+registry = ModelRegistry()
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+ENTRY_OVERHEAD_BYTES = 256
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """Function that computes content hash of an image.
+
+    Parameters
+    ----------
+    image_bytes: bytes
+        Contents of an image file.
+
+    Returns
+    -------
+    digest: str
+        Hex encoded SHA-256 hash of the image.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class PredictionCache:
+    """Content-addressed cache of prediction vectors.
+
+    Entries are keyed by the hash of the image file contents, the model name and the version of the model file,
+    and kept in memory in least recently used order, bounded both by the number of entries and their estimated
+    size. Entries older than ttl_seconds are treated as missing. When get sees a new version of a model, all entries
+    computed with its previous versions are dropped, and put ignores predictions of any other version. Optionally
+    entries are also written to an SQLite database, which survives restarts and is consulted on memory misses.
+
+    Parameters
+    ----------
+    max_entries: int
+        Maximum number of entries kept in memory.
+    max_bytes: int
+        Maximum estimated size of entries kept in memory.
+    ttl_seconds: float
+        Time after which entries expire, 0 disables expiration.
+    disk_path: str
+        Path of the SQLite database used as the on-disk tier, None disables it.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 ** 2, ttl_seconds=3600, disk_path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expirations": 0,
+                          "invalidations": 0}
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions (digest TEXT, model_name TEXT, version TEXT, "
+                             "prediction TEXT, created REAL, PRIMARY KEY (digest, model_name))")
+            self._db.commit()
+
+    def get(self, digest: str, model_name: str, version) -> np.ndarray | None:
+        """Method that returns a cached prediction vector.
+
+        Parameters
+        ----------
+        digest: str
+            Content hash of the image, see image_digest.
+        model_name: str
+            Name of the model.
+        version:
+            Version of the model file, see model_registry.model_version.
+
+        Returns
+        -------
+        prediction: np.ndarray or None
+            Cached prediction vector, None if there is no valid entry.
+        """
+        version = str(version)
+        with self._lock:
+            self._invalidate(model_name, version)
+            key = (digest, model_name)
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1]):
+                self._remove(key)
+                self._counters["expirations"] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return entry[0]
+
+            prediction = self._disk_get(digest, model_name, version)
+            if prediction is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._insert(key, prediction, time.time())
+            return prediction
+
+    def put(self, digest: str, model_name: str, version, prediction: np.ndarray) -> None:
+        """Method that stores a prediction vector, if it was computed with the version of the model last seen by get.
+
+        Parameters
+        ----------
+        digest: str
+            Content hash of the image, see image_digest.
+        model_name: str
+            Name of the model.
+        version:
+            Version of the model file the prediction was computed with.
+        prediction: np.ndarray
+            Prediction vector.
+
+        Returns
+        -------
+        None
+        """
+        version = str(version)
+        prediction = np.array(prediction)
+        created = time.time()
+        with self._lock:
+            if version != self._versions.get(model_name):
+                return
+            self._insert((digest, model_name), prediction, created)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)",
+                                 (digest, model_name, version, json.dumps(prediction.tolist()), created))
+                self._db.commit()
+
+    def stats(self) -> dict:
+        """Method that returns cache counters.
+
+        Returns
+        -------
+        stats: dict
+            Hit, miss, eviction, expiration and invalidation counters, number of entries and their estimated size.
+        """
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "bytes": self._bytes}
+
+    def _expired(self, created):
+        return self.ttl_seconds and time.time() - created > self.ttl_seconds
+
+    def _invalidate(self, model_name, version):
+        previous = self._versions.get(model_name)
+        if previous == version:
+            return
+        self._versions[model_name] = version
+        if previous is None:
+            return
+        for key in [key for key in self._entries if key[1] == model_name]:
+            self._remove(key)
+            self._counters["invalidations"] += 1
+        if self._db is not None:
+            self._db.execute("DELETE FROM predictions WHERE model_name = ? AND version != ?", (model_name, version))
+            self._db.commit()
+
+    def _disk_get(self, digest, model_name, version):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT prediction, created FROM predictions "
+                               "WHERE digest = ? AND model_name = ? AND version = ?",
+                               (digest, model_name, version)).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        return np.array(json.loads(row[0]), dtype=np.float32)
+
+    def _insert(self, key, prediction, created):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (prediction, created)
+        self._bytes += prediction.nbytes + ENTRY_OVERHEAD_BYTES
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    def _remove(self, key):
+        prediction, _ = self._entries.pop(key)
+        self._bytes -= prediction.nbytes + ENTRY_OVERHEAD_BYTES
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+import config
+from model_registry import estimate_model_bytes, model_version, registry
+
+SHARED_MODELS = ['kidney_diagnose', 'chest_diagnose']
+COMBINED_MODEL = 'combined_diagnose'
+
+
+def split_classifier(model):
+    """Function that splits a trained classifier into its convolutional backbone and its dense head.
+
+    Parameters
+    ----------
+    model: keras.models.Sequential
+        Classifier built by the training scripts: preprocessing layers, the VGG16 backbone and the head assembled by
+        assemble_kidney_classifier or assemble_chest_classifier.
+
+    Returns
+    -------
+    preprocessing: list of keras.layers.Layer
+        Layers before the backbone, without random augmentation layers, which do nothing at inference time.
+    backbone: keras.Model
+        Convolutional backbone.
+    head: keras.models.Sequential
+        Head taking backbone features as input.
+    """
+    index = next(i for i, layer in enumerate(model.layers) if isinstance(layer, tf.keras.Model))
+    preprocessing = [layer for layer in model.layers[:index] if not type(layer).__name__.startswith('Random')]
+    backbone = model.layers[index]
+    head = tf.keras.Sequential([tf.keras.Input(backbone.output_shape[1:])] + model.layers[index + 1:])
+    return preprocessing, backbone, head
+
+
+def layers_fingerprint(layers) -> str:
+    """Function that computes a hash of layers' configuration and weights.
+
+    Parameters
+    ----------
+    layers: list of keras.layers.Layer
+        Layers to hash.
+
+    Returns
+    -------
+    fingerprint: str
+        Hex encoded SHA-256 hash.
+    """
+    digest = hashlib.sha256()
+    for layer in layers:
+        digest.update(type(layer).__name__.encode())
+        for weight in layer.get_weights():
+            digest.update(np.ascontiguousarray(weight).tobytes())
+    return digest.hexdigest()
+
+
+class SharedBackbone:
+    """Serving model running several organ classifiers on a single instance of their common backbone.
+
+    The kidney and chest classifiers share the same frozen, ImageNet-weighted VGG16 behind an identical rescaling
+    layer. Only one copy of it is kept in memory, its 512-d output is computed once per batch and fed to the heads
+    of all requested classifiers. The models are reloaded when any of their .h5 files changes, requests arriving
+    meanwhile keep being served by the previously loaded models. Loaded models are held by the model registry under
+    COMBINED_MODEL, so they count against its memory limit and may be evicted like any other model.
+
+    Parameters
+    ----------
+    model_names: list of str
+        Names of the classifiers sharing the backbone.
+    model_dir: str
+        Directory containing the .h5 model files.
+    model_registry: model_registry.ModelRegistry
+        Registry holding the loaded models.
+    """
+
+    def __init__(self, model_names=SHARED_MODELS, model_dir=config.MODEL_DIR, model_registry=registry):
+        self.model_names = model_names
+        self.model_dir = model_dir
+        self.registry = model_registry
+        self._lock = threading.Lock()
+
+    def version(self) -> tuple:
+        """Method that returns versions of the .h5 files of all classifiers.
+
+        Returns
+        -------
+        version: tuple
+            Version of every model file, see model_registry.model_version.
+        """
+        return tuple(model_version(self._path(model_name)) for model_name in self.model_names)
+
+    def predict_on_batch(self, img_batch: np.ndarray, model_name: str = COMBINED_MODEL) -> np.ndarray:
+        """Method that returns prediction vectors for a batch of preprocessed images.
+
+        Parameters
+        ----------
+        img_batch: np.ndarray
+            Preprocessed images, in the format expected by the model (N, 150, 150, 3).
+        model_name: str
+            Name of one of the classifiers, or COMBINED_MODEL for all of them.
+
+        Returns
+        -------
+        predictions: np.ndarray
+            Prediction vectors, one row per image. For COMBINED_MODEL prediction vectors of all classifiers are
+            concatenated in the order of model_names, see prediction.split_prediction.
+        """
+        backbone, heads = self._load()
+        features = backbone(img_batch, training=False)
+        if model_name != COMBINED_MODEL:
+            return heads[model_name](features, training=False).numpy()
+        return np.concatenate([heads[name](features, training=False).numpy() for name in self.model_names], axis=1)
+
+    def _path(self, model_name):
+        return os.path.join(self.model_dir, f"{model_name}.h5")
+
+    def _load(self):
+        version = self.version()
+        loaded = self.registry.get_loaded(COMBINED_MODEL)
+        if loaded is not None and loaded[0] == version:
+            return loaded[1]
+
+        if not self._lock.acquire(blocking=loaded is None):
+            return loaded[1]
+        try:
+            loaded = self.registry.get_loaded(COMBINED_MODEL)
+            if loaded is not None and loaded[0] == version:
+                return loaded[1]
+
+            backbone, heads, fingerprint = None, {}, None
+            for model_name in self.model_names:
+                preprocessing, model_backbone, head = split_classifier(load_model(self._path(model_name)))
+                model_fingerprint = layers_fingerprint(preprocessing + [model_backbone])
+                if fingerprint is None:
+                    fingerprint = model_fingerprint
+                    backbone = tf.keras.Sequential([tf.keras.Input(model_backbone.input_shape[1:])] + preprocessing
+                                                   + [model_backbone])
+                elif model_fingerprint != fingerprint:
+                    raise ValueError(f"Backbone of {model_name} differs from {self.model_names[0]}, "
+                                     f"the models cannot share it")
+                heads[model_name] = head
+
+            size = estimate_model_bytes(backbone, self._path(self.model_names[0]))
+            size += sum(estimate_model_bytes(head, self._path(name)) for name, head in heads.items())
+            self.registry.add(COMBINED_MODEL, version, (backbone, heads), size)
+            return backbone, heads
+        finally:
+            self._lock.release()
+
+
+shared_backbone = SharedBackbone()
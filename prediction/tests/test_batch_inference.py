@@ -0,0 +1,49 @@
+import csv
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('tensorflow')
+
+from PIL import Image
+
+import batch_inference
+from batch_inference import run_batch_inference
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_inference, 'get_batch_prediction',
+                        lambda img_batch, model_name: np.tile([[0.1, 0.7, 0.1, 0.1]], (len(img_batch), 1)))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'images' / 'a').mkdir(parents=True)
+    for i in range(3):
+        Image.new('RGB', (40, 40), (i, i, i)).save(tmp_path / 'images' / 'a' / f'{i}.png')
+    (tmp_path / 'images' / 'a' / 'broken.png').write_bytes(b'not an image')
+    return tmp_path / 'images'
+
+
+@pytest.mark.parametrize('output', ['results.csv', 'results.jsonl'])
+def test_resume_matches_paths_given_in_any_form(images, output):
+    assert run_batch_inference(f'{images}/', output, ['kidney_diagnose'], chunk_size=2) == 4
+    assert run_batch_inference('images', output, ['kidney_diagnose']) == 0
+    assert run_batch_inference('./images/a/..', output, ['kidney_diagnose']) == 0
+
+    with open(output, newline='') as f:
+        if output.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f]
+        else:
+            rows = list(csv.DictReader(f))
+    assert len(rows) == 4
+    assert sum(1 for row in rows if row.get('error')) == 1
+    assert {row['kidney_diagnose_diagnosis'] for row in rows if not row.get('error')} == {'Normal'}
+
+
+@pytest.mark.parametrize('output', ['results.csv', 'results.jsonl'])
+def test_resume_with_other_models_is_refused(images, output):
+    run_batch_inference('images', output, ['kidney_diagnose'])
+    (images / 'a' / '3.png').write_bytes((images / 'a' / '0.png').read_bytes())
+
+    with pytest.raises(ValueError, match='other models'):
+        run_batch_inference('images', output, ['kidney_diagnose', 'chest_diagnose'])
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from batching import MicroBatcher
+
+
+class RecordingModel:
+    def __init__(self):
+        self.batch_sizes = []
+        self.lock = threading.Lock()
+
+    def __call__(self, img_batch, model_name):
+        with self.lock:
+            self.batch_sizes.append(len(img_batch))
+        return img_batch.reshape(len(img_batch), -1).sum(axis=1, keepdims=True)
+
+
+def images(values):
+    return np.array(values, dtype=np.float32).reshape(len(values), 1, 1, 1)
+
+
+def test_full_batch_is_flushed_without_waiting():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=10000)
+
+    start = time.perf_counter()
+    futures = [batcher.submit(images([i]), 'kidney_diagnose') for i in range(4)]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert time.perf_counter() - start < 5
+    assert model.batch_sizes == [4]
+    assert [float(result[0, 0]) for result in results] == [0, 1, 2, 3]
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=16, max_wait_ms=50)
+
+    start = time.perf_counter()
+    result = batcher.submit(images([7]), 'kidney_diagnose').result(timeout=5)
+
+    assert 0.05 <= time.perf_counter() - start < 5
+    assert model.batch_sizes == [1]
+    assert float(result[0, 0]) == 7
+    assert batcher.stats()['kidney_diagnose']['queue_wait_ms']['max'] >= 50
+
+
+def test_request_that_would_overflow_starts_next_batch():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=500)
+
+    first = batcher.submit(images([1, 2, 3]), 'kidney_diagnose')
+    second = batcher.submit(images([4, 5]), 'kidney_diagnose')
+    third = batcher.submit(images([6]), 'kidney_diagnose')
+
+    assert first.result(timeout=5).ravel().tolist() == [1, 2, 3]
+    assert second.result(timeout=5).ravel().tolist() == [4, 5]
+    assert third.result(timeout=5).ravel().tolist() == [6]
+    assert model.batch_sizes == [3, 3]
+
+
+def test_oversized_request_runs_alone():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=2, max_wait_ms=500)
+
+    oversized = batcher.submit(images([1, 2, 3]), 'chest_diagnose')
+    small = batcher.submit(images([4]), 'chest_diagnose')
+
+    assert oversized.result(timeout=5).ravel().tolist() == [1, 2, 3]
+    assert small.result(timeout=5).ravel().tolist() == [4]
+    assert model.batch_sizes == [3, 1]
+
+
+def test_shutdown_processes_pending_requests_and_stops_workers():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=10000)
+    running = set(threading.enumerate())
+
+    futures = [batcher.submit(images([i]), name) for i, name in enumerate(['kidney_diagnose', 'chest_diagnose'])]
+    workers = set(threading.enumerate()) - running
+    batcher.shutdown()
+
+    assert [float(future.result(timeout=0)[0, 0]) for future in futures] == [0, 1]
+    assert len(workers) == 2 and not any(worker.is_alive() for worker in workers)
+    with pytest.raises(RuntimeError):
+        batcher.submit(images([2]), 'kidney_diagnose')
+
+
+def test_cancelled_request_does_not_stop_the_worker():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=100)
+
+    cancelled = batcher.submit(images([1]), 'kidney_diagnose')
+    assert cancelled.cancel()
+    time.sleep(0.2)
+
+    assert batcher.submit(images([2]), 'kidney_diagnose').result(timeout=2).ravel().tolist() == [2]
+    assert model.batch_sizes == [1]
+
+
+def test_failing_model_does_not_stop_the_worker():
+    calls = []
+
+    def predict(img_batch, model_name):
+        calls.append(len(img_batch))
+        if len(calls) == 1:
+            raise ValueError("model failed")
+        return img_batch.reshape(len(img_batch), -1)
+
+    batcher = MicroBatcher(predict, max_batch_size=1, max_wait_ms=0)
+
+    with pytest.raises(ValueError):
+        batcher.submit(images([1]), 'kidney_diagnose').result(timeout=2)
+    assert batcher.submit(images([2]), 'kidney_diagnose').result(timeout=2).ravel().tolist() == [2]
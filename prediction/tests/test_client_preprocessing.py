@@ -0,0 +1,47 @@
+import io
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('tensorflow')
+pytest.importorskip('tkinter')
+pytest.importorskip('reportlab')
+pytest.importorskip('requests')
+
+from PIL import Image
+
+from prediction import is_preprocessed, prepare_image_bytes
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'gui'))
+import gui
+
+IMAGES = [('JPEG', 'RGB', (1600, 1200)), ('JPEG', 'L', (900, 700)), ('PNG', 'L', (512, 512)),
+          ('PNG', 'RGBA', (400, 300)), ('PNG', 'RGB', (120, 90))]
+
+
+def image_file(tmp_path, image_format, mode, size):
+    rng = np.random.RandomState(0)
+    channels = {'L': (), 'RGB': (3,), 'RGBA': (4,)}[mode]
+    pixels = rng.randint(0, 256, (size[1], size[0]) + channels, dtype=np.uint8)
+    path = tmp_path / f'scan.{image_format.lower()}'
+    Image.fromarray(pixels, mode).save(path, format=image_format)
+    return str(path)
+
+
+@pytest.mark.parametrize('image_format, mode, size', IMAGES)
+def test_client_resize_matches_server(tmp_path, image_format, mode, size):
+    path = image_file(tmp_path, image_format, mode, size)
+    payload = gui.encode_preprocessed(path)
+    with open(path, 'rb') as f:
+        expected = prepare_image_bytes(f.read())
+
+    assert is_preprocessed(payload)
+    np.testing.assert_array_equal(prepare_image_bytes(payload), expected)
+
+
+def test_client_payload_is_smaller_than_large_images(tmp_path):
+    path = image_file(tmp_path, 'PNG', 'RGB', (1024, 1024))
+
+    assert len(gui.encode_preprocessed(path)) < os.path.getsize(path)
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+PREDICTION_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_config(**environment):
+    env = {name: value for name, value in os.environ.items()
+           if name not in ('SHARED_BACKBONE', 'MODEL_BACKEND', 'MODEL_VARIANT')}
+    env.update(environment)
+    return subprocess.run([sys.executable, '-c', 'import config'], cwd=PREDICTION_DIR, env=env,
+                          capture_output=True, text=True)
+
+
+@pytest.mark.parametrize('environment', [{'MODEL_BACKEND': 'tflite'}, {'MODEL_BACKEND': 'savedmodel'},
+                                         {'MODEL_VARIANT': 'int8'}])
+def test_shared_backbone_rejects_other_backends_and_variants(environment):
+    result = import_config(SHARED_BACKBONE='1', **environment)
+
+    assert result.returncode != 0
+    assert 'SHARED_BACKBONE=1' in result.stderr
+
+
+@pytest.mark.parametrize('environment', [{'SHARED_BACKBONE': '1'}, {'MODEL_BACKEND': 'tflite'},
+                                         {'SHARED_BACKBONE': '1', 'MODEL_BACKEND': 'keras'}])
+def test_supported_combinations_are_accepted(environment):
+    assert import_config(**environment).returncode == 0
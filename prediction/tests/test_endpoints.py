@@ -0,0 +1,177 @@
+import asyncio
+import base64
+import io
+import json
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('fastapi')
+pytest.importorskip('tensorflow')
+
+from PIL import Image
+
+import config
+import fastApiEndpoints
+from batching import MicroBatcher
+from prediction_cache import PredictionCache
+from worker_pool import WorkerPool
+
+
+class SlowModel:
+    def __init__(self, delay=0.3):
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, img_batch, model_name):
+        self.calls += 1
+        time.sleep(self.delay)
+        return np.tile(np.array([[0.1, 0.7, 0.1, 0.1]], dtype=np.float32), (len(img_batch), 1))
+
+
+def png_bytes(value):
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), (value, value, value)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def multipart(contents, boundary='test-boundary'):
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="scan.png"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + contents + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def image_json(value):
+    return json.dumps({'image': base64.b64encode(png_bytes(value)).decode()}).encode()
+
+
+async def call(path, body=b'', content_type='application/json', disconnect_after_first_chunk=False):
+    messages = []
+    first_chunk = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        if disconnect_after_first_chunk:
+            await first_chunk.wait()
+            # Let the next chunk reach the micro-batcher before disconnecting
+            await asyncio.sleep(0.15)
+        else:
+            await asyncio.Event().wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+        if message['type'] == 'http.response.body' and message.get('body'):
+            first_chunk.set()
+
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST', 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+             'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())],
+             'client': ('testclient', 50000), 'server': ('testserver', 80)}
+    await asyncio.wait_for(fastApiEndpoints.app(scope, receive, send), timeout=10)
+    start = next(message for message in messages if message['type'] == 'http.response.start')
+    headers = {name.decode().lower(): value.decode() for name, value in start['headers']}
+    content = b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+    return start['status'], headers, content
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = SlowModel()
+    batcher = MicroBatcher(model, max_batch_size=1, max_wait_ms=0)
+    monkeypatch.setattr(fastApiEndpoints, 'batcher', batcher)
+    monkeypatch.setattr(fastApiEndpoints, 'cache', PredictionCache())
+    monkeypatch.setattr(fastApiEndpoints, 'get_model_version', lambda model_name: (1,))
+    yield model
+    batcher.shutdown()
+
+
+def test_client_disconnecting_mid_stream_does_not_break_later_requests(model, monkeypatch):
+    monkeypatch.setattr(config, 'STREAM_CHUNK_SIZE', 2)
+    lines = b'\n'.join(image_json(value) for value in range(6))
+
+    status, _, content = asyncio.run(call('/kidney/batch', lines, 'application/x-ndjson',
+                                          disconnect_after_first_chunk=True))
+    assert status == 200
+    assert len(content.splitlines()) < 6
+
+    status, _, content = asyncio.run(call('/kidney', image_json(200)))
+    assert status == 200
+    assert json.loads(content)['diagnosis'] == 'Normal'
+
+
+@pytest.mark.parametrize('path, content_type', [('/kidney', 'application/json'),
+                                                ('/kidney/batch', 'application/x-ndjson')])
+def test_saturated_pool_rejects_requests_with_retry_after(model, monkeypatch, path, content_type):
+    pool = WorkerPool(max_workers=1, max_queue=0, retry_after=7)
+    monkeypatch.setattr(fastApiEndpoints, 'pool', pool)
+    pool.acquire()
+
+    status, headers, content = asyncio.run(call(path, image_json(10), content_type))
+    assert status == 503
+    assert headers['retry-after'] == '7'
+    assert json.loads(content)['detail'] == 'Inference queue is full'
+
+    pool.release()
+    status, _, _ = asyncio.run(call(path, image_json(10), content_type))
+    assert status == 200
+    pool.shutdown()
+
+
+def test_lifespan_stops_batcher_and_pool(model, monkeypatch):
+    pool = WorkerPool(max_workers=1)
+    monkeypatch.setattr(fastApiEndpoints, 'pool', pool)
+
+    async def serve():
+        async with fastApiEndpoints.lifespan(fastApiEndpoints.app):
+            return await call('/kidney', image_json(20))
+
+    status, _, _ = asyncio.run(serve())
+    assert status == 200
+    with pytest.raises(RuntimeError):
+        fastApiEndpoints.batcher.submit(np.zeros((1, 150, 150, 3), dtype=np.float32), 'kidney_diagnose')
+    with pytest.raises(RuntimeError):
+        pool.submit(abs, -1)
+
+
+@pytest.mark.parametrize('multipart_upload', [False, True])
+def test_uploads_are_diagnosed(model, multipart_upload):
+    body, content_type = (multipart(png_bytes(30)) if multipart_upload
+                          else (png_bytes(30), 'application/octet-stream'))
+
+    status, _, content = asyncio.run(call('/chest/upload', body, content_type))
+
+    assert status == 200
+    assert json.loads(content) == {'diagnosis': 'Large cell carcinoma', 'confidence': pytest.approx(0.7)}
+
+
+@pytest.mark.parametrize('multipart_upload', [False, True])
+def test_corrupt_uploads_are_rejected(model, multipart_upload):
+    corrupt = png_bytes(40)[:60]
+    body, content_type = multipart(corrupt) if multipart_upload else (corrupt, 'application/octet-stream')
+
+    status, _, content = asyncio.run(call('/kidney/upload', body, content_type))
+
+    assert status == 422
+    assert 'Cannot read image' in json.loads(content)['detail']
+    assert model.calls == 0
+
+
+def test_decompression_bombs_are_rejected(model, monkeypatch):
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 100)
+
+    status, _, content = asyncio.run(call('/kidney/upload', png_bytes(50), 'application/octet-stream'))
+
+    assert status == 422
+    assert 'decompression bomb' in json.loads(content)['detail']
+
+
+def test_invalid_base64_is_rejected(model):
+    status, _, _ = asyncio.run(call('/kidney', b'{"image": "not base64!"}'))
+
+    assert status == 422
@@ -0,0 +1,94 @@
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from model_registry import ModelRegistry
+
+
+class Loader:
+    def __init__(self):
+        self.loads = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def __call__(self, path):
+        self.started.set()
+        self.release.wait(timeout=5)
+        with open(path) as f:
+            model = f.read()
+        self.loads.append(model)
+        return model
+
+
+def write_model(model_dir, model_name, contents, mtime):
+    path = os.path.join(model_dir, f'{model_name}.h5')
+    with open(path, 'w') as f:
+        f.write(contents)
+    os.utime(path, ns=(mtime, mtime))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = ModelRegistry(model_dir=str(tmp_path), memory_limit_bytes=1024, backend='keras', variant='')
+    registry.loader = Loader()
+    return registry
+
+
+def test_model_is_loaded_once_per_version(registry, tmp_path):
+    write_model(tmp_path, 'kidney_diagnose', 'v1', 1)
+
+    assert registry.get('kidney_diagnose') == 'v1'
+    assert registry.get('kidney_diagnose') == 'v1'
+    assert registry.loader.loads == ['v1']
+
+    write_model(tmp_path, 'kidney_diagnose', 'v2', 2)
+
+    assert registry.get_with_version('kidney_diagnose') == ('v2', registry.version('kidney_diagnose'))
+    assert registry.loader.loads == ['v1', 'v2']
+
+
+def test_old_version_serves_while_new_version_loads(registry, tmp_path):
+    write_model(tmp_path, 'kidney_diagnose', 'v1', 1)
+    old_version = registry.get_with_version('kidney_diagnose')[1]
+    write_model(tmp_path, 'kidney_diagnose', 'v2', 2)
+    registry.loader.release.clear()
+    registry.loader.started.clear()
+
+    reload = threading.Thread(target=registry.get, args=('kidney_diagnose',))
+    reload.start()
+    assert registry.loader.started.wait(timeout=5)
+
+    assert registry.get_with_version('kidney_diagnose') == ('v1', old_version)
+
+    registry.loader.release.set()
+    reload.join(timeout=5)
+    assert registry.get('kidney_diagnose') == 'v2'
+    assert registry.loader.loads == ['v1', 'v2']
+
+
+def test_least_recently_used_model_is_evicted(registry, tmp_path):
+    registry.memory_limit_bytes = 1000
+    write_model(tmp_path, 'kidney_diagnose', 'k' * 400, 1)
+    write_model(tmp_path, 'chest_diagnose', 'c' * 400, 1)
+    write_model(tmp_path, 'combined_diagnose', 'b' * 400, 1)
+
+    registry.get('kidney_diagnose')
+    registry.get('chest_diagnose')
+    registry.get('kidney_diagnose')
+    registry.get('combined_diagnose')
+
+    assert list(registry.loaded()) == ['kidney_diagnose', 'combined_diagnose']
+    assert registry.get_loaded('chest_diagnose') is None
+
+
+def test_added_models_count_against_the_memory_limit(registry, tmp_path):
+    write_model(tmp_path, 'kidney_diagnose', 'k' * 400, 1)
+    registry.get('kidney_diagnose')
+
+    registry.add('combined_diagnose', (1, 1), object(), 900)
+
+    assert list(registry.loaded()) == ['combined_diagnose']
@@ -0,0 +1,39 @@
+import io
+
+import pytest
+
+pytest.importorskip('fastapi')
+pytest.importorskip('tensorflow')
+
+from fastApiEndpoints import read_ndjson_images
+
+
+def test_lines_are_chunked_in_order():
+    lines = io.BytesIO(b''.join(b'{"image": "img%d"}\n' % i for i in range(5)))
+
+    chunks = list(read_ndjson_images(lines, chunk_size=2))
+
+    assert [[image for image, _ in chunk] for chunk in chunks] == [['img0', 'img1'], ['img2', 'img3'], ['img4']]
+    assert all(error is None for chunk in chunks for _, error in chunk)
+
+
+def test_blank_lines_are_skipped_and_last_line_needs_no_newline():
+    lines = io.BytesIO(b'\n{"image": "a"}\n  \n{"image": "b"}')
+
+    chunks = list(read_ndjson_images(lines, chunk_size=16))
+
+    assert chunks == [[('a', None), ('b', None)]]
+
+
+def test_invalid_lines_fail_only_themselves():
+    lines = io.BytesIO(b'{"image": "a"}\nnot json\n{"other": 1}\n{"image": "b"}\n')
+
+    (chunk,) = read_ndjson_images(lines, chunk_size=16)
+
+    assert [image for image, _ in chunk] == ['a', None, None, 'b']
+    assert chunk[0][1] is None and chunk[3][1] is None
+    assert chunk[1][1] and chunk[2][1]
+
+
+def test_empty_body_yields_nothing():
+    assert list(read_ndjson_images(io.BytesIO(b''), chunk_size=4)) == []
@@ -0,0 +1,109 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import prediction_cache
+from prediction_cache import ENTRY_OVERHEAD_BYTES, PredictionCache
+
+PREDICTION = np.array([0.1, 0.2, 0.3, 0.4], dtype=np.float32)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prediction_cache.time, 'time', clock)
+    return clock
+
+
+def test_hit_after_put():
+    cache = PredictionCache()
+    assert cache.get('a', 'kidney_diagnose', 1) is None
+
+    cache.put('a', 'kidney_diagnose', 1, PREDICTION)
+
+    np.testing.assert_array_equal(cache.get('a', 'kidney_diagnose', 1), PREDICTION)
+    assert cache.get('a', 'chest_diagnose', 1) is None
+    assert cache.stats()['hits'] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = PredictionCache(ttl_seconds=10)
+    cache.get('a', 'kidney_diagnose', 1)
+    cache.put('a', 'kidney_diagnose', 1, PREDICTION)
+
+    clock.now += 10
+    assert cache.get('a', 'kidney_diagnose', 1) is not None
+    clock.now += 1
+    assert cache.get('a', 'kidney_diagnose', 1) is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_least_recently_used_entry_is_evicted_by_count():
+    cache = PredictionCache(max_entries=2)
+    cache.get('a', 'kidney_diagnose', 1)
+    cache.put('a', 'kidney_diagnose', 1, PREDICTION)
+    cache.put('b', 'kidney_diagnose', 1, PREDICTION)
+    cache.get('a', 'kidney_diagnose', 1)
+
+    cache.put('c', 'kidney_diagnose', 1, PREDICTION)
+
+    assert cache.get('b', 'kidney_diagnose', 1) is None
+    assert cache.get('a', 'kidney_diagnose', 1) is not None
+    assert cache.get('c', 'kidney_diagnose', 1) is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_are_evicted_by_size():
+    cache = PredictionCache(max_bytes=2 * (PREDICTION.nbytes + ENTRY_OVERHEAD_BYTES))
+    cache.get('a', 'kidney_diagnose', 1)
+    for digest in 'abc':
+        cache.put(digest, 'kidney_diagnose', 1, PREDICTION)
+
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['bytes'] == 2 * (PREDICTION.nbytes + ENTRY_OVERHEAD_BYTES)
+    assert cache.get('a', 'kidney_diagnose', 1) is None
+
+
+def test_new_version_invalidates_only_its_model():
+    cache = PredictionCache()
+    cache.get('a', 'kidney_diagnose', 1)
+    cache.get('a', 'chest_diagnose', 1)
+    cache.put('a', 'kidney_diagnose', 1, PREDICTION)
+    cache.put('a', 'chest_diagnose', 1, PREDICTION)
+
+    assert cache.get('a', 'kidney_diagnose', 2) is None
+    assert cache.get('a', 'kidney_diagnose', 1) is None
+    assert cache.get('a', 'chest_diagnose', 1) is not None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_put_of_stale_version_neither_stores_nor_invalidates():
+    cache = PredictionCache()
+    cache.get('a', 'kidney_diagnose', 2)
+    cache.put('a', 'kidney_diagnose', 2, PREDICTION)
+
+    cache.put('b', 'kidney_diagnose', 1, PREDICTION)
+
+    assert cache.get('b', 'kidney_diagnose', 2) is None
+    assert cache.get('a', 'kidney_diagnose', 2) is not None
+    assert cache.stats()['invalidations'] == 0
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    disk_path = str(tmp_path / 'cache.sqlite')
+    cache = PredictionCache(disk_path=disk_path)
+    cache.get('a', 'kidney_diagnose', 1)
+    cache.put('a', 'kidney_diagnose', 1, PREDICTION)
+
+    restarted = PredictionCache(disk_path=disk_path)
+
+    np.testing.assert_allclose(restarted.get('a', 'kidney_diagnose', 1), PREDICTION)
+    assert restarted.stats()['disk_hits'] == 1
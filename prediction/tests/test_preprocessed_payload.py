@@ -0,0 +1,55 @@
+import zlib
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('tensorflow')
+
+from benchmark import synthetic_ct_image
+from prediction import (PREPROCESSED_HEADER, PREPROCESSED_MAGIC, decode_image_bytes, decode_preprocessed,
+                        encode_preprocessed, is_preprocessed, prepare_image_bytes, preprocess_batch,
+                        resize_for_model)
+
+
+def payload(mode, size=600):
+    return encode_preprocessed(resize_for_model(decode_image_bytes(synthetic_ct_image('JPEG', mode, size))))
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+def test_round_trip_gives_resized_pixels(mode):
+    resized = resize_for_model(decode_image_bytes(synthetic_ct_image('JPEG', mode, 600)))
+    out = np.empty((150, 150, 3), dtype=np.uint8)
+
+    decode_preprocessed(encode_preprocessed(resized), out)
+
+    pixels = np.asarray(resized)
+    expected = np.repeat(pixels[:, :, np.newaxis], 3, axis=2) if mode == 'L' else pixels
+    np.testing.assert_array_equal(out, expected)
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+def test_payload_is_predicted_like_the_image_file(mode):
+    image_bytes = synthetic_ct_image('JPEG', mode, 600)
+    encoded = payload(mode)
+
+    assert is_preprocessed(encoded) and not is_preprocessed(image_bytes)
+    batch = prepare_image_bytes(encoded)
+    assert batch.dtype == np.float32
+    np.testing.assert_array_equal(batch, preprocess_batch([decode_image_bytes(image_bytes)]))
+
+
+def test_payload_is_small():
+    assert len(payload('L')) < 150 * 150
+
+
+@pytest.mark.parametrize('encoded', [
+    PREPROCESSED_MAGIC,
+    PREPROCESSED_HEADER.pack(PREPROCESSED_MAGIC, 3, 224, 224) + zlib.compress(bytes(224 * 224 * 3)),
+    PREPROCESSED_HEADER.pack(PREPROCESSED_MAGIC, 4, 150, 150) + zlib.compress(bytes(150 * 150 * 4)),
+    PREPROCESSED_HEADER.pack(PREPROCESSED_MAGIC, 3, 150, 150) + zlib.compress(bytes(150 * 150 * 3 - 1)),
+    PREPROCESSED_HEADER.pack(PREPROCESSED_MAGIC, 3, 150, 150) + zlib.compress(bytes(100 * 1024 ** 2)),
+    PREPROCESSED_HEADER.pack(PREPROCESSED_MAGIC, 3, 150, 150) + b'not zlib',
+])
+def test_invalid_payloads_are_rejected(encoded):
+    with pytest.raises(ValueError):
+        decode_preprocessed(encoded, np.empty((150, 150, 3), dtype=np.uint8))
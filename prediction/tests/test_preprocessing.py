@@ -0,0 +1,50 @@
+import io
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('tensorflow')
+
+from PIL import Image
+
+from benchmark import synthetic_ct_image
+from prediction import PREPROCESS_TOLERANCE, decode_image_bytes, preprocess_batch, preprocessing_deviation
+
+
+@pytest.mark.parametrize('image_format', ['PNG', 'JPEG'])
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+@pytest.mark.parametrize('size', [150, 256, 449])
+def test_images_below_reducing_gap_match_reference_exactly(image_format, mode, size):
+    assert preprocessing_deviation(synthetic_ct_image(image_format, mode, size)) == 0.0
+
+
+@pytest.mark.parametrize('image_format', ['PNG', 'JPEG'])
+@pytest.mark.parametrize('mode', ['L', 'RGB'])
+@pytest.mark.parametrize('size', [512, 1024, 2048])
+def test_large_images_stay_within_tolerance(image_format, mode, size):
+    assert preprocessing_deviation(synthetic_ct_image(image_format, mode, size)) <= PREPROCESS_TOLERANCE
+
+
+@pytest.mark.parametrize('size', [1024, 3000])
+def test_large_photo_stays_within_tolerance(size):
+    cbook = pytest.importorskip('matplotlib.cbook')
+    with Image.open(cbook.get_sample_data('grace_hopper.jpg')) as photo:
+        photo = photo.convert('RGB').resize((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    photo.save(buffer, format='JPEG', quality=90)
+
+    assert preprocessing_deviation(buffer.getvalue()) <= PREPROCESS_TOLERANCE
+
+
+def test_batch_is_written_into_given_buffer():
+    images = [decode_image_bytes(synthetic_ct_image('PNG', mode, 300, seed))
+              for seed, mode in enumerate(['L', 'RGB', 'L'])]
+    out = np.full((4, 150, 150, 3), -1, dtype=np.float32)
+
+    batch = preprocess_batch(images, out)
+
+    assert batch.dtype == np.float32 and batch.shape == (3, 150, 150, 3)
+    assert np.shares_memory(batch, out)
+    assert (out[3] == -1).all()
+    assert (batch[0, :, :, 0] == batch[0, :, :, 2]).all()
+    np.testing.assert_array_equal(batch, preprocess_batch(images))
@@ -0,0 +1,111 @@
+import contextlib
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class PoolFullError(Exception):
+    """Raised when a request arrives while the worker pool queue is full.
+
+    Parameters
+    ----------
+    retry_after: int
+        Number of seconds the client should wait before retrying.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    """Bounded pool running blocking decoding, preprocessing and inference work off the event loop.
+
+    At most max_workers + max_queue requests are admitted at the same time, further requests fail fast with
+    PoolFullError instead of waiting in an ever-growing queue.
+
+    Parameters
+    ----------
+    kind: str
+        Type of the pool: 'thread' or 'process'.
+    max_workers: int
+        Number of workers.
+    max_queue: int
+        Number of admitted requests allowed to wait for a free worker.
+    retry_after: int
+        Number of seconds rejected clients are asked to wait before retrying.
+    """
+
+    def __init__(self, kind='thread', max_workers=4, max_queue=64, retry_after=1):
+        if kind == 'thread':
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        elif kind == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f"Unsupported pool kind: {kind}, expected 'thread' or 'process'")
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+    def acquire(self) -> None:
+        """Method that admits a request to the pool, it has to be followed by a call to release.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        PoolFullError
+            If the maximum number of requests is already admitted.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PoolFullError(self.retry_after)
+
+    def release(self) -> None:
+        """Method that frees the place of a request admitted with acquire.
+
+        Returns
+        -------
+        None
+        """
+        self._slots.release()
+
+    @contextlib.contextmanager
+    def admit(self):
+        """Method that admits a request to the pool for the duration of the with block.
+
+        Raises
+        ------
+        PoolFullError
+            If the maximum number of requests is already admitted.
+        """
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def submit(self, fn, *args) -> Future:
+        """Method that runs a function on one of the workers.
+
+        Parameters
+        ----------
+        fn: callable
+            Function to run, must be picklable for process pools.
+        args:
+            Arguments passed to the function.
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            Future resolved with the function's result.
+        """
+        return self._executor.submit(fn, *args)
+
+    def shutdown(self) -> None:
+        """Method that stops the workers after they finish their current work.
+
+        Returns
+        -------
+        None
+        """
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,316 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import hashlib
+import shutil
+import sys
+
+import numpy as np
+from keras import Sequential
+from keras.layers import Input, RandomZoom, Rescaling
+from keras.optimizers import Adam
+from keras.callbacks import LearningRateScheduler
+from tensorflow.keras.applications.vgg16 import VGG16
+
+from model import assemble_chest_classifier, assemble_kidney_classifier
+from training_utils import load_images, step_decay
+
+ORGANS = {
+    'kidney': {
+        'images_dir': 'CT-KIDNEY-DATASET-Normal-Cyst-Tumor-Stone',
+        'assemble': assemble_kidney_classifier,
+        'assemble_kwargs': {'num_classes': 4, 'first_dense_neurons': 512, 'dropout': 0.5},
+        'learning_rate': 0.0001,
+        'epochs': 15,
+        'lr_schedule': None,
+        'zoom': None,
+        'model_path': 'kidney_diagnose.h5',
+    },
+    'chest': {
+        'images_dir': 'ChestCT',
+        'assemble': assemble_chest_classifier,
+        'assemble_kwargs': {'num_classes': 4, 'first_dense_neurons': 512},
+        'learning_rate': 0.001,
+        'epochs': 60,
+        'lr_schedule': step_decay,
+        'zoom': 0.1,
+        'model_path': 'chest_diagnose.h5',
+    },
+}
+
+
+def build_feature_extractor(input_shape=(150, 150, 3)) -> Sequential:
+    """Function that builds the frozen part of the classifiers: rescaling and the ImageNet-weighted VGG16.
+
+    Parameters
+    ----------
+    input_shape: tuple of int
+        Shape of input images.
+
+    Returns
+    -------
+    model: keras.models.Sequential
+        Model mapping images to 512-d features.
+    """
+    pretrained_model = VGG16(include_top=False,
+                             input_shape=input_shape,
+                             pooling='max', classes=4,
+                             weights='imagenet')
+    pretrained_model.trainable = False
+    return Sequential([
+        Rescaling(1. / 255, input_shape=input_shape),
+        pretrained_model
+    ])
+
+
+def backbone_hash(model) -> str:
+    """Function that computes a hash of a model's weights.
+
+    Parameters
+    ----------
+    model: keras.Model
+        Model to hash.
+
+    Returns
+    -------
+    digest: str
+        Hex encoded SHA-256 hash.
+    """
+    digest = hashlib.sha256()
+    for weight in model.get_weights():
+        digest.update(str(weight.shape).encode())
+        digest.update(np.ascontiguousarray(weight).tobytes())
+    return digest.hexdigest()
+
+
+def dataset_hash(dataset, image_size) -> str:
+    """Function that computes a hash identifying the files of a dataset.
+
+    Parameters
+    ----------
+    dataset: tf.data.Dataset
+        Dataset returned by load_images, exposing file_paths, or fingerprint for packed datasets.
+    image_size: tuple of int
+        Size the images are resized to.
+
+    Returns
+    -------
+    digest: str
+        Hex encoded SHA-256 hash of image size and path, size and modification time of every file, or of image size
+        and fingerprint of a packed dataset.
+    """
+    digest = hashlib.sha256(str(tuple(image_size)).encode())
+    if getattr(dataset, 'fingerprint', None):
+        digest.update(dataset.fingerprint.encode())
+        return digest.hexdigest()
+    for path in sorted(dataset.file_paths):
+        stat = os.stat(path)
+        digest.update(f'{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def extract_features(feature_extractor, dataset, output_dir, augmentation=None, views=1):
+    """Function that runs a dataset through the feature extractor once and stores features as memory-mapped arrays.
+
+    Parameters
+    ----------
+    feature_extractor: keras.Model
+        Model mapping images to features.
+    dataset: tf.data.Dataset
+        Batched dataset of (image, label) pairs.
+    output_dir: str
+        Directory features.npy and labels.npy are written to.
+    augmentation: keras.layers.Layer
+        Augmentation layer applied to images of every view but the first one, None disables augmentation.
+    views: int
+        Number of views of every image: the original one and views - 1 augmented ones.
+
+    Returns
+    -------
+    features: np.memmap
+        Features, view after view, of shape (views * N, 512).
+    labels: np.memmap
+        Labels of the features.
+
+    Raises
+    ------
+    ValueError
+        If the dataset yields no images.
+    """
+    num_images = getattr(dataset, 'num_images', None)
+    if num_images is None:
+        num_images = len(dataset.file_paths)
+    num_features = feature_extractor.output_shape[-1]
+    tmp_dir = f'{output_dir}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+    features = labels = None
+
+    offset = 0
+    for view in range(views):
+        for images, batch_labels in dataset:
+            if view > 0 and augmentation is not None:
+                images = augmentation(images, training=True)
+            batch_features = feature_extractor.predict_on_batch(images)
+            if features is None:
+                features = np.lib.format.open_memmap(os.path.join(tmp_dir, 'features.npy'), mode='w+',
+                                                     dtype=np.float32, shape=(views * num_images, num_features))
+                labels = np.lib.format.open_memmap(os.path.join(tmp_dir, 'labels.npy'), mode='w+',
+                                                   dtype=np.float32,
+                                                   shape=(views * num_images,) + tuple(batch_labels.shape[1:]))
+            features[offset:offset + len(batch_features)] = batch_features
+            labels[offset:offset + len(batch_features)] = batch_labels
+            offset += len(batch_features)
+    if features is None:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise ValueError(f"Cannot extract features to {output_dir}, the dataset has no images")
+    features.flush()
+    labels.flush()
+    del features, labels
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(tmp_dir, output_dir)
+    return load_features(output_dir)
+
+
+def load_features(features_dir):
+    """Function that opens stored features as read-only memory-mapped arrays.
+
+    Parameters
+    ----------
+    features_dir: str
+        Directory written by extract_features.
+
+    Returns
+    -------
+    features: np.memmap
+        Stored features.
+    labels: np.memmap
+        Labels of the features.
+    """
+    return (np.load(os.path.join(features_dir, 'features.npy'), mmap_mode='r'),
+            np.load(os.path.join(features_dir, 'labels.npy'), mmap_mode='r'))
+
+
+def cached_features(feature_extractor, dataset, split, cache_dir='features_cache', image_size=(150, 150),
+                    augmentation=None, views=1):
+    """Function that returns features of a dataset split, extracting them only if they are not cached yet.
+
+    Parameters
+    ----------
+    feature_extractor: keras.Model
+        Model mapping images to features.
+    dataset: tf.data.Dataset
+        Dataset returned by load_images.
+    split: str
+        Name of the split, e.g. 'train'.
+    cache_dir: str
+        Directory of the feature cache.
+    image_size: tuple of int
+        Size the dataset's images are resized to.
+    augmentation: keras.layers.Layer
+        Augmentation layer used for additional views, see extract_features.
+    views: int
+        Number of views of every image, see extract_features.
+
+    Returns
+    -------
+    features: np.memmap
+        Features of the split.
+    labels: np.memmap
+        Labels of the features.
+    """
+    key = f'{dataset_hash(dataset, image_size)[:16]}-{backbone_hash(feature_extractor)[:16]}'
+    if augmentation is not None and views > 1:
+        augmentation_hash = hashlib.sha256(str(augmentation.get_config()).encode()).hexdigest()
+        key += f'-{type(augmentation).__name__}{views}-{augmentation_hash[:8]}'
+    features_dir = os.path.join(cache_dir, f'{split}-{key}')
+    if os.path.isdir(features_dir):
+        return load_features(features_dir)
+    print(f'Extracting {split} features to {features_dir}...')
+    return extract_features(feature_extractor, dataset, features_dir, augmentation, views)
+
+
+def organ_features(organ, cache_dir='features_cache', views=4, feature_extractor=None):
+    """Function that returns cached VGG16 features of every split of an organ's dataset, extracting missing ones.
+
+    Parameters
+    ----------
+    organ: str
+        'kidney' or 'chest', see ORGANS.
+    cache_dir: str
+        Directory of the feature cache.
+    views: int
+        Number of views of every training image for models with augmentation.
+    feature_extractor: keras.Model
+        Model returned by build_feature_extractor, None builds a new one.
+
+    Returns
+    -------
+    features: dict
+        Mapping from split name ('train', 'valid' and, if there is a test split, 'test') to features and labels.
+    """
+    settings = ORGANS[organ]
+    datasets = load_images(settings['images_dir'], image_size=(150, 150), batch_size=32)
+    feature_extractor = feature_extractor or build_feature_extractor()
+
+    augmentation = RandomZoom(settings['zoom']) if settings['zoom'] else None
+    features = {'train': cached_features(feature_extractor, datasets[0], 'train', cache_dir, augmentation=augmentation,
+                                         views=views if augmentation is not None else 1)}
+    for split, dataset in zip(('valid', 'test'), datasets[1:]):
+        features[split] = cached_features(feature_extractor, dataset, split, cache_dir)
+    return features
+
+
+def train_head_on_features(organ, cache_dir='features_cache', views=4, batch_size=32):
+    """Function that trains an organ classifier's head on cached VGG16 features and saves the complete classifier.
+
+    Features of every split are extracted once and reused by later runs, as long as neither the dataset nor the
+    backbone changes. The training split of models with a RandomZoom layer gets views - 1 additional zoomed views of
+    every image, so augmentation still takes place.
+
+    Parameters
+    ----------
+    organ: str
+        'kidney' or 'chest', see ORGANS.
+    cache_dir: str
+        Directory of the feature cache.
+    views: int
+        Number of views of every training image for models with augmentation.
+    batch_size: int
+        Batch size used to train the head.
+
+    Returns
+    -------
+    model: keras.models.Sequential
+        Complete classifier, taking images as input.
+    history: keras.callbacks.History
+        Head's training history.
+    """
+    settings = ORGANS[organ]
+    feature_extractor = build_feature_extractor()
+    features = organ_features(organ, cache_dir, views, feature_extractor)
+    train_features, train_labels = features['train']
+    validation_features, validation_labels = features['valid']
+
+    head = Sequential([Input(shape=feature_extractor.output_shape[1:])])
+    head = settings['assemble'](head, **settings['assemble_kwargs'])
+    head.compile(optimizer=Adam(learning_rate=settings['learning_rate']), loss='categorical_crossentropy',
+                 metrics=['accuracy'])
+    callbacks = [LearningRateScheduler(settings['lr_schedule'])] if settings['lr_schedule'] else []
+    history = head.fit(train_features, train_labels, batch_size=batch_size, epochs=settings['epochs'],
+                       validation_data=(validation_features, validation_labels), shuffle=True, callbacks=callbacks)
+
+    if 'test' in features:
+        test_features, test_labels = features['test']
+        test_loss, test_accuracy = head.evaluate(test_features, test_labels)
+        print(f'Test loss: {test_loss}, Test accuracy: {test_accuracy}')
+
+    model = Sequential(feature_extractor.layers + head.layers)
+    model.build((None, 150, 150, 3))
+    return model, history
+
+
+if __name__ == '__main__':
+    organ_name = sys.argv[1] if len(sys.argv) > 1 else 'kidney'
+    classifier, _ = train_head_on_features(organ_name)
+    classifier.save(ORGANS[organ_name]['model_path'])
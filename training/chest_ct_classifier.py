@@ -8,41 +8,54 @@ from keras.src.layers import Rescaling, RandomZoom
 from keras.src.optimizers import Adam
 from tensorflow.keras.applications.vgg16 import VGG16
 from model import assemble_chest_classifier
-from utils import plot_history, step_decay, load_images
+from training_utils import plot_history, TrainingMonitor, step_decay, ResumableCheckpoint
+from distributed_training import (cluster_config, get_distribution_strategy, is_chief, load_training_data,
+                                  restore_checkpoint, worker_path)
 
 
 early_stopping = EarlyStopping(monitor='val_loss', patience=10, restore_best_weights=True)
 
-train_data, validation_data, test_data = load_images('ChestCT', image_size=(150, 150), batch_size=32)
+strategy = get_distribution_strategy()
+monitor = TrainingMonitor(worker_path('runs/chest'), batch_size=32 * cluster_config()[0])
+(train_data, validation_data, test_data), steps = load_training_data(strategy, 'ChestCT', image_size=(150, 150),
+                                                                     batch_size=32, watch=monitor.watch)
+train_steps, validation_steps, test_steps = steps or (None, None, None)
 input_shape = (150, 150, 3)
 
-pretrained_model = VGG16(include_top=False,
-                         input_shape=input_shape,
-                         pooling='max', classes=4,
-                         weights='imagenet')
+with strategy.scope():
+    pretrained_model = VGG16(include_top=False,
+                             input_shape=input_shape,
+                             pooling='max', classes=4,
+                             weights='imagenet')
 
-pretrained_model.trainable = False
+    pretrained_model.trainable = False
 
-model = Sequential([
-    Rescaling(1. / 255, input_shape=input_shape),
-    RandomZoom(0.1)
-])
+    model = Sequential([
+        Rescaling(1. / 255, input_shape=input_shape),
+        RandomZoom(0.1)
+    ])
+
+    model.add(pretrained_model)
+    model = assemble_chest_classifier(model, num_classes=4, first_dense_neurons=512)
+    model.compile(optimizer=Adam(learning_rate=0.001), loss='categorical_crossentropy', metrics=['accuracy'])
 
 learning_rate_scheduling = LearningRateScheduler(step_decay)
 
-model.add(pretrained_model)
-model = assemble_chest_classifier(model, num_classes=4, first_dense_neurons=512)
-model.compile(optimizer=Adam(learning_rate=0.001), loss='categorical_crossentropy', metrics=['accuracy'])
+checkpoint = ResumableCheckpoint(worker_path('checkpoints/chest'), early_stopping=early_stopping)
+initial_epoch = restore_checkpoint(strategy, checkpoint, model, 'checkpoints/chest')
 
 model.summary()
-history = model.fit(train_data, epochs=60, validation_data=validation_data, callbacks=[learning_rate_scheduling])
+history = model.fit(train_data, epochs=60, initial_epoch=initial_epoch, steps_per_epoch=train_steps,
+                    validation_data=validation_data, validation_steps=validation_steps,
+                    callbacks=[learning_rate_scheduling, early_stopping, checkpoint, monitor])
 
-plot_history(history)
+if is_chief():
+    plot_history(history, 'chest_ct_plot.png')
 
-test_loss, test_accuracy = model.evaluate(test_data)
+test_loss, test_accuracy = model.evaluate(test_data, steps=test_steps)
 print(f'Test loss: {test_loss}, Test accuracy: {test_accuracy}')
 
-model.save('chest_diagnose.h5')
+model.save(worker_path('chest_diagnose.h5'))
 
 """
 Epoch 60/60 20/20 [==============================] - 3s 110ms/step - loss: 0.1393 - accuracy: 0.9543 
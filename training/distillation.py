@@ -0,0 +1,205 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import argparse
+import json
+
+import numpy as np
+import tensorflow as tf
+from keras import Model
+from keras.callbacks import EarlyStopping
+from keras.losses import CategoricalCrossentropy, KLDivergence
+from keras.metrics import CategoricalAccuracy, Mean
+from keras.optimizers import Adam
+from tensorflow.keras.models import load_model
+
+from export_models import benchmark_format
+from model import build_student_classifier
+from training_utils import load_images
+
+ORGANS = {
+    'kidney': {'images_dir': 'CT-KIDNEY-DATASET-Normal-Cyst-Tumor-Stone', 'teacher': 'kidney_diagnose.h5',
+               'zoom': None},
+    'chest': {'images_dir': 'ChestCT', 'teacher': 'chest_diagnose.h5', 'zoom': 0.1},
+}
+
+
+class Distiller(Model):
+    """Keras model training a student classifier to match the softened predictions of a teacher classifier.
+
+    The loss is alpha times the cross-entropy between the student's predictions and the true labels, plus
+    1 - alpha times the KL divergence between the teacher's and the student's predictions softened by temperature,
+    scaled by temperature squared so its gradients keep their magnitude. Only the student's weights are trained.
+
+    Parameters
+    ----------
+    student: keras.models.Sequential
+        Student classifier returned by model.build_student_classifier.
+    teacher: keras.Model
+        Trained classifier outputting class probabilities.
+    temperature: float
+        Temperature softening both predictions.
+    alpha: float
+        Weight of the loss on true labels.
+    """
+
+    def __init__(self, student, teacher, temperature=4.0, alpha=0.1):
+        super().__init__()
+        self.student = student
+        self.student_logits = Model(student.inputs, student.layers[-2].output)
+        self.teacher = teacher
+        self.teacher.trainable = False
+        self.temperature = temperature
+        self.alpha = alpha
+        self.label_loss_fn = CategoricalCrossentropy(from_logits=True)
+        self.distillation_loss_fn = KLDivergence()
+        self.loss_tracker = Mean(name='loss')
+        self.distillation_loss_tracker = Mean(name='distillation_loss')
+        self.accuracy = CategoricalAccuracy(name='accuracy')
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.distillation_loss_tracker, self.accuracy]
+
+    def call(self, images, training=False):
+        return self.student(images, training=training)
+
+    def train_step(self, data):
+        images, labels = data
+        teacher_logits = tf.math.log(self.teacher(images, training=False) + 1e-7)
+        with tf.GradientTape() as tape:
+            student_logits = self.student_logits(images, training=True)
+            label_loss = self.label_loss_fn(labels, student_logits)
+            distillation_loss = self.distillation_loss_fn(tf.nn.softmax(teacher_logits / self.temperature),
+                                                          tf.nn.softmax(student_logits / self.temperature))
+            distillation_loss *= self.temperature ** 2
+            loss = self.alpha * label_loss + (1 - self.alpha) * distillation_loss
+        gradients = tape.gradient(loss, self.student.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.student.trainable_variables))
+        return self._update_metrics(loss, distillation_loss, labels, student_logits)
+
+    def test_step(self, data):
+        images, labels = data
+        student_logits = self.student_logits(images, training=False)
+        loss = self.label_loss_fn(labels, student_logits)
+        return self._update_metrics(loss, 0.0, labels, student_logits)
+
+    def _update_metrics(self, loss, distillation_loss, labels, student_logits):
+        self.loss_tracker.update_state(loss)
+        self.distillation_loss_tracker.update_state(distillation_loss)
+        self.accuracy.update_state(labels, student_logits)
+        return {metric.name: metric.result() for metric in self.metrics}
+
+
+def distill(organ, output_dir='.', epochs=30, learning_rate=0.001, temperature=4.0, alpha=0.1,
+            widths=(32, 64, 128, 256)):
+    """Function that distills an organ's VGG16 classifier into a student classifier and saves it.
+
+    The student is saved next to the teacher with a _student suffix, e.g. kidney_diagnose_student.h5, which
+    prediction.py serves instead of the teacher when MODEL_VARIANT is set to '_student'.
+
+    Parameters
+    ----------
+    organ: str
+        'kidney' or 'chest', see ORGANS.
+    output_dir: str
+        Directory the student is saved to.
+    epochs: int
+        Maximum number of epochs, training stops early when validation loss stops improving.
+    learning_rate: float
+        Learning rate of the student.
+    temperature: float
+        Distillation temperature, see Distiller.
+    alpha: float
+        Weight of the loss on true labels, see Distiller.
+    widths: tuple of int
+        Number of filters of the student's convolutional blocks.
+
+    Returns
+    -------
+    student_path: str
+        Path of the saved student.
+    """
+    settings = ORGANS[organ]
+    train_data, validation_data = load_images(settings['images_dir'], image_size=(150, 150), batch_size=32)[:2]
+    teacher = load_model(settings['teacher'])
+    num_classes = teacher.output_shape[-1]
+
+    student = build_student_classifier(num_classes, widths=widths, zoom=settings['zoom'])
+    distiller = Distiller(student, teacher, temperature=temperature, alpha=alpha)
+    distiller.compile(optimizer=Adam(learning_rate=learning_rate))
+    early_stopping = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
+    distiller.fit(train_data, epochs=epochs, validation_data=validation_data, callbacks=[early_stopping])
+
+    model_name = os.path.splitext(os.path.basename(settings['teacher']))[0]
+    os.makedirs(output_dir, exist_ok=True)
+    student_path = os.path.join(output_dir, f'{model_name}_student.h5')
+    student.save(student_path)
+    return student_path
+
+
+def compare_student(organ, student_path, latency_runs=50) -> dict:
+    """Function that compares latency and test accuracy of a student classifier with its teacher.
+
+    Parameters
+    ----------
+    organ: str
+        'kidney' or 'chest', see ORGANS.
+    student_path: str
+        Path of the student returned by distill.
+    latency_runs: int
+        Number of single image predictions timed for latency percentiles.
+
+    Returns
+    -------
+    report: dict
+        Report of export_models.benchmark_format for the teacher and the student, the student's speedup per image,
+        accuracy lost and fraction of test images it classifies like the teacher.
+    """
+    datasets = load_images(ORGANS[organ]['images_dir'], image_size=(150, 150), batch_size=32)
+    if len(datasets) < 3:
+        raise ValueError(f"{ORGANS[organ]['images_dir']} has no test split")
+    test_data = datasets[2]
+
+    teacher = benchmark_format(ORGANS[organ]['teacher'], 'keras', test_data, latency_runs)
+    student = benchmark_format(student_path, 'keras', test_data, latency_runs)
+    agreement = float(np.mean(teacher.pop('predicted') == student.pop('predicted')))
+    return {
+        'teacher': teacher,
+        'student': student,
+        'speedup': teacher['latency_ms']['p50'] / student['latency_ms']['p50'],
+        'accuracy_lost': teacher['accuracy'] - student['accuracy'],
+        'agreement': agreement,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Distill a VGG16 classifier into a small student classifier and "
+                                                 "compare their latency and test accuracy.")
+    parser.add_argument('organ', choices=sorted(ORGANS))
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--learning-rate', type=float, default=0.001)
+    parser.add_argument('--temperature', type=float, default=4.0)
+    parser.add_argument('--alpha', type=float, default=0.1)
+    parser.add_argument('--widths', type=int, nargs='+', default=[32, 64, 128, 256])
+    parser.add_argument('--skip-training', action='store_true', help="Only compare an already distilled student")
+    parser.add_argument('--report', default=None, help="Path of the JSON report")
+    args = parser.parse_args()
+
+    teacher_name = os.path.splitext(os.path.basename(ORGANS[args.organ]['teacher']))[0]
+    path = os.path.join(args.output_dir, f'{teacher_name}_student.h5')
+    if not args.skip_training:
+        path = distill(args.organ, args.output_dir, args.epochs, args.learning_rate, args.temperature, args.alpha,
+                       tuple(args.widths))
+
+    report = compare_student(args.organ, path)
+    for name in ('teacher', 'student'):
+        result = report[name]
+        print(f"{name:<8} {result['disk_bytes'] / 1024 ** 2:>8.1f} MB  p50 {result['latency_ms']['p50']:>8.2f} ms  "
+              f"p95 {result['latency_ms']['p95']:>8.2f} ms  accuracy {result['accuracy']:.4f}")
+    print(f"Student is {report['speedup']:.1f}x faster per image, gives up {report['accuracy_lost']:.4f} test "
+          f"accuracy and agrees with the teacher on {report['agreement']:.2%} of test images")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,378 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import argparse
+import atexit
+import json
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+
+import tensorflow as tf
+
+from training_utils import TrainingMonitor, load_images
+
+_worker_dir = None
+
+
+def cluster_config() -> tuple[int, int]:
+    """Function that reads the worker configuration of the current process from the TF_CONFIG environment variable.
+
+    Returns
+    -------
+    num_workers: int
+        Number of workers in the cluster, 1 without TF_CONFIG.
+    worker_index: int
+        Index of the current worker, 0 is the chief.
+    """
+    tf_config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+    num_workers = len(tf_config.get('cluster', {}).get('worker', [])) or 1
+    return num_workers, tf_config.get('task', {}).get('index', 0)
+
+
+def get_distribution_strategy():
+    """Function that returns the distribution strategy configured by the environment.
+
+    Returns
+    -------
+    strategy: tf.distribute.Strategy
+        MultiWorkerMirroredStrategy when TF_CONFIG describes more than one worker, the default strategy otherwise.
+    """
+    if cluster_config()[0] > 1:
+        return tf.distribute.MultiWorkerMirroredStrategy()
+    return tf.distribute.get_strategy()
+
+
+def is_chief() -> bool:
+    """Function that tells whether the current process is the chief worker.
+
+    Returns
+    -------
+    chief: bool
+        True for the chief worker and for single-process training.
+    """
+    return cluster_config()[1] == 0
+
+
+def worker_path(path) -> str:
+    """Function that returns a path the current worker may write to.
+
+    All workers of a multi-worker run have to save models and checkpoints, but only the chief's copy is kept. Other
+    workers write to a temporary directory created for the run and removed when the process exits, under the full
+    absolute path of the chief's file, so that neither different files of a run nor different runs collide.
+
+    Parameters
+    ----------
+    path: str
+        Path used by the chief.
+
+    Returns
+    -------
+    path: str
+        The path itself for the chief, a path in the run's temporary directory, whose parent exists, for other
+        workers.
+    """
+    global _worker_dir
+    if is_chief():
+        return path
+    if _worker_dir is None:
+        _worker_dir = tempfile.mkdtemp(prefix=f'worker_{cluster_config()[1]}_')
+        atexit.register(shutil.rmtree, _worker_dir, ignore_errors=True)
+    relative_path = os.path.splitdrive(os.path.abspath(path))[1].lstrip(os.sep)
+    path = os.path.join(_worker_dir, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def broadcast_from_chief(strategy, value: int) -> int:
+    """Function that sends an integer of the chief to every worker.
+
+    Every worker has to call it, in the same order, since it runs a collective all-reduce.
+
+    Parameters
+    ----------
+    strategy: tf.distribute.Strategy
+        Strategy returned by get_distribution_strategy.
+    value: int
+        Value of the current worker, only the chief's value is used.
+
+    Returns
+    -------
+    value: int
+        Value of the chief.
+    """
+    if cluster_config()[0] == 1:
+        return value
+
+    def chief_value():
+        is_first_replica = tf.equal(tf.distribute.get_replica_context().replica_id_in_sync_group, 0)
+        return tf.cast(is_first_replica, tf.int64) * value
+
+    return int(strategy.reduce(tf.distribute.ReduceOp.SUM, strategy.run(chief_value), axis=None))
+
+
+def restore_checkpoint(strategy, checkpoint, model, chief_checkpoint_dir) -> int:
+    """Function that restores the same checkpoint of a run on every worker.
+
+    The chief restores its latest checkpoint and broadcasts its epoch, other workers then restore the chief's
+    checkpoint of that epoch, so that all workers resume with the same weights, optimizer state and epoch even when
+    their own checkpoints are missing or stale. As with keras.callbacks.BackupAndRestore, the chief's checkpoint
+    directory has to be readable by every worker.
+
+    Parameters
+    ----------
+    strategy: tf.distribute.Strategy
+        Strategy returned by get_distribution_strategy.
+    checkpoint: training_utils.ResumableCheckpoint
+        Checkpoint callback of the current worker, writing to worker_path(chief_checkpoint_dir).
+    model: keras.Model
+        Compiled model of the run.
+    chief_checkpoint_dir: str
+        Directory the chief writes checkpoints to.
+
+    Returns
+    -------
+    initial_epoch: int
+        Number of epochs already finished, to be passed to fit as initial_epoch.
+    """
+    if cluster_config()[0] == 1:
+        return checkpoint.restore(model)
+    epoch = broadcast_from_chief(strategy, checkpoint.restore(model) if is_chief() else 0)
+    if not is_chief():
+        checkpoint.restore(model, epoch=epoch, checkpoint_dir=chief_checkpoint_dir)
+    return epoch
+
+
+def load_training_data(strategy, images_dir, batch_size=32, watch=None, **load_kwargs):
+    """Function that loads train, validation and test data for training with a distribution strategy.
+
+    Without multiple workers this returns load_images datasets. With multiple workers every worker loads only its
+    own shard of every split, so that no image is decoded twice, and the given per-worker batch size is scaled up
+    to a global batch size of batch_size * num_workers. Datasets are repeated, fit and evaluate then need the
+    returned numbers of steps.
+
+    Parameters
+    ----------
+    strategy: tf.distribute.Strategy
+        Strategy returned by get_distribution_strategy.
+    images_dir: str
+        Path to directory containing images, see load_images.
+    batch_size: int
+        Batch size of a single worker.
+    watch: callable
+        Function applied to the train dataset of every worker, e.g. TrainingMonitor.watch.
+    load_kwargs:
+        Other arguments passed to load_images.
+
+    Returns
+    -------
+    datasets: tuple
+        Train, validation and, if there is a test split, test datasets.
+    steps: list of int or None
+        Number of steps per pass over every split, None for single-worker training.
+    """
+    num_workers, _ = cluster_config()
+    if num_workers == 1:
+        datasets = load_images(images_dir, batch_size=batch_size, **load_kwargs)
+        if watch is not None:
+            datasets = (watch(datasets[0]),) + datasets[1:]
+        return datasets, None
+
+    global_batch_size = batch_size * num_workers
+    full_datasets = load_images(images_dir, batch_size=global_batch_size, **load_kwargs)
+    steps = [max(1, len(dataset.file_paths) // global_batch_size) if getattr(dataset, 'file_paths', None)
+             else max(1, dataset.num_images // global_batch_size) for dataset in full_datasets]
+
+    def make_dataset_fn(split_index):
+        def dataset_fn(input_context):
+            per_replica_batch_size = input_context.get_per_replica_batch_size(global_batch_size)
+            shard = (input_context.num_input_pipelines, input_context.input_pipeline_id)
+            datasets = load_images(images_dir, batch_size=per_replica_batch_size, shard=shard, **load_kwargs)
+            dataset = datasets[split_index].repeat()
+            return watch(dataset) if watch is not None and split_index == 0 else dataset
+        return dataset_fn
+
+    datasets = tuple(strategy.distribute_datasets_from_function(make_dataset_fn(i)) for i in range(len(steps)))
+    return datasets, steps
+
+
+def free_ports(count) -> list[int]:
+    """Function that finds free TCP ports on the local host.
+
+    Parameters
+    ----------
+    count: int
+        Number of ports.
+
+    Returns
+    -------
+    ports: list of int
+        Free ports.
+    """
+    sockets = [socket.socket() for _ in range(count)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def launch_local_workers(num_workers, command, threads_per_worker=None) -> list[int]:
+    """Function that runs a training command as a multi-worker cluster of processes on the local host.
+
+    Parameters
+    ----------
+    num_workers: int
+        Number of worker processes.
+    command: list of str
+        Command run by every worker, e.g. [sys.executable, 'kidney_ct_classifier.py'].
+    threads_per_worker: int
+        Number of TensorFlow intra-op threads of every worker, defaults to CPUs divided by workers.
+
+    Returns
+    -------
+    return_codes: list of int
+        Return code of every worker.
+    """
+    workers = [f'localhost:{port}' for port in free_ports(num_workers)]
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ,
+                   TF_CONFIG=json.dumps({'cluster': {'worker': workers}, 'task': {'type': 'worker', 'index': index}}),
+                   TF_NUM_INTRAOP_THREADS=str(threads), TF_NUM_INTEROP_THREADS='2')
+        processes.append(subprocess.Popen(command, env=env))
+    return [process.wait() for process in processes]
+
+
+def benchmark_worker(result_path, batch_size=32, steps=20, epochs=3):
+    """Function run by every worker of a scaling benchmark: trains the kidney classifier on synthetic images.
+
+    The backbone is an untrained VGG16, so that the benchmark runs offline, its cost is the same as the cost of
+    the ImageNet-weighted one. Every epoch is recorded by a TrainingMonitor, whose report is written next to
+    result_path, and the chief writes throughput and input wait fraction of the fastest epoch to result_path.
+
+    Parameters
+    ----------
+    result_path: str
+        Path of the JSON result written by the chief.
+    batch_size: int
+        Batch size of a single worker.
+    steps: int
+        Number of steps per epoch.
+    epochs: int
+        Number of epochs, the first one warms up.
+
+    Returns
+    -------
+    None
+    """
+    from keras import Sequential
+    from keras.layers import Rescaling
+    from keras.applications.vgg16 import VGG16
+    from model import assemble_kidney_classifier
+
+    strategy = get_distribution_strategy()
+    num_workers, _ = cluster_config()
+    global_batch_size = batch_size * num_workers
+    monitor = TrainingMonitor(worker_path(os.path.splitext(result_path)[0]), batch_size=global_batch_size)
+
+    def dataset_fn(input_context):
+        per_replica_batch_size = input_context.get_per_replica_batch_size(global_batch_size)
+        images = tf.random.stateless_uniform((per_replica_batch_size, 150, 150, 3), seed=(1, 2), maxval=255)
+        labels = tf.one_hot(tf.zeros(per_replica_batch_size, dtype=tf.int32), 4)
+        return monitor.watch(tf.data.Dataset.from_tensors((images, labels)).repeat())
+
+    with strategy.scope():
+        pretrained_model = VGG16(include_top=False, input_shape=(150, 150, 3), pooling='max', weights=None)
+        pretrained_model.trainable = False
+        model = Sequential([Rescaling(1. / 255, input_shape=(150, 150, 3)), pretrained_model])
+        model = assemble_kidney_classifier(model, num_classes=4, first_dense_neurons=512, dropout=0.5)
+        model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+
+    model.fit(strategy.distribute_datasets_from_function(dataset_fn), epochs=epochs, steps_per_epoch=steps,
+              callbacks=[monitor], verbose=0)
+    if is_chief():
+        fastest = max(monitor.epochs[1:], key=lambda epoch: epoch['images_per_second'])
+        with open(result_path, 'w') as f:
+            json.dump({'workers': num_workers, 'images_per_second': fastest['images_per_second'],
+                       'input_wait_fraction': fastest['input_wait_fraction']}, f)
+
+
+def scaling_benchmark(max_workers, batch_size=32, steps=20) -> list[dict]:
+    """Function that measures scaling efficiency of multi-worker training on the local host.
+
+    Runs benchmark_worker with 1 to max_workers workers. Scaling efficiency of n workers is their throughput
+    divided by n times the throughput of a single worker.
+
+    Parameters
+    ----------
+    max_workers: int
+        Largest number of workers.
+    batch_size: int
+        Batch size of a single worker.
+    steps: int
+        Number of steps per epoch.
+
+    Returns
+    -------
+    results: list of dict
+        Number of workers, throughput, input wait fraction and scaling efficiency of every run.
+
+    Raises
+    ------
+    RuntimeError
+        If a worker of a run fails.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_workers in range(1, max_workers + 1):
+            result_path = os.path.join(tmp_dir, f'{num_workers}.json')
+            return_codes = launch_local_workers(num_workers, [sys.executable, os.path.abspath(__file__),
+                                                              'benchmark-worker', result_path, '--batch-size',
+                                                              str(batch_size), '--steps', str(steps)])
+            if any(return_codes):
+                raise RuntimeError(f"Benchmark with {num_workers} workers failed, return codes: {return_codes}")
+            with open(result_path) as f:
+                result = json.load(f)
+            result['efficiency'] = result['images_per_second'] / (num_workers * results[0]['images_per_second']) \
+                if results else 1.0
+            results.append(result)
+            print(f"{num_workers} workers: {result['images_per_second']:.1f} images/s, "
+                  f"scaling efficiency {result['efficiency']:.2f}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run multi-worker training locally and measure scaling efficiency.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    launch = subparsers.add_parser('launch', help="Run a training script as a local multi-worker cluster")
+    launch.add_argument('--workers', type=int, default=2)
+    launch.add_argument('script', nargs=argparse.REMAINDER)
+
+    scaling = subparsers.add_parser('scaling', help="Measure scaling efficiency for 1 to N local workers")
+    scaling.add_argument('--workers', type=int, default=4)
+    scaling.add_argument('--batch-size', type=int, default=32)
+    scaling.add_argument('--steps', type=int, default=20)
+    scaling.add_argument('--output', default=None)
+
+    worker = subparsers.add_parser('benchmark-worker')
+    worker.add_argument('result_path')
+    worker.add_argument('--batch-size', type=int, default=32)
+    worker.add_argument('--steps', type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == 'launch':
+        return_codes = launch_local_workers(args.workers, [sys.executable] + args.script)
+        sys.exit(next((code for code in return_codes if code), 0))
+    elif args.command == 'scaling':
+        scaling_results = scaling_benchmark(args.workers, args.batch_size, args.steps)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(scaling_results, f, indent=2)
+    else:
+        benchmark_worker(args.result_path, args.batch_size, args.steps)
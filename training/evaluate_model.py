@@ -0,0 +1,342 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import argparse
+import heapq
+import itertools
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from training_utils import load_images
+
+
+class EvaluationAccumulator:
+    """Running statistics of a classifier's predictions, updated batch by batch in constant memory.
+
+    Holds the confusion matrix, per confidence bin counts for calibration, summed log loss and Brier score, and the
+    worst misclassified files, i.e. those predicted wrongly with the highest confidence. Accumulators of shards of a
+    dataset are combined with merge.
+
+    Parameters
+    ----------
+    num_classes: int
+        The number of possible classes.
+    num_bins: int
+        Number of equal-width confidence bins used for calibration.
+    num_worst: int
+        Number of worst misclassified files kept.
+    """
+
+    def __init__(self, num_classes, num_bins=15, num_worst=20):
+        self.num_classes = num_classes
+        self.num_bins = num_bins
+        self.num_worst = num_worst
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.bin_counts = np.zeros(num_bins, dtype=np.int64)
+        self.bin_confidence = np.zeros(num_bins)
+        self.bin_correct = np.zeros(num_bins)
+        self.log_loss = 0.0
+        self.brier = 0.0
+        self.worst = []
+
+    def update(self, probabilities, labels, paths):
+        """Method that adds a batch of predictions to the statistics.
+
+        Parameters
+        ----------
+        probabilities: np.ndarray
+            Predicted class probabilities of shape (N, num_classes).
+        labels: np.ndarray
+            True class indices of shape (N,).
+        paths: list of str
+            Files the predictions were made for.
+
+        Returns
+        -------
+        None
+        """
+        predicted = np.argmax(probabilities, axis=1)
+        confidence = probabilities[np.arange(len(labels)), predicted]
+        correct = predicted == labels
+        self.confusion += np.bincount(labels * self.num_classes + predicted,
+                                      minlength=self.num_classes ** 2).reshape(self.num_classes, self.num_classes)
+
+        bins = np.minimum((confidence * self.num_bins).astype(int), self.num_bins - 1)
+        self.bin_counts += np.bincount(bins, minlength=self.num_bins)
+        self.bin_confidence += np.bincount(bins, weights=confidence, minlength=self.num_bins)
+        self.bin_correct += np.bincount(bins, weights=correct, minlength=self.num_bins)
+
+        true_probabilities = probabilities[np.arange(len(labels)), labels]
+        self.log_loss += float(-np.log(np.clip(true_probabilities, 1e-7, 1.0)).sum())
+        one_hot = np.eye(self.num_classes)[labels]
+        self.brier += float(((probabilities - one_hot) ** 2).sum())
+
+        for i in np.flatnonzero(~correct):
+            item = (float(confidence[i]), paths[i], int(labels[i]), int(predicted[i]))
+            if len(self.worst) < self.num_worst:
+                heapq.heappush(self.worst, item)
+            elif item > self.worst[0]:
+                heapq.heapreplace(self.worst, item)
+
+    def merge(self, other):
+        """Method that adds statistics of another accumulator, e.g. of another shard, to this one.
+
+        Parameters
+        ----------
+        other: EvaluationAccumulator
+            Accumulator with the same number of classes and bins.
+
+        Returns
+        -------
+        accumulator: EvaluationAccumulator
+            This accumulator.
+        """
+        self.confusion += other.confusion
+        self.bin_counts += other.bin_counts
+        self.bin_confidence += other.bin_confidence
+        self.bin_correct += other.bin_correct
+        self.log_loss += other.log_loss
+        self.brier += other.brier
+        self.worst = heapq.nlargest(self.num_worst, self.worst + other.worst)
+        heapq.heapify(self.worst)
+        return self
+
+    def report(self, class_names) -> dict:
+        """Method that computes evaluation metrics from the statistics.
+
+        Parameters
+        ----------
+        class_names: list of str
+            Names of the classes.
+
+        Returns
+        -------
+        report: dict
+            Number of images, accuracy, confusion matrix (rows are true classes), per-class precision, recall, F1
+            and support, calibration (expected and maximum calibration error, log loss, Brier score and per-bin
+            reliability) and the worst misclassified files, most confident first.
+        """
+        total = int(self.confusion.sum())
+        true_positives = np.diag(self.confusion)
+        predicted_counts = self.confusion.sum(axis=0)
+        support = self.confusion.sum(axis=1)
+        precision = np.divide(true_positives, predicted_counts, out=np.zeros(self.num_classes),
+                              where=predicted_counts > 0)
+        recall = np.divide(true_positives, support, out=np.zeros(self.num_classes), where=support > 0)
+        f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(self.num_classes),
+                       where=precision + recall > 0)
+
+        filled = self.bin_counts > 0
+        bin_accuracy = np.divide(self.bin_correct, self.bin_counts, out=np.zeros(self.num_bins), where=filled)
+        bin_confidence = np.divide(self.bin_confidence, self.bin_counts, out=np.zeros(self.num_bins), where=filled)
+        gaps = np.abs(bin_accuracy - bin_confidence)
+
+        return {
+            'images': total,
+            'accuracy': float(true_positives.sum() / total) if total else 0.0,
+            'class_names': list(class_names),
+            'confusion_matrix': self.confusion.tolist(),
+            'per_class': {name: {'precision': float(precision[i]), 'recall': float(recall[i]), 'f1': float(f1[i]),
+                                 'support': int(support[i])} for i, name in enumerate(class_names)},
+            'calibration': {
+                'ece': float((gaps * self.bin_counts).sum() / total) if total else 0.0,
+                'mce': float(gaps[filled].max()) if filled.any() else 0.0,
+                'log_loss': self.log_loss / total if total else 0.0,
+                'brier': self.brier / total if total else 0.0,
+                'bins': [{'upper': (i + 1) / self.num_bins, 'count': int(self.bin_counts[i]),
+                          'confidence': float(bin_confidence[i]), 'accuracy': float(bin_accuracy[i])}
+                         for i in range(self.num_bins)],
+            },
+            'worst_misclassified': [{'path': path, 'true': class_names[label], 'predicted': class_names[predicted],
+                                     'confidence': confidence}
+                                    for confidence, path, label, predicted in sorted(self.worst, reverse=True)],
+        }
+
+
+SPLITS = ('train', 'valid', 'test')
+
+
+def load_split(source, split='test', image_size=(150, 150), batch_size=256, validation_split=0.2, seed=123,
+               shard=None):
+    """Function that loads the datasets of a split to evaluate with load_images.
+
+    Images are decoded and resized like the prediction server does (resize='serving'), files keep their order and
+    labels are returned as class indices.
+
+    Parameters
+    ----------
+    source: str
+        Dataset directory, packed dataset directory or manifest accepted by load_images.
+    split: str
+        Split of the dataset to evaluate: 'train', 'valid' or 'test', or 'all' for every split of source.
+    image_size: tuple of int
+        Size the images are resized to.
+    batch_size: int
+        Number of images per batch.
+    validation_split: float
+        Fraction of training images reserved for validation, see load_images.
+    seed: int
+        Seed of the validation split, see load_images.
+    shard: tuple of int
+        Number of shards and index of the shard to load, see load_images.
+
+    Returns
+    -------
+    datasets: dict
+        Mapping from split name to its dataset of (image, label) batches.
+    class_names: list of str
+        Names of the classes.
+    """
+    datasets = load_images(source, batch_size=batch_size, image_size=image_size, validation_split=validation_split,
+                           label_mode='int', seed=seed, shard=shard, shuffle=False, resize='serving')
+    datasets = {name: dataset for name, dataset in zip(SPLITS, datasets) if dataset is not None}
+    if split != 'all':
+        if split not in datasets:
+            raise ValueError(f"{source} has no {split} split, found: {', '.join(datasets)}")
+        datasets = {split: datasets[split]}
+    return datasets, next(iter(datasets.values())).class_names
+
+
+def evaluate_shard(model_path, source, split='test', image_size=(150, 150), batch_size=256, num_worst=20,
+                   validation_split=0.2, seed=123, shard=None, threads=None):
+    """Function that streams a shard of a dataset split through a saved model and accumulates statistics of its
+    predictions.
+
+    Images are decoded in parallel by the pipeline of load_images and never held in memory beyond the prefetched
+    batches. Packed datasets do not keep file paths, their images are identified by split, shard and position.
+
+    Parameters
+    ----------
+    model_path: str
+        Path of the saved .h5 model.
+    source: str
+        Dataset directory or manifest, see load_split.
+    split: str
+        Split to evaluate, see load_split.
+    image_size: tuple of int
+        Size the images are resized to.
+    batch_size: int
+        Number of images predicted at once.
+    num_worst: int
+        Number of worst misclassified files kept.
+    validation_split: float
+        Fraction of training images reserved for validation, see load_images.
+    seed: int
+        Seed of the validation split, see load_images.
+    shard: tuple of int
+        Number of shards and index of the shard to evaluate, None evaluates the whole split.
+    threads: int
+        Number of TensorFlow intra-op threads, None keeps TensorFlow's default.
+
+    Returns
+    -------
+    accumulator: EvaluationAccumulator
+        Statistics of the predictions.
+    class_names: list of str
+        Names of the classes.
+    """
+    import tensorflow as tf
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+    from tensorflow.keras.models import load_model
+
+    datasets, class_names = load_split(source, split, image_size, batch_size, validation_split, seed, shard)
+    model = load_model(model_path)
+    accumulator = EvaluationAccumulator(len(class_names), num_worst=num_worst)
+    shard_index = shard[1] if shard is not None else 0
+    for split_name, dataset in datasets.items():
+        paths = getattr(dataset, 'file_paths', None)
+        if paths is None:
+            paths = (f'{source}#{split_name}/{shard_index}/{position}' for position in itertools.count())
+        paths = iter(paths)
+        for images, labels in dataset:
+            probabilities = np.asarray(model.predict_on_batch(images))
+            accumulator.update(probabilities, labels.numpy(), list(itertools.islice(paths, len(probabilities))))
+    return accumulator, class_names
+
+
+def evaluate_model(model_path, source, split='test', image_size=(150, 150), batch_size=256, workers=1,
+                   num_worst=20, validation_split=0.2, seed=123) -> dict:
+    """Function that evaluates a saved model on a dataset split, optionally in several processes.
+
+    With several workers, every worker loads its shard of the files (or packed records) with load_images and
+    evaluates it in its own process with an equal share of the CPU threads, and the statistics of the shards are
+    merged.
+
+    Parameters
+    ----------
+    model_path: str
+        Path of the saved .h5 model.
+    source: str
+        Dataset directory, packed dataset directory or manifest, see load_split.
+    split: str
+        Split to evaluate, see load_split.
+    image_size: tuple of int
+        Size the images are resized to.
+    batch_size: int
+        Number of images predicted at once.
+    workers: int
+        Number of processes.
+    num_worst: int
+        Number of worst misclassified files listed.
+    validation_split: float
+        Fraction of training images reserved for validation, see load_images.
+    seed: int
+        Seed of the validation split, see load_images.
+
+    Returns
+    -------
+    report: dict
+        Evaluation metrics, see EvaluationAccumulator.report.
+    """
+    if workers <= 1:
+        accumulator, class_names = evaluate_shard(model_path, source, split, image_size, batch_size, num_worst,
+                                                  validation_split, seed)
+        return accumulator.report(class_names)
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(evaluate_shard, model_path, source, split, image_size, batch_size, num_worst,
+                                   validation_split, seed, (workers, i), threads) for i in range(workers)]
+        accumulator, class_names = futures[0].result()
+        for future in futures[1:]:
+            accumulator.merge(future.result()[0])
+    return accumulator.report(class_names)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Evaluate a saved classifier on a dataset split with "
+                                                 "per-class metrics, calibration and worst misclassified files.")
+    parser.add_argument('model_path', help="Saved .h5 model, e.g. chest_diagnose.h5")
+    parser.add_argument('source', help="Dataset directory, packed dataset directory or manifest")
+    parser.add_argument('--split', default='test', choices=['train', 'valid', 'test', 'all'])
+    parser.add_argument('--image-size', type=int, nargs=2, default=[150, 150])
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--worst', type=int, default=20)
+    parser.add_argument('--report', default=None, help="Path of the JSON report")
+    args = parser.parse_args()
+
+    report = evaluate_model(args.model_path, args.source, args.split, tuple(args.image_size), args.batch_size,
+                            args.workers, args.worst)
+    names = report['class_names']
+    print(f"{report['images']} images, accuracy {report['accuracy']:.4f}")
+    print(f"{'true / predicted':<24}" + ''.join(f'{name[:12]:>14}' for name in names))
+    for name, row in zip(names, report['confusion_matrix']):
+        print(f'{name[:24]:<24}' + ''.join(f'{count:>14}' for count in row))
+    print(f"{'class':<24}{'precision':>12}{'recall':>12}{'f1':>12}{'support':>12}")
+    for name, metrics in report['per_class'].items():
+        print(f"{name[:24]:<24}{metrics['precision']:>12.4f}{metrics['recall']:>12.4f}{metrics['f1']:>12.4f}"
+              f"{metrics['support']:>12}")
+    calibration = report['calibration']
+    print(f"ECE {calibration['ece']:.4f}, MCE {calibration['mce']:.4f}, log loss {calibration['log_loss']:.4f}, "
+          f"Brier {calibration['brier']:.4f}")
+    for item in report['worst_misclassified']:
+        print(f"{item['confidence']:.4f} {item['true']} -> {item['predicted']}: {item['path']}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
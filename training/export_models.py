@@ -0,0 +1,271 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import argparse
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+from training_utils import load_images
+
+FORMATS = ['keras', 'savedmodel', 'tflite', 'tflite_float16', 'tflite_int8']
+
+
+def export_savedmodel(model, path):
+    """Function that exports a Keras model in the SavedModel format.
+
+    Parameters
+    ----------
+    model: keras.Model
+        Model to export.
+    path: str
+        Path of the SavedModel directory.
+
+    Returns
+    -------
+    path: str
+        Path of the SavedModel directory.
+    """
+    tf.saved_model.save(model, path)
+    return path
+
+
+def export_tflite(model, path, quantization=None, calibration_data=None, calibration_steps=100):
+    """Function that exports a Keras model in the TFLite format, optionally with post-training quantization.
+
+    Parameters
+    ----------
+    model: keras.Model
+        Model to export.
+    path: str
+        Path of the .tflite file.
+    quantization: str
+        None for a float32 model, 'float16' for float16 weights, 'int8' for int8 weights and activations
+        calibrated on calibration_data. Inputs and outputs stay float32 in every case.
+    calibration_data: tf.data.Dataset
+        Batched dataset of (image, label) pairs used to calibrate int8 quantization.
+    calibration_steps: int
+        Number of images used for calibration.
+
+    Returns
+    -------
+    path: str
+        Path of the .tflite file.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if calibration_data is None:
+            raise ValueError("int8 quantization requires calibration data")
+
+        def representative_dataset():
+            for image in calibration_data.unbatch().take(calibration_steps):
+                yield [tf.expand_dims(tf.cast(image[0], tf.float32), 0)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+    elif quantization is not None:
+        raise ValueError(f"Unsupported quantization: {quantization}, expected None, 'float16' or 'int8'")
+
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+    return path
+
+
+def load_predict_fn(path, model_format):
+    """Function that loads an exported model and returns a function running it on a batch of images.
+
+    Parameters
+    ----------
+    path: str
+        Path of the exported model.
+    model_format: str
+        Format of the exported model, one of FORMATS.
+
+    Returns
+    -------
+    predict_fn: callable
+        Function taking a float32 batch of images and returning prediction vectors.
+    """
+    if model_format == 'keras':
+        model = load_model(path)
+        return lambda img_batch: model.predict_on_batch(img_batch)
+
+    if model_format == 'savedmodel':
+        signature = tf.saved_model.load(path).signatures['serving_default']
+        input_name = list(signature.structured_input_signature[1].keys())[0]
+        return lambda img_batch: next(iter(signature(**{input_name: tf.constant(img_batch)}).values())).numpy()
+
+    interpreter = tf.lite.Interpreter(model_path=path)
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+
+    def predict_fn(img_batch):
+        interpreter.resize_tensor_input(input_index, img_batch.shape)
+        interpreter.allocate_tensors()
+        interpreter.set_tensor(input_index, img_batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index).copy()
+
+    return predict_fn
+
+
+def rss_bytes():
+    """Function that returns resident memory of the current process.
+
+    Returns
+    -------
+    rss: int
+        Resident set size in bytes, 0 if it cannot be read.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def disk_bytes(path):
+    """Function that returns size of an exported model on disk.
+
+    Parameters
+    ----------
+    path: str
+        Path of a model file or SavedModel directory.
+
+    Returns
+    -------
+    size: int
+        Size in bytes.
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+def benchmark_format(path, model_format, test_data, latency_runs=50):
+    """Function that measures latency, memory and accuracy of an exported model on the test split.
+
+    Parameters
+    ----------
+    path: str
+        Path of the exported model.
+    model_format: str
+        Format of the exported model, one of FORMATS.
+    test_data: tf.data.Dataset
+        Batched test dataset of (image, categorical label) pairs.
+    latency_runs: int
+        Number of single image predictions timed for latency percentiles.
+
+    Returns
+    -------
+    report: dict
+        Disk size, resident memory growth after loading, single image latency percentiles in milliseconds,
+        test accuracy and predicted classes of every test image.
+    """
+    rss_before = rss_bytes()
+    predict_fn = load_predict_fn(path, model_format)
+    rss_after = rss_bytes()
+
+    predicted, labels = [], []
+    for img_batch, label_batch in test_data:
+        predicted.append(np.argmax(predict_fn(img_batch.numpy().astype(np.float32)), axis=1))
+        labels.append(np.argmax(label_batch.numpy(), axis=1))
+    predicted, labels = np.concatenate(predicted), np.concatenate(labels)
+
+    single_image = next(iter(test_data))[0].numpy()[:1].astype(np.float32)
+    predict_fn(single_image)
+    latencies = []
+    for _ in range(latency_runs):
+        start = time.perf_counter()
+        predict_fn(single_image)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'disk_bytes': disk_bytes(path),
+        'rss_growth_bytes': rss_after - rss_before,
+        'latency_ms': {'p50': float(np.percentile(latencies, 50)), 'p95': float(np.percentile(latencies, 95))},
+        'accuracy': float(np.mean(predicted == labels)),
+        'predicted': predicted,
+    }
+
+
+def export_and_compare(model_path, images_dir, output_dir, formats=FORMATS, calibration_steps=100):
+    """Function that exports a trained model to the given formats and compares them with the original .h5 model.
+
+    Parameters
+    ----------
+    model_path: str
+        Path of the trained .h5 model, e.g. 'kidney_diagnose.h5'.
+    images_dir: str
+        Dataset directory accepted by load_images, must contain a test split.
+    output_dir: str
+        Directory the exported models are written to, named so that prediction.py's MODEL_BACKEND setting finds
+        them, e.g. 'kidney_diagnose_int8.tflite'.
+    formats: list of str
+        Formats to export and compare, subset of FORMATS.
+    calibration_steps: int
+        Number of training images used to calibrate int8 quantization.
+
+    Returns
+    -------
+    report: dict
+        Report of benchmark_format for every format, extended by the difference in accuracy and the fraction of
+        test images whose predicted class matches the .h5 model.
+    """
+    datasets = load_images(images_dir)
+    if len(datasets) < 3:
+        raise ValueError(f"{images_dir} has no test split")
+    train_data, _, test_data = datasets
+
+    model = load_model(model_path)
+    model_name = os.path.splitext(os.path.basename(model_path))[0]
+    os.makedirs(output_dir, exist_ok=True)
+
+    paths = {'keras': model_path}
+    for model_format in formats:
+        if model_format == 'savedmodel':
+            paths[model_format] = export_savedmodel(model, os.path.join(output_dir, f'{model_name}_savedmodel'))
+        elif model_format.startswith('tflite'):
+            quantization = model_format.split('_')[1] if '_' in model_format else None
+            suffix = f'_{quantization}' if quantization else ''
+            paths[model_format] = export_tflite(model, os.path.join(output_dir, f'{model_name}{suffix}.tflite'),
+                                                quantization=quantization, calibration_data=train_data,
+                                                calibration_steps=calibration_steps)
+
+    reports = {model_format: benchmark_format(paths[model_format], model_format, test_data)
+               for model_format in ['keras'] + [f for f in formats if f != 'keras']}
+    reference = reports['keras']
+    for report in reports.values():
+        report['accuracy_delta'] = report['accuracy'] - reference['accuracy']
+        report['agreement'] = float(np.mean(report.pop('predicted') == reference['predicted']))
+    return reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a trained classifier to optimized CPU inference formats "
+                                                 "and compare them with the original model on the test split.")
+    parser.add_argument('model_path', help="Trained .h5 model, e.g. kidney_diagnose.h5")
+    parser.add_argument('images_dir', help="Dataset directory with a test split")
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--formats', nargs='+', default=FORMATS[1:], choices=FORMATS)
+    parser.add_argument('--calibration-steps', type=int, default=100)
+    parser.add_argument('--report', default=None, help="Path of the JSON report")
+    args = parser.parse_args()
+
+    results = export_and_compare(args.model_path, args.images_dir, args.output_dir, args.formats,
+                                 args.calibration_steps)
+    print(f"{'format':<16}{'disk MB':>10}{'RSS MB':>10}{'p50 ms':>10}{'p95 ms':>10}{'accuracy':>10}"
+          f"{'delta':>10}{'agree':>10}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['disk_bytes'] / 1024 ** 2:>10.1f}{result['rss_growth_bytes'] / 1024 ** 2:>10.1f}"
+              f"{result['latency_ms']['p50']:>10.2f}{result['latency_ms']['p95']:>10.2f}"
+              f"{result['accuracy']:>10.4f}{result['accuracy_delta']:>+10.4f}{result['agreement']:>10.4f}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent=2)
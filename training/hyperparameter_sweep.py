@@ -0,0 +1,236 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bottleneck_features import ORGANS, organ_features
+
+SEARCH_SPACE = {
+    'first_dense_neurons': [128, 256, 512, 1024],
+    'dropout': (0.2, 0.6),
+    'learning_rate': (1e-4, 3e-3),
+    'drop': [0.5, 0.7, 1.0],
+    'epochs_drop': [5, 10, 15],
+}
+RESULT_FIELDS = ['rank', 'trial', 'rung', 'epochs', 'val_loss', 'val_accuracy', 'loss', 'accuracy',
+                 'first_dense_neurons', 'dropout', 'learning_rate', 'drop', 'epochs_drop']
+
+
+def sample_configs(num_trials, seed=123) -> list[dict]:
+    """Function that samples random trial configurations from SEARCH_SPACE.
+
+    Parameters
+    ----------
+    num_trials: int
+        Number of configurations.
+    seed: int
+        Seed of the random generator.
+
+    Returns
+    -------
+    configs: list of dict
+        Sampled configurations, learning rates are sampled log-uniformly.
+    """
+    rng = np.random.RandomState(seed)
+    configs = []
+    for _ in range(num_trials):
+        low, high = SEARCH_SPACE['learning_rate']
+        configs.append({
+            'first_dense_neurons': int(rng.choice(SEARCH_SPACE['first_dense_neurons'])),
+            'dropout': round(float(rng.uniform(*SEARCH_SPACE['dropout'])), 3),
+            'learning_rate': float(f'{math.exp(rng.uniform(math.log(low), math.log(high))):.2e}'),
+            'drop': float(rng.choice(SEARCH_SPACE['drop'])),
+            'epochs_drop': int(rng.choice(SEARCH_SPACE['epochs_drop'])),
+        })
+    return configs
+
+
+def _init_worker(threads):
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def run_trial(organ, config, feature_files, trial_dir, initial_epoch, epochs, batch_size=32) -> dict:
+    """Function that trains a trial's classifier head on cached features up to the given epoch.
+
+    The head is saved to trial_dir together with its optimizer state, so a trial promoted to the next rung resumes
+    training instead of starting over.
+
+    Parameters
+    ----------
+    organ: str
+        'kidney' or 'chest', see ORGANS.
+    config: dict
+        Trial configuration, see SEARCH_SPACE.
+    feature_files: dict
+        Mapping from split name to paths of the split's memory-mapped features and labels.
+    trial_dir: str
+        Directory of the trial's head.
+    initial_epoch: int
+        Number of epochs the trial has already been trained for.
+    epochs: int
+        Number of epochs the trial is trained for in total.
+    batch_size: int
+        Batch size.
+
+    Returns
+    -------
+    metrics: dict
+        Training and validation loss and accuracy after the last epoch.
+    """
+    from keras import Sequential
+    from keras.callbacks import LearningRateScheduler
+    from keras.layers import Input
+    from keras.models import load_model
+    from keras.optimizers import Adam
+    from training_utils import make_step_decay
+
+    train_features, train_labels = (np.load(path, mmap_mode='r') for path in feature_files['train'])
+    validation_features, validation_labels = (np.load(path, mmap_mode='r') for path in feature_files['valid'])
+
+    head_path = os.path.join(trial_dir, 'head.h5')
+    if initial_epoch > 0 and os.path.exists(head_path):
+        head = load_model(head_path)
+    else:
+        settings = ORGANS[organ]
+        head = Sequential([Input(shape=train_features.shape[1:])])
+        head = settings['assemble'](head, **dict(settings['assemble_kwargs'],
+                                                 first_dense_neurons=config['first_dense_neurons'],
+                                                 dropout=config['dropout']))
+        head.compile(optimizer=Adam(learning_rate=config['learning_rate']), loss='categorical_crossentropy',
+                     metrics=['accuracy'])
+        initial_epoch = 0
+
+    schedule = make_step_decay(config['learning_rate'], config['drop'], config['epochs_drop'])
+    history = head.fit(train_features, train_labels, batch_size=batch_size, epochs=epochs,
+                       initial_epoch=initial_epoch, validation_data=(validation_features, validation_labels),
+                       shuffle=True, callbacks=[LearningRateScheduler(schedule)], verbose=0)
+    os.makedirs(trial_dir, exist_ok=True)
+    head.save(head_path)
+    return {key: float(values[-1]) for key, values in history.history.items()
+            if key not in ('lr', 'learning_rate')}
+
+
+def successive_halving(organ, num_trials=27, min_epochs=2, max_epochs=54, eta=3, workers=None, threads=None,
+                       cache_dir='features_cache', output_dir='sweep', seed=123) -> list[dict]:
+    """Function that runs a hyperparameter sweep of an organ classifier's head with successive halving.
+
+    Features of the dataset are extracted once into the bottleneck feature cache and memory-mapped by every trial,
+    so trials share a single copy of the input data through the page cache. All trials of a rung run in parallel in
+    a process pool, each with its own budget of CPU threads. After every rung, only the best 1 / eta of the trials,
+    by validation loss, are promoted and trained eta times longer, until max_epochs is reached.
+
+    Parameters
+    ----------
+    organ: str
+        'kidney' or 'chest', see ORGANS.
+    num_trials: int
+        Number of sampled configurations.
+    min_epochs: int
+        Number of epochs every trial is trained for in the first rung.
+    max_epochs: int
+        Maximum number of epochs of a trial.
+    eta: int
+        Factor by which the number of trials is reduced, and the number of epochs increased, after every rung.
+    workers: int
+        Number of trials run in parallel, defaults to the number of CPUs divided by threads.
+    threads: int
+        Number of TensorFlow threads of every trial, defaults to 2.
+    cache_dir: str
+        Directory of the feature cache.
+    output_dir: str
+        Directory the trials' heads and the results tables are written to.
+    seed: int
+        Seed of the sampling of configurations.
+
+    Returns
+    -------
+    results: list of dict
+        Configuration, last rung, number of epochs and metrics of every trial, best first.
+    """
+    features = organ_features(organ, cache_dir)
+    feature_files = {split: (split_features.filename, split_labels.filename)
+                     for split, (split_features, split_labels) in features.items()}
+
+    threads = threads or 2
+    workers = workers or max(1, (os.cpu_count() or 1) // threads)
+    trials = [{'trial': i, 'rung': 0, 'epochs': 0, **config}
+              for i, config in enumerate(sample_configs(num_trials, seed))]
+
+    active = trials
+    rung, epochs = 0, min_epochs
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(threads,)) as executor:
+        while active:
+            futures = [executor.submit(run_trial, organ, trial, feature_files,
+                                       os.path.join(output_dir, f"trial_{trial['trial']:03d}"), trial['epochs'],
+                                       epochs) for trial in active]
+            for trial, future in zip(active, futures):
+                trial.update(future.result(), rung=rung, epochs=epochs)
+            active.sort(key=lambda trial: trial['val_loss'])
+            print(f"Rung {rung}: {len(active)} trials trained for {epochs} epochs, "
+                  f"best val_loss {active[0]['val_loss']:.4f} (trial {active[0]['trial']})")
+
+            if epochs >= max_epochs or len(active) < eta:
+                break
+            active = active[:len(active) // eta]
+            rung, epochs = rung + 1, min(epochs * eta, max_epochs)
+
+    results = sorted(trials, key=lambda trial: (-trial['rung'], trial['val_loss']))
+    write_results(results, output_dir)
+    return results
+
+
+def write_results(results, output_dir):
+    """Function that writes a ranked table of trials to results.csv and results.json.
+
+    Parameters
+    ----------
+    results: list of dict
+        Trials, best first.
+    output_dir: str
+        Directory the tables are written to.
+
+    Returns
+    -------
+    None
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for rank, trial in enumerate(results, start=1):
+            writer.writerow({'rank': rank, **trial})
+    with open(os.path.join(output_dir, 'results.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tune hyperparameters of a classifier head in parallel trials "
+                                                 "with successive halving.")
+    parser.add_argument('organ', choices=sorted(ORGANS))
+    parser.add_argument('--trials', type=int, default=27)
+    parser.add_argument('--min-epochs', type=int, default=2)
+    parser.add_argument('--max-epochs', type=int, default=54)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None, help="TensorFlow threads per trial")
+    parser.add_argument('--cache-dir', default='features_cache')
+    parser.add_argument('--output-dir', default='sweep')
+    parser.add_argument('--seed', type=int, default=123)
+    args = parser.parse_args()
+
+    sweep_results = successive_halving(args.organ, args.trials, args.min_epochs, args.max_epochs, args.eta,
+                                       args.workers, args.threads, args.cache_dir, args.output_dir, args.seed)
+    for position, result in enumerate(sweep_results[:10], start=1):
+        print(f"{position:>2}. trial {result['trial']:>3} rung {result['rung']} val_loss {result['val_loss']:.4f} "
+              f"val_accuracy {result['val_accuracy']:.4f} {json.dumps({k: result[k] for k in SEARCH_SPACE})}")
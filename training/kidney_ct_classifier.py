@@ -2,44 +2,60 @@ import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 from keras import Sequential
+from keras.callbacks import EarlyStopping
 from keras.optimizers import Adam
 from keras.losses import CategoricalCrossentropy
 from keras.src.layers import Rescaling
-from utils import load_images, plot_history
+from training_utils import plot_history, TrainingMonitor, ResumableCheckpoint
 from model import assemble_kidney_classifier
 from keras.applications.vgg16 import VGG16
+from distributed_training import (cluster_config, get_distribution_strategy, is_chief, load_training_data,
+                                  restore_checkpoint, worker_path)
 
-train_data, validation_data, test_data = load_images('CT-KIDNEY-DATASET-Normal-Cyst-Tumor-Stone')
+early_stopping = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
+
+strategy = get_distribution_strategy()
+monitor = TrainingMonitor(worker_path('runs/kidney'), batch_size=32 * cluster_config()[0])
+(train_data, validation_data, test_data), steps = load_training_data(strategy,
+                                                                     'CT-KIDNEY-DATASET-Normal-Cyst-Tumor-Stone',
+                                                                     watch=monitor.watch)
+train_steps, validation_steps, test_steps = steps or (None, None, None)
 
 input_shape = (150, 150, 3)
 
-pretrained_model = VGG16(include_top=False,
-                         input_shape=input_shape,
-                         pooling='max', classes=4,
-                         weights='imagenet')
+with strategy.scope():
+    pretrained_model = VGG16(include_top=False,
+                             input_shape=input_shape,
+                             pooling='max', classes=4,
+                             weights='imagenet')
+
+    pretrained_model.trainable = False
 
-pretrained_model.trainable = False
+    VGG_model = Sequential([
+        Rescaling(1. / 255, input_shape=(150, 150, 3)),
+        pretrained_model
+    ])
 
-VGG_model = Sequential([
-    Rescaling(1. / 255, input_shape=(150, 150, 3)),
-    pretrained_model
-])
+    VGG_model = assemble_kidney_classifier(VGG_model, num_classes=4, first_dense_neurons=512, dropout=0.5)
 
-VGG_model = assemble_kidney_classifier(VGG_model, num_classes=4, first_dense_neurons=512, dropout=0.5)
+    VGG_model.compile(optimizer=Adam(0.0001),
+                      loss=CategoricalCrossentropy(), metrics=["accuracy"])
 
-VGG_model.compile(optimizer=Adam(0.0001),
-                  loss=CategoricalCrossentropy(), metrics=["accuracy"])
+checkpoint = ResumableCheckpoint(worker_path('checkpoints/kidney'), early_stopping=early_stopping)
+initial_epoch = restore_checkpoint(strategy, checkpoint, VGG_model, 'checkpoints/kidney')
 
 VGG_model.summary()
-history = VGG_model.fit(train_data, epochs=15,
-                        validation_data=validation_data)
+history = VGG_model.fit(train_data, epochs=15, initial_epoch=initial_epoch, steps_per_epoch=train_steps,
+                        validation_data=validation_data, validation_steps=validation_steps,
+                        callbacks=[early_stopping, checkpoint, monitor])
 
-test_loss, test_accuracy = VGG_model.evaluate(test_data)
+test_loss, test_accuracy = VGG_model.evaluate(test_data, steps=test_steps)
 
-plot_history(history)
+if is_chief():
+    plot_history(history, 'kidney_ct_plot.png')
 print(f'Test loss: {test_loss}, Test accuracy: {test_accuracy}')
 
-VGG_model.save('kidney_diagnose.h5')
+VGG_model.save(worker_path('kidney_diagnose.h5'))
 
 """
 Epoch 15/15
@@ -1,4 +1,5 @@
-from tensorflow.keras.layers import BatchNormalization, Dense, Dropout, Flatten
+from tensorflow.keras.layers import (Activation, BatchNormalization, Conv2D, Dense, Dropout, Flatten,
+                                     GlobalAveragePooling2D, MaxPooling2D, RandomZoom, Rescaling, SeparableConv2D)
 from tensorflow.keras.models import Sequential
 
 
@@ -69,3 +70,49 @@ def assemble_chest_classifier(model, num_classes, first_dense_neurons, dropout=0
     model.add(Dense(num_classes, activation=activation))
 
     return model
+
+
+def build_student_classifier(num_classes, input_shape=(150, 150, 3), widths=(32, 64, 128, 256), dropout=0.3,
+                             zoom=None) -> Sequential:
+    """Function that builds a small convolutional classifier, trained by distillation.py to mimic a VGG16 classifier.
+
+    The student takes the same unscaled images as the VGG16 classifiers and outputs class probabilities, so it is a
+    drop-in replacement for them. Its last Dense layer outputs logits, followed by a separate softmax Activation.
+
+    Parameters
+    ----------
+    num_classes: int
+        The number of possible classes.
+    input_shape: tuple of int
+        Shape of input images.
+    widths: tuple of int
+        Number of filters of every convolutional block, every block halves the resolution.
+    dropout: float
+        Dropout rate.
+    zoom: float
+        Zoom factor of a RandomZoom augmentation layer, None disables augmentation.
+
+    Returns
+    -------
+    model: keras.models.Sequential
+        Student classifier.
+    """
+    model = Sequential([Rescaling(1. / 255, input_shape=input_shape)])
+    if zoom:
+        model.add(RandomZoom(zoom))
+
+    model.add(Conv2D(widths[0], 3, strides=2, padding='same', use_bias=False))
+    model.add(BatchNormalization())
+    model.add(Activation('relu'))
+    for width in widths[1:]:
+        model.add(SeparableConv2D(width, 3, padding='same', use_bias=False))
+        model.add(BatchNormalization())
+        model.add(Activation('relu'))
+        model.add(MaxPooling2D())
+
+    model.add(GlobalAveragePooling2D())
+    model.add(Dropout(dropout))
+    model.add(Dense(num_classes))
+    model.add(Activation('softmax'))
+
+    return model
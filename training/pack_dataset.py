@@ -0,0 +1,139 @@
+import os
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import argparse
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+from training_utils import PACKED_INDEX, decode_and_resize, split_image_files
+
+
+def files_fingerprint(paths) -> str:
+    """Function that computes a hash identifying a list of files and their contents' versions.
+
+    Parameters
+    ----------
+    paths: list of str
+        Paths to files.
+
+    Returns
+    -------
+    digest: str
+        Hex encoded SHA-256 hash of path, size and modification time of every file.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f'{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def write_shard(path, image_paths, label_indices, image_size):
+    """Function that writes resized images and their labels to a single TFRecord shard.
+
+    Parameters
+    ----------
+    path: str
+        Path of the shard.
+    image_paths: list of str
+        Paths to image files.
+    label_indices: list of int
+        Label of every image.
+    image_size: tuple of int
+        Size the images are resized to.
+
+    Returns
+    -------
+    count: int
+        Number of images written.
+    """
+    tmp_path = f'{path}.tmp'
+    with tf.io.TFRecordWriter(tmp_path) as writer:
+        for image_path, label in zip(image_paths, label_indices):
+            image = decode_and_resize(tf.constant(image_path), image_size).numpy()
+            example = tf.train.Example(features=tf.train.Features(feature={
+                'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+                'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+            }))
+            writer.write(example.SerializeToString())
+    os.replace(tmp_path, path)
+    return len(image_paths)
+
+
+def pack_dataset(images_dir, output_dir, image_size=(150, 150), shard_size=1024, validation_split=0.2, seed=123,
+                 workers=None):
+    """Function that packs a dataset directory into sharded TFRecord files of fixed-resolution uint8 images.
+
+    Every split found by load_images (train, valid and test directories, or class directories with a validation
+    split) is shuffled with the given seed and written as shards of at most shard_size images, in parallel.
+    An index with class names, shards, image counts and a fingerprint of the source files of every split is written
+    to PACKED_INDEX, which lets load_images read the packed dataset directly.
+
+    Parameters
+    ----------
+    images_dir: str
+        Path to directory containing images, in any layout accepted by load_images.
+    output_dir: str
+        Directory the shards and the index are written to.
+    image_size: tuple of int
+        Size the images are resized to.
+    shard_size: int
+        Maximum number of images per shard.
+    validation_split: float
+        Fraction of training images reserved for validation when there is no valid directory.
+    seed: int
+        Seed of the validation split and of the order of images in shards.
+    workers: int
+        Number of shards written in parallel, defaults to the number of CPUs.
+
+    Returns
+    -------
+    index: dict
+        Written index.
+    """
+    splits, class_names = split_image_files(images_dir, validation_split, seed=seed)
+    os.makedirs(output_dir, exist_ok=True)
+    index = {'image_size': list(image_size), 'class_names': class_names, 'splits': {}}
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = []
+        for split, (paths, label_indices) in splits.items():
+            order = np.random.RandomState(seed).permutation(len(paths))
+            paths = [paths[i] for i in order]
+            label_indices = [label_indices[i] for i in order]
+            num_shards = max(1, -(-len(paths) // shard_size))
+            shards = [f'{split}-{i:05d}-of-{num_shards:05d}.tfrecord' for i in range(num_shards)]
+            for i, shard in enumerate(shards):
+                futures.append(executor.submit(write_shard, os.path.join(output_dir, shard),
+                                               paths[i * shard_size:(i + 1) * shard_size],
+                                               label_indices[i * shard_size:(i + 1) * shard_size], image_size))
+            index['splits'][split] = {'shards': shards, 'count': len(paths),
+                                      'fingerprint': files_fingerprint(sorted(paths))}
+        for future in futures:
+            future.result()
+
+    with open(os.path.join(output_dir, PACKED_INDEX), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pack a CT image directory into sharded TFRecord files "
+                                                 "readable by load_images.")
+    parser.add_argument('images_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--image-size', type=int, nargs=2, default=[150, 150])
+    parser.add_argument('--shard-size', type=int, default=1024)
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=123)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    packed = pack_dataset(args.images_dir, args.output_dir, tuple(args.image_size), args.shard_size,
+                          args.validation_split, args.seed, args.workers)
+    for split_name, split_index in packed['splits'].items():
+        print(f"{split_name}: {split_index['count']} images in {len(split_index['shards'])} shards")
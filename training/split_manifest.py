@@ -0,0 +1,176 @@
+import argparse
+import csv
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from training_utils import IMAGE_EXTENSIONS, path_bucket
+
+MANIFEST_FIELDS = ['path', 'class', 'split', 'size', 'hash']
+SPLIT_DIRS = ('train', 'valid', 'test')
+
+
+def scan_directory(directory):
+    """Function that recursively lists image files of a directory with os.scandir.
+
+    Parameters
+    ----------
+    directory: str
+        Directory to scan.
+
+    Returns
+    -------
+    files: list of tuple
+        Path and size of every image file.
+    """
+    files = []
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append((entry.path, entry.stat().st_size))
+    return files
+
+
+def content_hash(path) -> str:
+    """Function that computes hash of a file's contents.
+
+    Parameters
+    ----------
+    path: str
+        Path to the file.
+
+    Returns
+    -------
+    digest: str
+        Hex encoded SHA-1 hash of the file.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def assign_split(relative_path, test_split=0.2, validation_split=0.2) -> str:
+    """Function that deterministically assigns a file to a split based on the hash of its path.
+
+    The assignment of a file depends only on its own path, so adding or removing other files never moves it to
+    another split.
+
+    Parameters
+    ----------
+    relative_path: str
+        Path of the file relative to the dataset directory.
+    test_split: float
+        Fraction of files assigned to the test split.
+    validation_split: float
+        Fraction of files assigned to the validation split.
+
+    Returns
+    -------
+    split: str
+        'train', 'valid' or 'test'.
+    """
+    bucket = path_bucket(relative_path)
+    if bucket < test_split:
+        return 'test'
+    if bucket < test_split + validation_split:
+        return 'valid'
+    return 'train'
+
+
+def write_manifest(images_dir, manifest_path=None, test_split=0.2, validation_split=0.2, hash_contents=True,
+                   workers=None, scan_ahead=None):
+    """Function that writes a manifest assigning every image of a dataset directory to a split, without moving files.
+
+    Class directories (or, for already split datasets, train/valid/test directories with class subdirectories)
+    are processed in order, while up to scan_ahead of them are scanned in parallel, and files of a directory are
+    hashed in parallel. Files of unsplit class directories are assigned to splits with assign_split, files of
+    already split datasets keep their split. Every row of the manifest holds the path of the file relative to the
+    manifest's directory, its class, split, size and, optionally, hash of its contents. Rows are written as soon as
+    each directory is processed, so memory use grows with the number of files of the scan_ahead largest class
+    directories, not with the size of the whole dataset. load_images reads the manifest when given its path instead
+    of a directory.
+
+    Parameters
+    ----------
+    images_dir: str
+        Path to directory containing class directories with images.
+    manifest_path: str
+        Path of the CSV manifest, defaults to manifest.csv in images_dir.
+    test_split: float
+        Fraction of images assigned to the test split.
+    validation_split: float
+        Fraction of images assigned to the validation split, 0 lets load_images split validation data off the
+        training split, also by hashing paths.
+    hash_contents: bool
+        Whether to compute hashes of file contents.
+    workers: int
+        Number of threads scanning directories and hashing files, defaults to 4 times the number of CPUs.
+    scan_ahead: int
+        Number of class directories scanned at the same time, defaults to the number of threads. Lower values bound
+        memory use on datasets with many large class directories.
+
+    Returns
+    -------
+    counts: dict
+        Number of images per split.
+    """
+    manifest_path = manifest_path or os.path.join(images_dir, 'manifest.csv')
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    presplit = [d for d in SPLIT_DIRS if os.path.isdir(os.path.join(images_dir, d))]
+    if presplit:
+        class_dirs = [(split, entry.name, entry.path) for split in presplit
+                      for entry in os.scandir(os.path.join(images_dir, split)) if entry.is_dir()]
+    else:
+        class_dirs = [(None, entry.name, entry.path) for entry in os.scandir(images_dir) if entry.is_dir()]
+
+    counts = dict.fromkeys(SPLIT_DIRS, 0)
+    tmp_path = f'{manifest_path}.tmp'
+    workers = workers or 4 * (os.cpu_count() or 1)
+    scan_ahead = max(1, scan_ahead or workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(tmp_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(MANIFEST_FIELDS)
+        pending = iter(sorted(class_dirs, key=lambda item: (item[0] or '', item[1])))
+        scans = deque()
+        while True:
+            while len(scans) < scan_ahead and (class_dir := next(pending, None)) is not None:
+                split, class_name, path = class_dir
+                scans.append((split, class_name, executor.submit(scan_directory, path)))
+            if not scans:
+                break
+            split, class_name, scan = scans.popleft()
+            files = sorted(scan.result())
+            hashes = executor.map(content_hash, [path for path, _ in files]) if hash_contents else None
+            for path, size in files:
+                relative_path = os.path.relpath(path, manifest_dir)
+                file_split = split or assign_split(os.path.relpath(path, images_dir), test_split, validation_split)
+                writer.writerow([relative_path, class_name, file_split, size, next(hashes) if hashes else ''])
+                counts[file_split] += 1
+    os.replace(tmp_path, manifest_path)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a manifest assigning images to train/valid/test splits "
+                                                 "by hashing their paths, without moving any file.")
+    parser.add_argument('images_dir')
+    parser.add_argument('--manifest', default=None)
+    parser.add_argument('--test-split', type=float, default=0.2)
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--no-hash', action='store_true', help="Skip hashing file contents")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--scan-ahead', type=int, default=None,
+                        help="Class directories scanned at the same time, defaults to the number of workers")
+    args = parser.parse_args()
+
+    split_counts = write_manifest(args.images_dir, args.manifest, args.test_split, args.validation_split,
+                                  not args.no_hash, args.workers, args.scan_ahead)
+    print(', '.join(f'{split}: {count}' for split, count in split_counts.items()))
@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from bottleneck_features import extract_features
+
+
+def feature_extractor():
+    return tf.keras.Sequential([tf.keras.Input((8, 8, 3)), tf.keras.layers.GlobalAveragePooling2D()])
+
+
+def labeled_dataset(num_images):
+    images = np.arange(num_images * 8 * 8 * 3, dtype=np.float32).reshape(num_images, 8, 8, 3)
+    labels = np.eye(2, dtype=np.float32)[np.arange(num_images) % 2]
+    dataset = tf.data.Dataset.from_tensor_slices((images, labels)).batch(2)
+    dataset.num_images = num_images
+    return dataset, images, labels
+
+
+def test_features_of_every_view_are_stored(tmp_path):
+    dataset, images, labels = labeled_dataset(5)
+
+    features, stored_labels = extract_features(feature_extractor(), dataset, str(tmp_path / 'features'), views=2)
+
+    expected = images.mean(axis=(1, 2))
+    np.testing.assert_allclose(features, np.concatenate([expected, expected]), rtol=1e-6)
+    np.testing.assert_array_equal(stored_labels, np.concatenate([labels, labels]))
+    assert not os.path.exists(tmp_path / 'features.tmp')
+
+
+def test_empty_dataset_is_rejected(tmp_path):
+    dataset, _, _ = labeled_dataset(0)
+
+    with pytest.raises(ValueError, match='no images'):
+        extract_features(feature_extractor(), dataset, str(tmp_path / 'features'))
+    assert not os.path.exists(tmp_path / 'features.tmp')
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from keras.optimizers import SGD
+
+from distillation import Distiller
+from model import build_student_classifier
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def linear_classifier(seed):
+    tf.keras.utils.set_random_seed(seed)
+    return tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(3), tf.keras.layers.Activation('softmax')])
+
+
+@pytest.mark.parametrize('alpha', [0.0, 0.3, 1.0])
+def test_loss_mixes_label_and_softened_teacher_losses(alpha):
+    images = np.random.default_rng(0).normal(size=(6, 4)).astype(np.float32)
+    labels = np.eye(3, dtype=np.float32)[[0, 1, 2, 0, 1, 2]]
+    student, teacher = linear_classifier(1), linear_classifier(2)
+    distiller = Distiller(student, teacher, temperature=2.0, alpha=alpha)
+    distiller.compile(optimizer=SGD(learning_rate=0.0))
+
+    history = distiller.fit(images, labels, batch_size=6, epochs=1, shuffle=False, verbose=0)
+
+    student_logits = images @ student.layers[0].kernel.numpy() + student.layers[0].bias.numpy()
+    teacher_logits = np.log(teacher.predict(images, verbose=0) + 1e-7)
+    label_loss = -np.mean(np.sum(labels * np.log(softmax(student_logits)), axis=-1))
+    soft_teacher, soft_student = softmax(teacher_logits / 2.0), softmax(student_logits / 2.0)
+    distillation_loss = 4.0 * np.mean(np.sum(soft_teacher * np.log(soft_teacher / soft_student), axis=-1))
+    assert history.history['distillation_loss'][0] == pytest.approx(distillation_loss, rel=1e-4)
+    assert history.history['loss'][0] == pytest.approx(alpha * label_loss + (1 - alpha) * distillation_loss,
+                                                       rel=1e-4)
+
+
+def test_only_the_student_is_trained():
+    images = np.random.default_rng(0).uniform(0, 255, size=(8, 32, 32, 3)).astype(np.float32)
+    labels = np.eye(2, dtype=np.float32)[np.arange(8) % 2]
+    student = build_student_classifier(2, input_shape=(32, 32, 3), widths=(4, 8))
+    teacher = build_student_classifier(2, input_shape=(32, 32, 3), widths=(4, 8))
+    student_weights, teacher_weights = student.get_weights(), teacher.get_weights()
+    distiller = Distiller(student, teacher)
+    distiller.compile(optimizer=SGD(learning_rate=0.1))
+
+    distiller.fit(images, labels, batch_size=4, epochs=1, verbose=0)
+
+    assert any(not np.array_equal(before, after) for before, after in zip(student_weights, student.get_weights()))
+    for before, after in zip(teacher_weights, teacher.get_weights()):
+        np.testing.assert_array_equal(before, after)
+    np.testing.assert_allclose(distiller.predict(images, verbose=0).sum(axis=-1), 1.0, rtol=1e-5)
@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('tensorflow')
+
+import distributed_training
+from distributed_training import cluster_config, launch_local_workers, worker_path
+
+
+def tf_config(num_workers, index):
+    return json.dumps({'cluster': {'worker': [f'localhost:{1000 + i}' for i in range(num_workers)]},
+                       'task': {'type': 'worker', 'index': index}})
+
+
+def test_cluster_config_defaults_to_a_single_worker(monkeypatch):
+    monkeypatch.delenv('TF_CONFIG', raising=False)
+    assert cluster_config() == (1, 0)
+
+    monkeypatch.setenv('TF_CONFIG', tf_config(3, 2))
+    assert cluster_config() == (3, 2)
+
+
+def test_only_the_chief_writes_to_the_given_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(distributed_training, '_worker_dir', None)
+    monkeypatch.setattr(distributed_training.tempfile, 'tempdir', str(tmp_path / 'tmp'))
+    (tmp_path / 'tmp').mkdir()
+    checkpoint_dir = str(tmp_path / 'run' / 'checkpoints')
+    model_path = str(tmp_path / 'run' / 'model.h5')
+
+    monkeypatch.setenv('TF_CONFIG', tf_config(2, 0))
+    assert worker_path(checkpoint_dir) == checkpoint_dir
+
+    monkeypatch.setenv('TF_CONFIG', tf_config(2, 1))
+    worker_checkpoint_dir = worker_path(checkpoint_dir)
+    worker_model_path = worker_path(model_path)
+    assert worker_checkpoint_dir.startswith(str(tmp_path / 'tmp' / 'worker_1_'))
+    assert os.path.dirname(worker_checkpoint_dir) == os.path.dirname(worker_model_path)
+    assert os.path.isdir(os.path.dirname(worker_model_path))
+    assert worker_checkpoint_dir.endswith(checkpoint_dir)
+
+
+def test_local_workers_get_their_own_task(tmp_path):
+    script = tmp_path / 'worker.py'
+    script.write_text("import json, os, sys\n"
+                      "task = json.loads(os.environ['TF_CONFIG'])['task']['index']\n"
+                      f"open(os.path.join({str(tmp_path)!r}, str(task)), 'w').write(os.environ['TF_CONFIG'])\n"
+                      "sys.exit(3 if task == 1 else 0)\n")
+
+    assert launch_local_workers(2, [sys.executable, str(script)], threads_per_worker=1) == [0, 3]
+
+    configs = [json.loads((tmp_path / str(index)).read_text()) for index in range(2)]
+    assert configs[0]['cluster'] == configs[1]['cluster']
+    assert len(set(configs[0]['cluster']['worker'])) == 2
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+from PIL import Image
+
+from evaluate_model import evaluate_model
+from pack_dataset import pack_dataset
+from training_utils import decode_and_resize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'prediction'))
+from prediction import preprocess_batch
+
+CLASSES = ['Cyst', 'Normal']
+
+
+def make_dataset(directory, per_class=4):
+    rng = np.random.RandomState(0)
+    for split in ('train', 'test'):
+        for class_name in CLASSES:
+            os.makedirs(directory / split / class_name)
+            for i in range(per_class):
+                pixels = rng.randint(0, 256, (300 + 40 * i, 420, 3), dtype=np.uint8)
+                Image.fromarray(pixels).save(directory / split / class_name / f'{i}.jpg', quality=90)
+
+
+def save_model(path):
+    model = tf.keras.Sequential([tf.keras.Input((150, 150, 3)), tf.keras.layers.GlobalAveragePooling2D(),
+                                 tf.keras.layers.Dense(len(CLASSES), activation='softmax')])
+    model.save(path)
+
+
+@pytest.mark.parametrize('mode, size', [('RGB', (1200, 900)), ('L', (640, 512)), ('RGB', (140, 160))])
+def test_serving_resize_matches_prediction(tmp_path, mode, size):
+    rng = np.random.RandomState(1)
+    shape = (size[1], size[0], 3) if mode == 'RGB' else (size[1], size[0])
+    path = str(tmp_path / 'scan.jpg')
+    Image.fromarray(rng.randint(0, 256, shape, dtype=np.uint8), mode).save(path, quality=90)
+
+    image = decode_and_resize(tf.constant(path), (150, 150), resize='serving').numpy()
+    with Image.open(path) as served:
+        expected = preprocess_batch([served])[0]
+
+    np.testing.assert_array_equal(image.astype(np.float32), expected)
+
+
+def test_evaluate_model_reads_directories_and_packed_datasets(tmp_path):
+    make_dataset(tmp_path / 'images')
+    model_path = str(tmp_path / 'model.h5')
+    save_model(model_path)
+    pack_dataset(str(tmp_path / 'images'), str(tmp_path / 'packed'), shard_size=3, workers=1)
+
+    report = evaluate_model(model_path, str(tmp_path / 'images'), 'test', batch_size=3)
+    packed_report = evaluate_model(model_path, str(tmp_path / 'packed'), 'test', batch_size=3)
+    all_report = evaluate_model(model_path, str(tmp_path / 'images'), 'all', batch_size=3)
+
+    assert report['images'] == packed_report['images'] == 8
+    assert all_report['images'] == 16
+    assert report['class_names'] == packed_report['class_names'] == CLASSES
+    assert all(os.path.isfile(item['path']) for item in report['worst_misclassified'])
+    assert all(item['path'].startswith(str(tmp_path / 'packed') + '#test/')
+               for item in packed_report['worst_misclassified'])
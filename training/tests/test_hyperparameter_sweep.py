@@ -0,0 +1,60 @@
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('tensorflow')
+
+import hyperparameter_sweep
+from hyperparameter_sweep import sample_configs, successive_halving
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def run_trial(organ, config, feature_files, trial_dir, initial_epoch, epochs, batch_size=32):
+        calls.append((config['trial'], initial_epoch, epochs))
+        # Trials rank 0, 2, 4, 6, 8, 1, 3, 5, 7 at every rung, and improve with more epochs
+        return {'val_loss': 5 * config['trial'] % 9 + 1 / epochs, 'val_accuracy': 0.5, 'loss': 1.0, 'accuracy': 0.5}
+
+    split = (SimpleNamespace(filename='features.npy'), SimpleNamespace(filename='labels.npy'))
+    monkeypatch.setattr(hyperparameter_sweep, 'organ_features', lambda organ, cache_dir: {'train': split,
+                                                                                          'valid': split})
+    monkeypatch.setattr(hyperparameter_sweep, 'run_trial', run_trial)
+    monkeypatch.setattr(hyperparameter_sweep, 'ProcessPoolExecutor',
+                        lambda max_workers, **kwargs: ThreadPoolExecutor(max_workers))
+    return calls
+
+
+def test_best_third_of_every_rung_is_promoted(calls, tmp_path):
+    results = successive_halving('kidney', num_trials=9, min_epochs=1, max_epochs=9, eta=3, workers=2,
+                                 output_dir=str(tmp_path))
+
+    assert [result['trial'] for result in results] == [0, 2, 4, 6, 8, 1, 3, 5, 7]
+    assert [(result['rung'], result['epochs']) for result in results[:4]] == [(2, 9), (1, 3), (1, 3), (0, 1)]
+    assert sorted(call for call in calls if call[0] == 0) == [(0, 0, 1), (0, 1, 3), (0, 3, 9)]
+    assert len(calls) == 9 + 3 + 1
+
+    with open(tmp_path / 'results.csv', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['rank'], row['trial']) for row in rows[:3]] == [('1', '0'), ('2', '2'), ('3', '4')]
+
+
+def test_sweep_stops_at_max_epochs(calls, tmp_path):
+    results = successive_halving('kidney', num_trials=9, min_epochs=2, max_epochs=4, eta=3, workers=2,
+                                 output_dir=str(tmp_path))
+
+    assert [(result['rung'], result['epochs']) for result in results[:4]] == [(1, 4), (1, 4), (1, 4), (0, 2)]
+    assert len(calls) == 9 + 3
+
+
+def test_sampled_configs_are_reproducible():
+    configs = sample_configs(5, seed=1)
+
+    assert configs == sample_configs(5, seed=1)
+    assert configs != sample_configs(5, seed=2)
+    for config in configs:
+        assert 1e-4 <= config['learning_rate'] <= 3e-3
+        assert config['first_dense_neurons'] in hyperparameter_sweep.SEARCH_SPACE['first_dense_neurons']
@@ -0,0 +1,99 @@
+import time
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from PIL import Image
+
+from training_utils import InputWaitTimer, build_image_dataset, load_images
+
+CLASS_COLORS = {'cyst': 40, 'normal': 120, 'stone': 200}
+
+
+@pytest.fixture
+def images_dir(tmp_path):
+    for split, count in (('train', 10), ('test', 3)):
+        for class_name, color in CLASS_COLORS.items():
+            (tmp_path / split / class_name).mkdir(parents=True)
+            for i in range(count):
+                Image.new('RGB', (20, 16), (color, i, 0)).save(tmp_path / split / class_name / f'{i}.png')
+    return tmp_path
+
+
+def batches(dataset):
+    images, labels = zip(*((images.numpy(), labels.numpy()) for images, labels in dataset))
+    return np.concatenate(images), np.concatenate(labels)
+
+
+def test_splits_are_disjoint_and_labels_match_images(images_dir):
+    train_data, validation_data, test_data = load_images(str(images_dir), batch_size=4, image_size=(8, 8),
+                                                         shuffle=False)
+
+    assert train_data.class_names == sorted(CLASS_COLORS)
+    assert len(train_data.file_paths) == 24 and len(validation_data.file_paths) == 6
+    assert not set(train_data.file_paths) & set(validation_data.file_paths)
+    assert len(test_data.file_paths) == 9
+    for dataset in (train_data, validation_data, test_data):
+        images, labels = batches(dataset)
+        assert images.shape == (len(dataset.file_paths), 8, 8, 3) and images.dtype == np.float32
+        colors = [CLASS_COLORS[train_data.class_names[label]] for label in labels.argmax(axis=1)]
+        np.testing.assert_allclose(images[:, 0, 0, 0], colors)
+
+
+def test_shuffling_is_deterministic_and_cached_epochs_match(images_dir, tmp_path):
+    def epochs(cache=None):
+        dataset = load_images(str(images_dir), batch_size=4, image_size=(8, 8), seed=7, cache=cache)[0]
+        return [batches(dataset) for _ in range(2)]
+
+    first, second = epochs()
+    assert not np.array_equal(first[0], second[0])
+    for expected, actual in zip((first, second), epochs()):
+        np.testing.assert_array_equal(expected[0], actual[0])
+        np.testing.assert_array_equal(expected[1], actual[1])
+    for cache in ('memory', str(tmp_path / 'cache')):
+        for images, _ in epochs(cache):
+            np.testing.assert_array_equal(np.sort(images, axis=0), np.sort(first[0], axis=0))
+
+
+def test_shards_partition_every_split(images_dir):
+    full = load_images(str(images_dir), batch_size=4, image_size=(8, 8))
+    shards = [load_images(str(images_dir), batch_size=4, image_size=(8, 8), shard=(3, index)) for index in range(3)]
+
+    for split, dataset in enumerate(full):
+        shard_paths = [shard[split].file_paths for shard in shards]
+        assert sorted(sum(shard_paths, [])) == sorted(dataset.file_paths)
+        assert max(map(len, shard_paths)) - min(map(len, shard_paths)) <= 1
+
+
+def test_dataset_of_images_only(images_dir):
+    paths = sorted(str(path) for path in (images_dir / 'test').rglob('*.png'))
+
+    dataset = build_image_dataset(paths, None, 0, image_size=(8, 8), batch_size=5)
+
+    assert [images.shape[0] for images in dataset] == [5, 4]
+    assert dataset.file_paths == paths
+
+
+def test_input_wait_inside_training_steps_is_measured():
+    def slow(images):
+        time.sleep(0.05)
+        return images
+
+    def slow_batch(images, labels):
+        images = tf.numpy_function(slow, [images], tf.float32)
+        images.set_shape((None, 4))
+        return images, labels
+
+    x = np.zeros((12, 4), dtype=np.float32)
+    y = np.eye(2, dtype=np.float32)[np.arange(12) % 2]
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(2, activation='softmax')])
+    model.compile(optimizer='sgd', loss='categorical_crossentropy')
+    timer = InputWaitTimer()
+
+    history = model.fit(timer.watch(tf.data.Dataset.from_tensor_slices((x, y)).batch(4).map(slow_batch)), epochs=2,
+                        callbacks=[timer], verbose=0)
+
+    assert min(history.history['input_wait']) >= 0.15
+    assert min(history.history['input_wait_fraction']) > 0.5
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from PIL import Image
+
+from pack_dataset import pack_dataset
+from training_utils import load_images
+
+
+@pytest.fixture
+def images_dir(tmp_path):
+    for split, count in (('train', 9), ('test', 2)):
+        for color, class_name in enumerate(('cyst', 'normal', 'stone')):
+            (tmp_path / 'images' / split / class_name).mkdir(parents=True)
+            for i in range(count):
+                Image.new('RGB', (20, 16), (80 * color, 10 * i, 0)).save(
+                    tmp_path / 'images' / split / class_name / f'{i}.png')
+    return tmp_path / 'images'
+
+
+def contents(dataset):
+    images, labels = zip(*((images.numpy(), labels.numpy()) for images, labels in dataset))
+    images, labels = np.concatenate(images), np.concatenate(labels)
+    order = np.lexsort(images.reshape(len(images), -1).T)
+    return images[order], labels[order]
+
+
+def test_packed_dataset_round_trips_through_load_images(images_dir, tmp_path):
+    packed_dir = str(tmp_path / 'packed')
+    index = pack_dataset(str(images_dir), packed_dir, image_size=(8, 8), shard_size=4, workers=2)
+
+    assert {split: len(split_index['shards']) for split, split_index in index['splits'].items()} == \
+        {'train': 6, 'valid': 2, 'test': 2}
+    packed = load_images(packed_dir, batch_size=5, image_size=(8, 8))
+    original = load_images(str(images_dir), batch_size=5, image_size=(8, 8), shuffle=False)
+    assert len(packed) == len(original) == 3
+    for packed_data, original_data in zip(packed, original):
+        assert packed_data.class_names == original_data.class_names
+        assert packed_data.num_images == len(original_data.file_paths)
+        for packed_array, original_array in zip(contents(packed_data), contents(original_data)):
+            np.testing.assert_array_equal(packed_array, original_array)
+
+
+def test_shards_of_a_packed_dataset_partition_every_split(images_dir, tmp_path):
+    packed_dir = str(tmp_path / 'packed')
+    pack_dataset(str(images_dir), packed_dir, image_size=(8, 8), shard_size=4)
+    full = [contents(dataset)[0] for dataset in load_images(packed_dir, image_size=(8, 8))]
+
+    # 6 train shard files are dealt to 2 or 3 dataset shards by file, 2 valid and test shard files by record
+    for num_shards in (2, 3):
+        shards = [load_images(packed_dir, image_size=(8, 8), shard=(num_shards, index)) for index in range(num_shards)]
+        for split, full_images in enumerate(full):
+            images = np.concatenate([contents(shard[split])[0] for shard in shards])
+            np.testing.assert_array_equal(images[np.lexsort(images.reshape(len(images), -1).T)], full_images)
+
+
+def test_image_size_has_to_match_the_packed_size(images_dir, tmp_path):
+    packed_dir = str(tmp_path / 'packed')
+    pack_dataset(str(images_dir), packed_dir, image_size=(8, 8))
+
+    with pytest.raises(ValueError, match='packed with image size'):
+        load_images(packed_dir, image_size=(16, 16))
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from training_utils import ResumableCheckpoint
+
+
+def compiled_model():
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(2, activation='softmax')])
+    model.compile(optimizer=tf.keras.optimizers.SGD(learning_rate=0.0), loss='categorical_crossentropy')
+    return model
+
+
+def test_resume_restores_weights_epoch_and_early_stopping_state(tmp_path):
+    x = np.random.default_rng(0).normal(size=(8, 4)).astype(np.float32)
+    y = np.eye(2, dtype=np.float32)[np.arange(8) % 2]
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+
+    model = compiled_model()
+    early_stopping = tf.keras.callbacks.EarlyStopping(monitor='loss', patience=10, restore_best_weights=True)
+    checkpoint = ResumableCheckpoint(checkpoint_dir, early_stopping=early_stopping)
+    model.fit(x, y, batch_size=8, epochs=3, shuffle=False, verbose=0, callbacks=[early_stopping, checkpoint])
+    # With a learning rate of 0 the loss never improves after the first epoch
+    assert (early_stopping.wait, early_stopping.best_epoch) == (2, 0)
+
+    resumed = compiled_model()
+    resumed_early_stopping = tf.keras.callbacks.EarlyStopping(monitor='loss', patience=10,
+                                                              restore_best_weights=True)
+    resumed_checkpoint = ResumableCheckpoint(checkpoint_dir, early_stopping=resumed_early_stopping)
+
+    assert resumed_checkpoint.restore(resumed) == 3
+    for weights, resumed_weights in zip(model.get_weights(), resumed.get_weights()):
+        np.testing.assert_array_equal(weights, resumed_weights)
+
+    resumed_early_stopping.set_model(resumed)
+    resumed_checkpoint.set_model(resumed)
+    resumed_early_stopping.on_train_begin()
+    resumed_checkpoint.on_train_begin()
+    assert resumed_early_stopping.wait == 2
+    assert resumed_early_stopping.best_epoch == 0
+    assert resumed_early_stopping.best == pytest.approx(early_stopping.best)
+    for weights, best_weights in zip(early_stopping.best_weights, resumed_early_stopping.best_weights):
+        np.testing.assert_array_equal(weights, best_weights)
+
+
+def test_restore_without_checkpoint_starts_from_scratch(tmp_path):
+    assert ResumableCheckpoint(str(tmp_path / 'checkpoints')).restore(compiled_model()) == 0
@@ -0,0 +1,87 @@
+import csv
+
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from split_manifest import assign_split, write_manifest
+from training_utils import make_train_and_test_dirs, split_manifest_files
+
+PATHS = [f'class_{i % 4}/image_{i:05d}.png' for i in range(10000)]
+
+
+def read_splits(manifest_path):
+    with open(manifest_path, newline='') as f:
+        return {row['path']: row['split'] for row in csv.DictReader(f)}
+
+
+def make_images(directory, names):
+    for name in names:
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(name.encode())
+
+
+def test_assignment_is_deterministic():
+    assert [assign_split(path) for path in PATHS] == [assign_split(path) for path in PATHS]
+
+
+def test_split_fractions():
+    splits = [assign_split(path, test_split=0.2, validation_split=0.1) for path in PATHS]
+
+    assert splits.count('test') / len(PATHS) == pytest.approx(0.2, abs=0.02)
+    assert splits.count('valid') / len(PATHS) == pytest.approx(0.1, abs=0.02)
+
+
+def test_larger_test_split_only_moves_files_to_test():
+    for path in PATHS:
+        if assign_split(path, test_split=0.1) == 'test':
+            assert assign_split(path, test_split=0.2) == 'test'
+
+
+def test_adding_files_keeps_existing_assignments(tmp_path):
+    images_dir = tmp_path / 'images'
+    make_images(images_dir, PATHS[:200])
+    write_manifest(str(images_dir), hash_contents=False, workers=2)
+    before = read_splits(images_dir / 'manifest.csv')
+
+    make_images(images_dir, PATHS[200:400])
+    write_manifest(str(images_dir), hash_contents=False, workers=2)
+    after = read_splits(images_dir / 'manifest.csv')
+
+    assert len(after) == 400
+    assert {path: after[path] for path in before} == before
+
+
+def test_validation_is_hashed_off_training_files_of_a_manifest_without_valid_split(tmp_path):
+    images_dir = tmp_path / 'images'
+    make_images(images_dir, PATHS[:400])
+    write_manifest(str(images_dir), validation_split=0.0, hash_contents=False, workers=2)
+
+    splits, class_names = split_manifest_files(str(images_dir / 'manifest.csv'), validation_split=0.25)
+    make_images(images_dir, PATHS[400:800])
+    write_manifest(str(images_dir), validation_split=0.0, hash_contents=False, workers=2)
+    more_splits, _ = split_manifest_files(str(images_dir / 'manifest.csv'), validation_split=0.25)
+
+    assert class_names == ['class_0', 'class_1', 'class_2', 'class_3']
+    assert not set(splits['train'][0]) & set(splits['valid'][0])
+    assert set(splits['valid'][0]) <= set(more_splits['valid'][0])
+    assert set(splits['train'][0]) <= set(more_splits['train'][0])
+
+
+@pytest.mark.parametrize('scan_ahead', [1, 3, None])
+def test_manifest_does_not_depend_on_scan_concurrency(tmp_path, scan_ahead):
+    images_dir = tmp_path / 'images'
+    make_images(images_dir, PATHS[:200])
+    write_manifest(str(images_dir), str(tmp_path / 'reference.csv'), workers=1, scan_ahead=1)
+
+    write_manifest(str(images_dir), str(tmp_path / 'manifest.csv'), workers=4, scan_ahead=scan_ahead)
+
+    assert (tmp_path / 'manifest.csv').read_text() == (tmp_path / 'reference.csv').read_text()
+
+
+def test_copy_based_split_is_deprecated(tmp_path):
+    make_images(tmp_path, PATHS[:8])
+
+    with pytest.deprecated_call():
+        make_train_and_test_dirs(str(tmp_path))
@@ -0,0 +1,77 @@
+import csv
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from training_utils import TrainingMonitor
+
+
+def compiled_model():
+    model = tf.keras.Sequential([tf.keras.Input((4,)), tf.keras.layers.Dense(2, activation='softmax')])
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=0.01), loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    return model
+
+
+def dataset(delay=0.0):
+    x = np.random.default_rng(0).normal(size=(12, 4)).astype(np.float32)
+    y = np.eye(2, dtype=np.float32)[np.arange(12) % 2]
+
+    def slow(images):
+        time.sleep(delay)
+        return images
+
+    def slow_batch(images, labels):
+        images = tf.numpy_function(slow, [images], tf.float32)
+        images.set_shape((None, 4))
+        return images, labels
+
+    data = tf.data.Dataset.from_tensor_slices((x, y)).batch(4)
+    if delay:
+        data = data.map(slow_batch)
+    return data
+
+
+def test_report_of_a_run_is_written(tmp_path):
+    monitor = TrainingMonitor(str(tmp_path / 'report'), batch_size=4)
+
+    history = compiled_model().fit(monitor.watch(dataset()), validation_data=dataset(), epochs=2, callbacks=[monitor],
+                                   verbose=0)
+
+    with open(tmp_path / 'report' / 'steps.csv', newline='') as f:
+        steps = list(csv.DictReader(f))
+    assert [(int(step['epoch']), int(step['step'])) for step in steps] == [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1),
+                                                                          (1, 2)]
+    assert all(float(step['learning_rate']) == pytest.approx(0.01) for step in steps)
+
+    with open(tmp_path / 'report' / 'epochs.csv', newline='') as f:
+        epochs = list(csv.DictReader(f))
+    assert [int(epoch['epoch']) for epoch in epochs] == [0, 1]
+    assert {'loss', 'val_loss', 'val_accuracy', 'images_per_second', 'input_wait_fraction', 'peak_rss_mb'} \
+        <= set(epochs[0])
+    assert len(history.history['images_per_second']) == 2
+
+    with open(tmp_path / 'report' / 'run.json') as f:
+        run = json.load(f)
+    assert run['summary']['epochs'] == 2 and run['summary']['steps'] == 6
+    assert run['summary']['peak_rss_mb'] > 0
+    assert [epoch['loss'] for epoch in run['epochs']] == pytest.approx(history.history['loss'])
+    assert os.path.exists(tmp_path / 'report' / 'throughput.png')
+    assert os.path.exists(tmp_path / 'report' / 'history.png')
+
+
+def test_slow_input_pipeline_is_reported_as_the_bottleneck(tmp_path):
+    monitor = TrainingMonitor(str(tmp_path / 'report'), batch_size=4)
+
+    compiled_model().fit(monitor.watch(dataset(delay=0.05)), epochs=2, callbacks=[monitor], verbose=0)
+
+    summary = monitor.summary()
+    assert all(step['input_wait'] >= 0.04 for step in monitor.steps)
+    assert summary['input_wait_fraction'] > 0.5
+    assert summary['bottleneck'] == 'input'
+    assert not os.path.exists(tmp_path / 'report' / 'history.png')
@@ -1,12 +1,224 @@
 import base64
+import csv
+import hashlib
 import io
+import json
 import os
 import shutil
 import random
+import resource
+import time
+import warnings
 import numpy as np
 from PIL import Image
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback
 from tensorflow.keras.preprocessing import image_dataset_from_directory
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+
+IMAGE_EXTENSIONS = ('.bmp', '.gif', '.jpeg', '.jpg', '.png')
+PACKED_INDEX = 'packed_index.json'
+# Must match REDUCING_GAP and resize_for_model of prediction/prediction.py
+REDUCING_GAP = 3.0
+
+
+def list_image_files(directory, labels='inferred', class_names=None):
+    """Function that lists image files of a directory in a deterministic order.
+
+    Parameters
+    ----------
+    directory: str
+        Path to directory containing images, in class subdirectories when labels are inferred.
+    labels: str
+        Labels mode: 'inferred', None or list of labels corresponding to the image files sorted alphanumerically,
+        same as in load_images.
+    class_names: list of str
+        Names of the classes, defaults to sorted names of the subdirectories.
+
+    Returns
+    -------
+    paths: list of str
+        Paths to image files.
+    label_indices: list of int or None
+        Label of every file, None if labels is None.
+    class_names: list of str
+        Names of the classes.
+    """
+    if labels != 'inferred':
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(directory) for name in names
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+        if labels is None:
+            return paths, None, class_names or []
+        return paths, list(labels), class_names or [str(label) for label in sorted(set(labels))]
+
+    if class_names is None:
+        class_names = sorted(entry.name for entry in os.scandir(directory) if entry.is_dir())
+    paths, label_indices = [], []
+    for index, class_name in enumerate(class_names):
+        class_dir = os.path.join(directory, class_name)
+        class_paths = sorted(os.path.join(root, name) for root, _, names in os.walk(class_dir) for name in names
+                             if name.lower().endswith(IMAGE_EXTENSIONS))
+        paths.extend(class_paths)
+        label_indices.extend([index] * len(class_paths))
+    return paths, label_indices, class_names
+
+
+def resize_for_model(image, size=(150, 150)):
+    """Function that shrinks an image exactly like prediction.resize_for_model does when serving.
+
+    JPEG images are decoded at the smallest DCT scale that is still REDUCING_GAP times larger than the target
+    size, and the image is reduced by an integer factor before the final bicubic resize.
+
+    Parameters
+    ----------
+    image: PIL.Image
+        Image to resize, not loaded yet for draft mode to take effect.
+    size: tuple of int
+        Target image size, as width and height.
+
+    Returns
+    -------
+    image: PIL.Image
+        Resized image, in mode 'L' or 'RGB'.
+    """
+    if image.format == 'JPEG':
+        image.draft(image.mode, (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP)))
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    return image.resize(size, Image.BICUBIC, reducing_gap=REDUCING_GAP)
+
+
+def _serving_decode(path, height, width):
+    with Image.open(np.asarray(path).item().decode()) as image:
+        return np.asarray(resize_for_model(image, (int(width), int(height))).convert('RGB'))
+
+
+def decode_and_resize(path, image_size, resize='bilinear'):
+    """Function that reads and decodes an image file and resizes it to a uint8 tensor.
+
+    Parameters
+    ----------
+    path: tf.Tensor
+        Path to the image file.
+    image_size: tuple of int
+        Target image size.
+    resize: str
+        'bilinear' resizes with tf.image.resize, 'serving' decodes and resizes with PIL like the prediction server,
+        see resize_for_model.
+
+    Returns
+    -------
+    image: tf.Tensor
+        Image of shape (*image_size, 3) and dtype uint8.
+    """
+    if resize == 'serving':
+        image = tf.numpy_function(_serving_decode, [path, image_size[0], image_size[1]], tf.uint8)
+        image.set_shape((*image_size, 3))
+        return image
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, image_size, method='bilinear')
+    return tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8)
+
+
+def encode_labels(label_indices, num_classes, label_mode):
+    """Function that encodes integer labels in the given labels mode.
+
+    Parameters
+    ----------
+    label_indices: tf.Tensor
+        Integer labels, a single one or a vector of them.
+    num_classes: int
+        The number of possible classes.
+    label_mode: str
+        Labels mode: 'categorical', 'binary', 'sparse' or 'int'.
+
+    Returns
+    -------
+    labels: tf.Tensor
+        One-hot float32 labels for 'categorical', float32 labels with a trailing axis of size 1 for 'binary',
+        int32 labels otherwise.
+    """
+    if label_mode == 'categorical':
+        return tf.one_hot(label_indices, num_classes)
+    if label_mode == 'binary':
+        return tf.expand_dims(tf.cast(label_indices, tf.float32), -1)
+    return tf.cast(label_indices, tf.int32)
+
+
+def build_image_dataset(paths, label_indices, num_classes, image_size=(150, 150), batch_size=32,
+                        label_mode='categorical', shuffle=False, seed=123, cache=None, shuffle_buffer=2048,
+                        resize='bilinear'):
+    """Function that builds an input pipeline decoding images in parallel.
+
+    Images are decoded and resized in parallel into uint8 tensors, optionally cached in memory or on disk so that
+    later epochs skip decoding, shuffled deterministically for a given seed, batched, cast to float32 and prefetched.
+
+    Parameters
+    ----------
+    paths: list of str
+        Paths to image files.
+    label_indices: list of int or None
+        Label of every file, None for a dataset of images only.
+    num_classes: int
+        The number of possible classes.
+    image_size: tuple of int
+        Returned dataset's image size.
+    batch_size: int
+        Returned dataset's batch size.
+    label_mode: str
+        Labels mode: 'categorical', 'binary', 'sparse' or 'int'.
+    shuffle: bool
+        Whether to reshuffle the dataset in every epoch.
+    seed: int
+        Seed of the shuffling.
+    cache: str
+        None disables caching, 'memory' caches resized images in memory, any other value is used as path prefix of
+        an on-disk cache.
+    shuffle_buffer: int
+        Size of the shuffle buffer of cached datasets, uncached datasets shuffle file paths before decoding instead.
+    resize: str
+        Resize method, 'bilinear' or 'serving', see decode_and_resize.
+
+    Returns
+    -------
+    dataset: tf.data.Dataset
+        Batched dataset of (image, label) pairs or of images, exposing file_paths.
+    """
+    options = tf.data.Options()
+    options.deterministic = True
+
+    dataset = tf.data.Dataset.from_tensor_slices(paths)
+    if label_indices is not None:
+        labels = encode_labels(tf.constant(label_indices, dtype=tf.int64), num_classes, label_mode)
+        dataset = tf.data.Dataset.zip((dataset, tf.data.Dataset.from_tensor_slices(labels)))
+
+    if shuffle and not cache:
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+
+    if label_indices is not None:
+        dataset = dataset.map(lambda path, label: (decode_and_resize(path, image_size, resize), label),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+    else:
+        dataset = dataset.map(lambda path: decode_and_resize(path, image_size, resize),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+
+    if cache == 'memory':
+        dataset = dataset.cache()
+    elif cache:
+        dataset = dataset.cache(cache)
+    if shuffle and cache:
+        dataset = dataset.shuffle(min(len(paths), shuffle_buffer), seed=seed, reshuffle_each_iteration=True)
+
+    dataset = dataset.batch(batch_size)
+    if label_indices is not None:
+        dataset = dataset.map(lambda images, labels: (tf.cast(images, tf.float32), labels),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+    else:
+        dataset = dataset.map(lambda images: tf.cast(images, tf.float32), num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.prefetch(tf.data.AUTOTUNE).with_options(options)
+    dataset.file_paths = paths
+    return dataset
 
 
 def load_images(images_dir,
@@ -14,14 +226,21 @@ def load_images(images_dir,
                 image_size=(150, 150),
                 validation_split=0.2,
                 labels='inferred',
-                label_mode='categorical'):
+                label_mode='categorical',
+                cache=None,
+                seed=123,
+                optimized=True,
+                shard=None,
+                shuffle=True,
+                resize='bilinear'):
     """Function that loads images from a directory and returns train, validation and test tf datasets,
     if test directory exists, otherwise returns only train and validation tf datasets.
 
     Parameters
     ----------
     images_dir: str
-        Path to directory containing images.
+        Path to directory containing images, to a directory written by pack_dataset.py, which is read with
+        load_packed_images, or to a CSV manifest written by split_manifest.py, whose files are read in place.
     batch_size: int
         Returned datasets' batch sizes.
     image_size: tuple of int
@@ -33,6 +252,22 @@ def load_images(images_dir,
         refer to Keras documentation for more details.
     label_mode: str
         Labels mode: 'categorical', 'binary', 'sparse', 'int', refer to Keras documentation for more details.
+    cache: str
+        None disables caching, 'memory' caches resized uint8 images in memory, any other value is used as path
+        prefix of on-disk caches, one per split.
+    seed: int
+        Seed of the validation split and of the shuffling of training data.
+    optimized: bool
+        Whether to use the parallel, prefetching pipeline of build_image_dataset, False returns plain
+        image_dataset_from_directory datasets, e.g. to compare input wait times with InputWaitTimer.
+    shard: tuple of int
+        Number of shards and index of the shard to load, e.g. (num_workers, worker_index) for multi-worker
+        training, None loads the whole dataset. Files are assigned to shards before decoding.
+    shuffle: bool
+        Whether to shuffle training data, False keeps the order of dataset.file_paths, e.g. for evaluation.
+    resize: str
+        Resize method, 'bilinear' or 'serving', see decode_and_resize. Packed datasets keep the images resized when
+        they were packed.
 
     Returns
     -------
@@ -43,7 +278,236 @@ def load_images(images_dir,
     test_data: tf.data.Dataset or None
         Test dataset, if test directory exists, otherwise None.
     """
+    if not optimized:
+        return _load_images_from_directory(images_dir, batch_size, image_size, validation_split, labels, label_mode)
+
+    if os.path.isfile(os.path.join(images_dir, PACKED_INDEX)):
+        return load_packed_images(images_dir, batch_size=batch_size, image_size=image_size, label_mode=label_mode,
+                                  seed=seed, shard=shard, shuffle=shuffle)
+
+    splits, class_names = split_image_files(images_dir, validation_split, labels, seed)
+
+    datasets = []
+    for split, (paths, label_indices) in splits.items():
+        if shard is not None:
+            num_shards, index = shard
+            paths = paths[index::num_shards]
+            label_indices = label_indices[index::num_shards] if label_indices is not None else None
+        split_cache = cache if cache in (None, 'memory') else f'{cache}_{split}'
+        dataset = build_image_dataset(paths, label_indices, len(class_names), image_size=image_size,
+                                      batch_size=batch_size, label_mode=label_mode,
+                                      shuffle=shuffle and split == 'train', seed=seed, cache=split_cache,
+                                      resize=resize)
+        dataset.class_names = class_names
+        datasets.append(dataset)
+    return tuple(datasets)
+
+
+def split_image_files(images_dir, validation_split=0.2, labels='inferred', seed=123):
+    """Function that lists image files of the train, validation and test splits of a dataset directory.
+
+    The directory either contains train and test subdirectories, and optionally a valid subdirectory, or
+    is itself the training directory. Without a valid directory, validation files are split off the training files,
+    after shuffling them with the given seed. A path to a manifest written by split_manifest.py is read with
+    split_manifest_files instead.
+
+    Parameters
+    ----------
+    images_dir: str
+        Path to directory containing images, or to a CSV manifest.
+    validation_split: float
+        Fraction of training images reserved for validation when there is no valid directory.
+    labels: str
+        Labels mode: 'inferred', None or list of labels, see list_image_files.
+    seed: int
+        Seed of the validation split.
+
+    Returns
+    -------
+    splits: dict
+        Mapping from split name ('train', 'valid' and, if test directory exists, 'test') to a tuple of file paths and
+        their labels.
+    class_names: list of str
+        Names of the classes.
+    """
+    if os.path.isfile(images_dir):
+        return split_manifest_files(images_dir, validation_split, seed)
+
+    is_test_dir = os.path.isdir(f'{images_dir}/test')
+    is_val_dir = os.path.isdir(f'{images_dir}/valid')
+    train_dir = f'{images_dir}/train' if is_test_dir else images_dir
+
+    train_paths, train_labels, class_names = list_image_files(train_dir, labels)
+    splits = {}
+
+    if is_val_dir:
+        splits['train'] = (train_paths, train_labels)
+        splits['valid'] = list_image_files(f'{images_dir}/valid', labels, class_names)[:2]
+    else:
+        order = np.random.RandomState(seed).permutation(len(train_paths))
+        train_paths = [train_paths[i] for i in order]
+        train_labels = [train_labels[i] for i in order] if train_labels is not None else None
+        split = len(train_paths) - int(validation_split * len(train_paths))
+        splits['train'] = (train_paths[:split], train_labels[:split] if train_labels is not None else None)
+        splits['valid'] = (train_paths[split:], train_labels[split:] if train_labels is not None else None)
+
+    if is_test_dir:
+        splits['test'] = list_image_files(f'{images_dir}/test', labels, class_names)[:2]
+    return splits, class_names
+
+
+def path_bucket(relative_path, salt='') -> float:
+    """Function that deterministically maps a file path to a number in [0, 1) by hashing it.
+
+    Parameters
+    ----------
+    relative_path: str
+        Path of the file relative to the dataset directory or manifest.
+    salt: str
+        Prefix hashed with the path, different salts give independent numbers.
+
+    Returns
+    -------
+    bucket: float
+        Number uniformly distributed over [0, 1) across paths.
+    """
+    digest = hashlib.sha256(f'{salt}{relative_path}'.encode()).hexdigest()
+    return int(digest[:8], 16) / 0x100000000
+
+
+def split_manifest_files(manifest_path, validation_split=0.2, seed=123):
+    """Function that lists image files of the train, validation and test splits of a manifest.
+
+    When the manifest has no valid split, training files are assigned to validation by hashing their paths, like
+    split_manifest.assign_split does, so that adding or removing other files never moves a file between training
+    and validation.
+
+    Parameters
+    ----------
+    manifest_path: str
+        Path of a CSV manifest written by split_manifest.py, with path, class and split columns. Paths are relative
+        to the manifest's directory.
+    validation_split: float
+        Fraction of training images reserved for validation when the manifest has no valid split.
+    seed: int
+        Salt of the hash assigning training images to validation.
+
+    Returns
+    -------
+    splits: dict
+        Mapping from split name ('train', 'valid' and, if the manifest has one, 'test') to a tuple of file paths and
+        their labels.
+    class_names: list of str
+        Names of the classes.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    rows = {}
+    with open(manifest_path, newline='') as f:
+        has_valid_split = any(row['split'] == 'valid' for row in csv.DictReader(f))
+        f.seek(0)
+        for row in csv.DictReader(f):
+            split = row['split']
+            if split == 'train' and not has_valid_split \
+                    and path_bucket(row['path'], f'valid-{seed}') < validation_split:
+                split = 'valid'
+            paths, classes = rows.setdefault(split, ([], []))
+            paths.append(os.path.join(manifest_dir, row['path']))
+            classes.append(row['class'])
+
+    class_names = sorted({class_name for _, classes in rows.values() for class_name in classes})
+    class_indices = {class_name: index for index, class_name in enumerate(class_names)}
+    splits = {split: (paths, [class_indices[class_name] for class_name in classes])
+              for split, (paths, classes) in rows.items()}
+    splits.setdefault('train', ([], []))
+    splits.setdefault('valid', ([], []))
+    return {split: splits[split] for split in ('train', 'valid', 'test') if split in splits}, class_names
+
+
+def load_packed_images(packed_dir, batch_size=32, image_size=(150, 150), label_mode='categorical', seed=123,
+                       shuffle_buffer=2048, shard=None, shuffle=True):
+    """Function that loads a dataset packed by pack_dataset.py and returns its train, validation and test tf datasets.
+
+    Shards of every split are read in parallel and sequentially, no directory has to be listed and no image has to
+    be decoded.
+
+    Parameters
+    ----------
+    packed_dir: str
+        Directory written by pack_dataset.py.
+    batch_size: int
+        Returned datasets' batch sizes.
+    image_size: tuple of int
+        Returned datasets' image sizes, has to match the size the dataset was packed with.
+    label_mode: str
+        Labels mode: 'categorical', 'binary', 'sparse' or 'int'.
+    seed: int
+        Seed of the shuffling of training data.
+    shuffle_buffer: int
+        Size of the shuffle buffer of training data.
+    shard: tuple of int
+        Number of shards and index of the shard to load, None loads the whole dataset. Whole shard files are
+        assigned to dataset shards when there are enough of them, records otherwise.
+    shuffle: bool
+        Whether to shuffle training data, False reads the records in the order they were packed.
+
+    Returns
+    -------
+    train_data: tf.data.Dataset
+        Train dataset.
+    validation_data: tf.data.Dataset
+        Validation dataset.
+    test_data: tf.data.Dataset
+        Test dataset, returned only if the dataset was packed with a test split.
+    """
+    with open(os.path.join(packed_dir, PACKED_INDEX)) as f:
+        index = json.load(f)
+    if tuple(index['image_size']) != tuple(image_size):
+        raise ValueError(f"{packed_dir} was packed with image size {tuple(index['image_size'])}, "
+                         f"{tuple(image_size)} requested")
+
+    height, width = index['image_size']
+    class_names = index['class_names']
+    features = {'image': tf.io.FixedLenFeature([], tf.string), 'label': tf.io.FixedLenFeature([], tf.int64)}
+
+    def parse(record):
+        example = tf.io.parse_single_example(record, features)
+        image = tf.reshape(tf.io.decode_raw(example['image'], tf.uint8), (height, width, 3))
+        return image, encode_labels(example['label'], len(class_names), label_mode)
 
+    options = tf.data.Options()
+    options.deterministic = True
+
+    datasets = []
+    for split in ('train', 'valid', 'test'):
+        if split not in index['splits']:
+            continue
+        shards = [os.path.join(packed_dir, name) for name in index['splits'][split]['shards']]
+        num_images = index['splits'][split]['count']
+        shard_records = shard is not None and len(shards) < shard[0]
+        if shard is not None and not shard_records:
+            shards = shards[shard[1]::shard[0]]
+        dataset = tf.data.Dataset.from_tensor_slices(shards)
+        if shuffle and split == 'train':
+            dataset = dataset.shuffle(len(shards), seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.interleave(tf.data.TFRecordDataset, cycle_length=min(len(shards), 8),
+                                     num_parallel_calls=tf.data.AUTOTUNE)
+        if shard_records:
+            dataset = dataset.shard(*shard)
+        dataset = dataset.map(parse, num_parallel_calls=tf.data.AUTOTUNE)
+        if shuffle and split == 'train':
+            dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.map(lambda images, labels: (tf.cast(images, tf.float32), labels),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+        dataset = dataset.prefetch(tf.data.AUTOTUNE).with_options(options)
+        dataset.class_names = class_names
+        dataset.fingerprint = index['splits'][split]['fingerprint']
+        dataset.num_images = num_images if shard is None else None
+        datasets.append(dataset)
+    return tuple(datasets)
+
+
+def _load_images_from_directory(images_dir, batch_size, image_size, validation_split, labels, label_mode):
     is_test_dir = os.path.isdir(f'{images_dir}/test')
     is_val_dir = os.path.isdir(f'{images_dir}/valid')
 
@@ -88,43 +552,390 @@ def load_images(images_dir,
     return (train_data, validation_data, test_data) if is_test_dir else (train_data, validation_data)
 
 
-def plot_history(history):
-    """Function that plots model's training and validation accuracy and loss.
+def stamp_input(dataset, input_ready):
+    """Function that makes a dataset record when each of its elements leaves the input pipeline.
+
+    Keras fetches the next batch inside the training step, so callbacks alone cannot tell waiting for data from
+    computing. The returned dataset writes the time every element becomes available, as returned by tf.timestamp,
+    to input_ready, which lets callbacks measure how long a step waited for its batch.
+
+    Parameters
+    ----------
+    dataset: tf.data.Dataset
+        Dataset the model is trained on.
+    input_ready: tf.Variable
+        Scalar float64 variable the times are written to.
+
+    Returns
+    -------
+    dataset: tf.data.Dataset
+        Dataset of the same elements.
+    """
+    def stamp(*element):
+        with tf.control_dependencies([input_ready.assign(tf.timestamp())]):
+            return tf.nest.map_structure(tf.identity, element if len(element) > 1 else element[0])
+
+    return dataset.map(stamp)
+
+
+class InputWaitTimer(Callback):
+    """Keras callback measuring how long training steps wait for the input pipeline.
+
+    Batches of a dataset passed through watch are timed when they leave the input pipeline, inside the training
+    step, any other time between the end of a training step and the beginning of the next one is counted as well.
+    After every epoch, the total input wait time ('input_wait') and its fraction of the epoch's time
+    ('input_wait_fraction') are added to the epoch logs, and therefore to the training history.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.epoch_start = None
+        self.last_step_end = None
+        self.step_begin = None
+        self.input_wait = 0.0
+        self.input_ready = tf.Variable(0.0, dtype=tf.float64, trainable=False)
+
+    def watch(self, dataset):
+        """Method that makes a dataset report when its batches are ready, see stamp_input.
+
+        Parameters
+        ----------
+        dataset: tf.data.Dataset
+            Training dataset.
+
+        Returns
+        -------
+        dataset: tf.data.Dataset
+            Training dataset to pass to fit.
+        """
+        return stamp_input(dataset, self.input_ready)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+        self.last_step_end = self.epoch_start
+        self.input_wait = 0.0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.input_wait += time.perf_counter() - self.last_step_end
+        self.step_begin = time.time()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.input_wait += max(0.0, float(self.input_ready.numpy()) - self.step_begin)
+        self.last_step_end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is None:
+            return
+        epoch_time = self.last_step_end - self.epoch_start
+        logs['input_wait'] = self.input_wait
+        logs['input_wait_fraction'] = self.input_wait / epoch_time if epoch_time else 0.0
+
+
+class TrainingMonitor(Callback):
+    """Keras callback recording where the time of a training run goes, and writing a report of the run.
+
+    For every training step, its duration, the time it spent waiting for the input pipeline and the learning rate
+    are recorded. Waiting inside the step is only seen for datasets passed through watch, see stamp_input. For every epoch, images per second, input wait fraction, mean step time, peak resident
+    memory of the process and learning rate are added to the epoch logs, and therefore to the training history.
+    After every epoch, steps.csv, epochs.csv and run.json are written to output_dir, at the end of training also
+    throughput.png and history.png. A large input wait fraction means that data loading, not compute, limits
+    training speed.
+
+    Parameters
+    ----------
+    output_dir: str
+        Directory the report is written to.
+    batch_size: int
+        Number of images of a training step.
+    """
+
+    STEP_FIELDS = ['epoch', 'step', 'step_time', 'input_wait', 'images_per_second', 'learning_rate']
+
+    def __init__(self, output_dir, batch_size=32):
+        super().__init__()
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.steps = []
+        self.epochs = []
+        self.train_start = None
+        self.epoch = 0
+        self.epoch_start = None
+        self.step_start = None
+        self.step_begin = None
+        self.last_step_end = None
+        self.input_ready = tf.Variable(0.0, dtype=tf.float64, trainable=False)
+
+    def watch(self, dataset):
+        """Method that makes a dataset report when its batches are ready, see stamp_input.
+
+        Parameters
+        ----------
+        dataset: tf.data.Dataset
+            Training dataset.
+
+        Returns
+        -------
+        dataset: tf.data.Dataset
+            Training dataset to pass to fit.
+        """
+        return stamp_input(dataset, self.input_ready)
+
+    def on_train_begin(self, logs=None):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.train_start = time.perf_counter()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self.epoch_start = time.perf_counter()
+        self.last_step_end = self.epoch_start
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.step_start = time.perf_counter()
+        self.step_begin = time.time()
+
+    def on_train_batch_end(self, batch, logs=None):
+        end = time.perf_counter()
+        step_time = end - self.step_start
+        input_wait = self.step_start - self.last_step_end + max(0.0, float(self.input_ready.numpy()) - self.step_begin)
+        self.steps.append({'epoch': self.epoch, 'step': batch, 'step_time': step_time, 'input_wait': input_wait,
+                           'images_per_second': self.batch_size / step_time if step_time else 0.0,
+                           'learning_rate': self._learning_rate()})
+        self.last_step_end = end
+
+    def on_epoch_end(self, epoch, logs=None):
+        steps = [step for step in self.steps if step['epoch'] == epoch]
+        epoch_time = self.last_step_end - self.epoch_start
+        input_wait = sum(step['input_wait'] for step in steps)
+        metrics = {
+            'epoch_time': epoch_time,
+            'images_per_second': len(steps) * self.batch_size / epoch_time if epoch_time else 0.0,
+            'mean_step_time': float(np.mean([step['step_time'] for step in steps])) if steps else 0.0,
+            'input_wait': input_wait,
+            'input_wait_fraction': input_wait / epoch_time if epoch_time else 0.0,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'learning_rate': self._learning_rate(),
+        }
+        if logs is not None:
+            logs.update(metrics)
+        self.epochs.append({'epoch': epoch, **{key: float(value) for key, value in (logs or metrics).items()}})
+        self._write_report()
+
+    def on_train_end(self, logs=None):
+        self._write_report()
+        if not self.epochs:
+            return
+        self._plot_throughput(os.path.join(self.output_dir, 'throughput.png'))
+        if 'val_loss' in self.epochs[0] and 'val_accuracy' in self.epochs[0]:
+            history = {key: [epoch[key] for epoch in self.epochs] for key in self.epochs[0]}
+            plot_history(history, os.path.join(self.output_dir, 'history.png'))
+
+    def summary(self) -> dict:
+        """Method that summarizes the run so far.
+
+        Returns
+        -------
+        summary: dict
+            Number of epochs and steps, total time, mean images per second, input wait fraction, peak resident
+            memory and the likely bottleneck: 'input' when more than a fifth of the time is spent waiting for data,
+            'compute' otherwise.
+        """
+        total_time = sum(epoch['epoch_time'] for epoch in self.epochs)
+        input_wait = sum(epoch['input_wait'] for epoch in self.epochs)
+        input_wait_fraction = input_wait / total_time if total_time else 0.0
+        return {
+            'epochs': len(self.epochs),
+            'steps': len(self.steps),
+            'train_time': total_time,
+            'images_per_second': len(self.steps) * self.batch_size / total_time if total_time else 0.0,
+            'input_wait_fraction': input_wait_fraction,
+            'peak_rss_mb': max((epoch['peak_rss_mb'] for epoch in self.epochs), default=0.0),
+            'bottleneck': 'input' if input_wait_fraction > 0.2 else 'compute',
+        }
+
+    def _learning_rate(self):
+        optimizer = getattr(self.model, 'optimizer', None)
+        if optimizer is None:
+            return float('nan')
+        learning_rate = optimizer.learning_rate
+        if callable(learning_rate):
+            learning_rate = learning_rate(optimizer.iterations)
+        return float(tf.keras.backend.get_value(learning_rate))
+
+    def _write_report(self):
+        with open(os.path.join(self.output_dir, 'steps.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.STEP_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.steps)
+        if self.epochs:
+            with open(os.path.join(self.output_dir, 'epochs.csv'), 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(self.epochs[-1]), extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(self.epochs)
+        with open(os.path.join(self.output_dir, 'run.json'), 'w') as f:
+            json.dump({'summary': self.summary(), 'epochs': self.epochs}, f, indent=2)
+
+    def _plot_throughput(self, path):
+        figure = Figure(figsize=(12, 8))
+        step_index = np.arange(len(self.steps))
+        panels = [
+            ('Step time', 'Seconds', step_index, [('step_time', self.steps), ('input_wait', self.steps)], 'Step'),
+            ('Throughput', 'Images per second', None, [('images_per_second', self.epochs)], 'Epoch'),
+            ('Learning rate', 'Learning rate', None, [('learning_rate', self.epochs)], 'Epoch'),
+            ('Peak memory', 'RSS (MB)', None, [('peak_rss_mb', self.epochs)], 'Epoch'),
+        ]
+        for position, (title, ylabel, x, series, xlabel) in enumerate(panels, start=1):
+            axes = figure.add_subplot(2, 2, position)
+            for key, rows in series:
+                axes.plot(x if x is not None else [row['epoch'] for row in rows], [row[key] for row in rows],
+                          label=key)
+            axes.set_title(title)
+            axes.set_ylabel(ylabel)
+            axes.set_xlabel(xlabel)
+            if len(series) > 1:
+                axes.legend(loc='upper right')
+        figure.tight_layout()
+        figure.savefig(path)
+
+
+class ResumableCheckpoint(Callback):
+    """Keras callback periodically checkpointing a training run so that it can resume after a crash.
+
+    Every save_freq epochs, model weights, optimizer state (including its learning rate and iteration count) and
+    the number of finished epochs are written with tf.train.CheckpointManager. State of the early stopping callback,
+    if given, is saved as well, so that its patience carries over a restart. Call restore before fit and pass the
+    returned epoch as fit's initial_epoch, epoch-based learning rate schedules then continue where they stopped.
+
+    Parameters
+    ----------
+    checkpoint_dir: str
+        Directory the checkpoints are written to.
+    save_freq: int
+        Number of epochs between checkpoints.
+    max_to_keep: int
+        Number of most recent checkpoints kept on disk.
+    early_stopping: keras.callbacks.EarlyStopping
+        Early stopping callback of the run, must precede this callback in fit's callbacks.
+    """
+
+    def __init__(self, checkpoint_dir, save_freq=1, max_to_keep=3, early_stopping=None):
+        super().__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.save_freq = save_freq
+        self.max_to_keep = max_to_keep
+        self.early_stopping = early_stopping
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.manager = None
+        self.restore_dir = checkpoint_dir
+        self.restored_state = None
+
+    def restore(self, model, epoch=None, checkpoint_dir=None) -> int:
+        """Method that restores a checkpoint of a run into a compiled model, by default the latest one, if there is one.
+
+        Parameters
+        ----------
+        model: keras.Model
+            Compiled model of the run.
+        epoch: int
+            Restore the checkpoint written after this epoch instead of the latest one, 0 restores nothing.
+        checkpoint_dir: str
+            Directory the checkpoint is restored from, defaults to the directory checkpoints are written to.
+
+        Returns
+        -------
+        initial_epoch: int
+            Number of epochs already finished, to be passed to fit as initial_epoch.
+        """
+        checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, epoch=self.epoch)
+        self.manager = tf.train.CheckpointManager(checkpoint, self.checkpoint_dir, max_to_keep=self.max_to_keep)
+        self.restore_dir = checkpoint_dir or self.checkpoint_dir
+        if epoch is None:
+            checkpoint_path = tf.train.latest_checkpoint(self.restore_dir)
+        else:
+            checkpoint_path = os.path.join(self.restore_dir, f'ckpt-{epoch}') if epoch else None
+        if checkpoint_path is None:
+            return 0
+
+        checkpoint.restore(checkpoint_path).expect_partial()
+        state_path = os.path.join(self.restore_dir, 'state.json')
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.restored_state = json.load(f)
+        print(f'Resuming from {checkpoint_path} after epoch {int(self.epoch.numpy())}')
+        return int(self.epoch.numpy())
+
+    def on_train_begin(self, logs=None):
+        if self.manager is None:
+            self.restore(self.model)
+        if self.early_stopping is not None and self.restored_state is not None:
+            self.early_stopping.wait = self.restored_state['wait']
+            self.early_stopping.best = self.restored_state['best']
+            self.early_stopping.best_epoch = self.restored_state['best_epoch']
+            best_weights_path = os.path.join(self.restore_dir, 'best_weights.npz')
+            if os.path.exists(best_weights_path):
+                with np.load(best_weights_path) as best_weights:
+                    self.early_stopping.best_weights = [best_weights[f'arr_{i}'] for i in range(len(best_weights))]
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.save_freq == 0:
+            self._save(epoch + 1)
+
+    def on_train_end(self, logs=None):
+        if self.model.stop_training:
+            self._save(self.params['epochs'])
+
+    def _save(self, epoch):
+        self.epoch.assign(epoch)
+        self.manager.save(checkpoint_number=epoch)
+        if self.early_stopping is None:
+            return
+        state = {'wait': self.early_stopping.wait, 'best': float(self.early_stopping.best),
+                 'best_epoch': self.early_stopping.best_epoch}
+        if self.early_stopping.wait == 0 and self.early_stopping.best_weights is not None:
+            np.savez(os.path.join(self.checkpoint_dir, 'best_weights.npz'), *self.early_stopping.best_weights)
+        state_path = os.path.join(self.checkpoint_dir, 'state.json')
+        with open(f'{state_path}.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(f'{state_path}.tmp', state_path)
+
+
+def plot_history(history, path='history.png'):
+    """Function that plots model's training and validation accuracy and loss and saves the plot to a file.
+
+    The plot is drawn without pyplot, so no display is needed.
 
     Parameters
     ----------
     history: keras.callbacks.History
-        Model's history.
+        Model's history, or its history dictionary.
+    path: str
+        Path of the saved image.
 
     Returns
     -------
     None
     """
+    history = getattr(history, 'history', history)
 
-    plt.figure(figsize=(12, 4))
-    plt.subplot(1, 2, 1)
-    plt.plot(history.history['accuracy'])
-    plt.plot(history.history['val_accuracy'])
-    plt.title('Model accuracy')
-    plt.ylabel('Accuracy')
-    plt.xlabel('Epoch')
-    plt.legend(['Train', 'Validation'], loc='upper left')
+    figure = Figure(figsize=(12, 4))
+    for position, (metric, title) in enumerate([('accuracy', 'Model accuracy'), ('loss', 'Model loss')], start=1):
+        axes = figure.add_subplot(1, 2, position)
+        axes.plot(history[metric])
+        axes.plot(history[f'val_{metric}'])
+        axes.set_title(title)
+        axes.set_ylabel(title.split()[1].capitalize())
+        axes.set_xlabel('Epoch')
+        axes.legend(['Train', 'Validation'], loc='upper left')
 
-    plt.subplot(1, 2, 2)
-    plt.plot(history.history['loss'])
-    plt.plot(history.history['val_loss'])
-    plt.title('Model loss')
-    plt.ylabel('Loss')
-    plt.xlabel('Epoch')
-    plt.legend(['Train', 'Validation'], loc='upper left')
-
-    plt.tight_layout()
-    plt.show()
+    figure.tight_layout()
+    figure.savefig(path)
 
 
 def make_train_and_test_dirs(images_dir, test_split=0.2):
     """Utility function for creating train and test directories from a directory containing images.
 
+    Deprecated: files are moved permanently and randomly, use split_manifest.write_manifest, which writes a
+    reproducible split without moving any file, instead.
+
     Parameters
     ----------
     images_dir: str
@@ -136,6 +947,8 @@ def make_train_and_test_dirs(images_dir, test_split=0.2):
     -------
     None
     """
+    warnings.warn("make_train_and_test_dirs is deprecated, use split_manifest.write_manifest instead",
+                  DeprecationWarning, stacklevel=2)
 
     test_dir = os.path.join(images_dir, 'test')
     os.makedirs(test_dir, exist_ok=True)
@@ -181,6 +994,28 @@ def make_train_and_test_dirs(images_dir, test_split=0.2):
 
 
 
+def make_step_decay(initial_lrate=0.001, drop=0.5, epochs_drop=15):
+    """Function that creates a step decay function for learning rate scheduling with the given constants.
+
+    Parameters
+    ----------
+    initial_lrate: float
+        Learning rate of the first epochs.
+    drop: float
+        Factor the learning rate is multiplied by every epochs_drop epochs.
+    epochs_drop: int
+        Number of epochs between drops.
+
+    Returns
+    -------
+    schedule: callable
+        Function mapping the number of an epoch to its learning rate.
+    """
+    def schedule(epoch, lr=None):
+        return float(initial_lrate * np.power(drop, np.floor((1 + epoch) / epochs_drop)))
+    return schedule
+
+
 def step_decay(epoch):
     """Step decay function for learning rate scheduling in chest_ct_classifier.py.
 
@@ -194,8 +1029,4 @@ def step_decay(epoch):
     lrate: float
         Learning rate to be applied to the model.
     """
-    initial_lrate = 0.001
-    drop = 0.5
-    epochs_drop = 15
-    lrate = initial_lrate * np.power(drop, np.floor((1 + epoch) / epochs_drop))
-    return lrate
+    return make_step_decay()(epoch)